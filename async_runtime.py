@@ -0,0 +1,139 @@
+'''
+asyncio runtime of the headless controller (none_gui_main.py --asyncio).
+
+Sensing, logging, pump edges and shutdown run as coroutines on one event
+loop. Blocking I2C and GPIO calls go to a small thread pool
+(settings.ASYNC_WORKERS); the only other thread is the log writer. The
+program exits as soon as the last pump edge has run.
+'''
+import asyncio
+import signal
+import time
+from concurrent.futures import ThreadPoolExecutor
+import settings
+from scheduler import EdgeQueue
+from loopthread import LoopStats
+
+class AsyncTaskScheduler(EdgeQueue):
+    '''Runs the pump edges of an EdgeQueue from a coroutine, calling them in the executor.'''
+    def __init__(self, executor, onResult=None):
+        EdgeQueue.__init__(self)
+        self.executor   = executor
+        self.onResult   = onResult
+        self._loop      = None
+        self._wake      = None
+        self._idle      = None
+        self._task      = None
+
+    def _notify(self):
+        # Edges may be added or cancelled from other threads.
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._wake.set)
+
+    def start(self):
+        self._loop  = asyncio.get_running_loop()
+        self._wake  = asyncio.Event()
+        self._idle  = asyncio.Event()
+        self._task  = self._loop.create_task(self.run())
+
+    async def run(self):
+        while True:
+            self._wake.clear()
+            if self.pending_count() == 0:
+                self._idle.set()
+            execTime = self.next_time()
+            if execTime is None:
+                await self._wake.wait()
+                continue
+            delay = execTime - time.time()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._wake.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            edge = self.pop_due()
+            if edge is None:
+                continue
+            func, args = edge
+            try:
+                result = await self._loop.run_in_executor(self.executor, func, *args)
+                if self.onResult is not None:
+                    self.onResult(result)
+            except Exception as e:
+                print("[Scheduler] Error in {}: {}".format(func.__name__, e))
+
+    async def wait_idle(self):
+        '''Return once no edge is pending.'''
+        while self.pending_count() > 0:
+            self._idle.clear()
+            await self._idle.wait()
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+
+    def isStopped(self):
+        return self._task is None or self._task.done()
+
+
+async def run_every(interval, func, executor, name):
+    '''Call func every interval sec, aligned like LoopThread, in the executor if given.'''
+    loop = asyncio.get_running_loop()
+    stats = LoopStats(name, interval)
+    lastScheduled = 0
+    while True:
+        now = time.time()
+        scheduled = now + interval - now % interval
+        if scheduled <= lastScheduled:
+            scheduled += interval
+        await asyncio.sleep(scheduled - now)
+        fired = time.time()
+        if executor is not None:
+            await loop.run_in_executor(executor, func)
+        else:
+            func()
+        stats.record(scheduled, fired, time.time())
+        lastScheduled = scheduled
+
+
+async def run_main(main, log):
+    loop = asyncio.get_running_loop()
+    executor = ThreadPoolExecutor(max_workers=settings.ASYNC_WORKERS, thread_name_prefix="io")
+    stopEvent = asyncio.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stopEvent.set)
+
+    scheduler = AsyncTaskScheduler(executor, onResult=lambda result: log(str(result)))
+    scheduler.start()
+    loops = []
+    try:
+        main.run(scheduler=scheduler, startThreads=False)
+        if main.haveSensor and main.setLogging:
+            sensorHandler = main.sensorHandler
+            loops.append(loop.create_task(
+                run_every(settings.SENSOR_SEC, sensorHandler.read_sensor, executor, "sensor")))
+            if sensorHandler.logWriter is not None:
+                loops.append(loop.create_task(
+                    run_every(sensorHandler.outputEvery, sensorHandler.record_csv, None, "logging")))
+        if settings.TASK_RELOAD_SEC > 0:
+            loops.append(loop.create_task(
+                run_every(settings.TASK_RELOAD_SEC, main.check_task_file, executor, "reload")))
+
+        idle = loop.create_task(scheduler.wait_idle())
+        stop = loop.create_task(stopEvent.wait())
+        await asyncio.wait([idle, stop], return_when=asyncio.FIRST_COMPLETED)
+        if idle.done():
+            log("[Main  ] No task to run.")
+        for task in (idle, stop):
+            task.cancel()
+    finally:
+        log("[Main  ] Exiting the program.")
+        for task in loops:
+            task.cancel()
+        scheduler.stop()
+        await loop.run_in_executor(executor, main.stop)
+        executor.shutdown()
+
+def run_async(main, log=print):
+    asyncio.run(run_main(main, log))
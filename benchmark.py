@@ -0,0 +1,155 @@
+'''
+Benchmarks of the scheduler, sampling pipeline and headless startup on the
+simulated hardware.
+
+    $ python3 benchmark.py [--seconds 5] [--adcs 4] [--samples 100000] [--edges 2000] [--startups 5]
+'''
+import argparse
+import datetime
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import settings
+from hardware import set_backend
+
+def bench_sensor(mode, seconds):
+    from fs1012 import FS1012
+    from flowbuffer import create_flow_buffer
+    sensor = FS1012(settings.CAL_PARAMS, mode=mode)
+    flowBuffer = create_flow_buffer()
+    count = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        sample = sensor.snapshot(maxAge=0)
+        flowBuffer.append(sample.time, sample.tp1, sample.tp2, sample.flowRate)
+        count += 1
+    elapsed = time.perf_counter() - start
+    print("[Sensor   ] {:<12} {:>8.1f} samples/s, {:>7.3f} ms/sample"
+        .format(mode, count/elapsed, elapsed/count*1000))
+
+def bench_bus(adcs, seconds):
+    '''
+    Readings per second of one FS1012 (single mode) on each of 1..adcs
+    ADS1115s, converting one input after another and with SensorBus.
+    '''
+    from fs1012 import FS1012
+    from sensorbus import SensorBus
+    for count in range(1, adcs + 1):
+        addresses = [0x48 + index for index in range(count)]
+        settings.FLOW_SENSORS = [{"name": str(index + 1), "address": address, "tp1": 0, "tp2": 1}
+                                 for index, address in enumerate(addresses)]
+        sensors = [FS1012(settings.CAL_PARAMS, mode="single", address=address) for address in addresses]
+
+        def serial():
+            for sensor in sensors:
+                for key, pin, negativePin in sensor.conversions():
+                    sensor.ads1115.start_conversion(pin, negativePin)
+                    sensor.set_code(key, sensor.ads1115.read_conversion())
+
+        for name, read in (("serial", serial), ("bus", SensorBus(sensors).read)):
+            readings = 0
+            start = time.perf_counter()
+            while time.perf_counter() - start < seconds:
+                read()
+                readings += 1
+            elapsed = time.perf_counter() - start
+            print("[Bus      ] {} ADS1115 {:<7} {:>8.1f} readings/s, {:>8.1f} sensor samples/s, {:>7.3f} ms/reading"
+                .format(count, name, readings/elapsed, readings*count/elapsed, elapsed/readings*1000))
+
+def bench_filters(samples):
+    '''
+    Cost per reading and noise left by each filter of filters.py, on a
+    constant flow with gaussian noise and a spike every 50 readings.
+    '''
+    import random
+    from filters import create_filters
+    rng = random.Random(1)
+    readings = [(i*settings.SENSOR_SEC, 50 + rng.gauss(0, 1) + (20 if i % 50 == 0 else 0)) for i in range(samples)]
+    for spec in ([("boxcar", {"n": 8})], [("median", {"n": 5})], [("ema", {"tau": 1.0})],
+                 [("kalman", {"q": 0.01, "r": 1.0})], [("median", {"n": 3}), ("ema", {"tau": 1.0})]):
+        chain = create_filters(spec)
+        start = time.perf_counter()
+        filtered = [chain.update(value, timeStamp) for timeStamp, value in readings]
+        elapsed = time.perf_counter() - start
+        # Skip the settling of the slow filters.
+        noise = statistics.pstdev(filtered[samples//10:])
+        print("[Filters  ] {:<14} {:>7.2f} us/reading, noise {:.3f} mlpm (raw {:.3f})"
+            .format("+".join(kind for kind, _ in spec), elapsed/samples*1e6, noise,
+                    statistics.pstdev(value for _, value in readings[samples//10:])))
+
+def bench_scheduler(edges):
+    from scheduler import TaskScheduler
+    lateness = []
+    def edge(execTime):
+        lateness.append(time.time() - execTime)
+
+    scheduler = TaskScheduler()
+    scheduler.start()
+    now = datetime.datetime.now()
+    start = time.perf_counter()
+    for i in range(edges):
+        execTimeObj = now + datetime.timedelta(seconds=1 + i/edges)
+        scheduler.add_edge(str(i//2), execTimeObj, edge, execTimeObj.timestamp())
+    addTime = time.perf_counter() - start
+    while scheduler.pending_count() > 0:
+        time.sleep(0.05)
+    scheduler.stop()
+    lateness.sort()
+    print("[Scheduler] {} edges: add {:.1f} us/edge, lateness median {:.2f} ms, max {:.2f} ms"
+        .format(edges, addTime/edges*1e6, lateness[len(lateness)//2]*1000, lateness[-1]*1000))
+
+def bench_startup(runs):
+    '''
+    Time from the process start of none_gui_main.py to its first scheduled
+    pump edge (its --profile-startup milestone), with the sensor and logging on.
+    '''
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "none_gui_main.py")
+    pattern = re.compile(r"First pump edges scheduled ([0-9.]+) ms after the (process|script) start")
+    times = []
+    with tempfile.TemporaryDirectory() as tmpDir:
+        startTime = datetime.datetime.now() + datetime.timedelta(minutes=10)
+        taskJson = os.path.join(tmpDir, "task.json")
+        with open(taskJson, "w") as file:
+            json.dump({"haveSensor": True, "flowRateLogging": True, "flowRateLoggingLocation": tmpDir,
+                       "pumpTasks": [{"startTime": startTime.strftime("%Y-%m-%d %H:%M:%S"), "duration": 1,
+                                      "durationUnit": "min", "pumpA": True, "pumpB": False}]}, file)
+        for _ in range(runs):
+            # The journal is written to the working directory, so run in tmpDir.
+            process = subprocess.Popen([sys.executable, script, taskJson, "--backend", "sim", "--profile-startup"],
+                                       cwd=tmpDir, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+            try:
+                for line in process.stdout:
+                    match = pattern.search(line)
+                    if match:
+                        times.append(float(match.group(1)))
+                        break
+            finally:
+                process.kill()
+                process.wait()
+    if not times:
+        print("[Startup  ] No startup time reported.")
+        return
+    print("[Startup  ] start to first pump edge: median {:.1f} ms, min {:.1f} ms, max {:.1f} ms over {} runs"
+        .format(statistics.median(times), min(times), max(times), len(times)))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seconds", type=float, default=5, help="Duration of each sensor benchmark.")
+    parser.add_argument("--adcs", type=int, default=4, help="Largest number of ADS1115s of the bus benchmark (1-4).")
+    parser.add_argument("--samples", type=int, default=100000, help="Readings of the filter benchmark.")
+    parser.add_argument("--edges", type=int, default=2000, help="Number of scheduler edges.")
+    parser.add_argument("--startups", type=int, default=5, help="Runs of the headless startup benchmark.")
+    args = parser.parse_args()
+    set_backend("sim")
+
+    bench_sensor("single", args.seconds)
+    bench_sensor("differential", args.seconds)
+    bench_bus(args.adcs, args.seconds)
+    bench_filters(args.samples)
+    bench_scheduler(args.edges)
+    bench_startup(args.startups)
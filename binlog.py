@@ -0,0 +1,116 @@
+'''
+Binary flow log
+
+Header (88 bytes, little endian):
+    magic       4s      b"FSLG"
+    version     H
+    recordSize  H
+    gain        d       ADC_GAIN when the file was written
+    nParams     I       number of calibration parameters (<= 8)
+    reserved    4x
+    calParams   8d      CAL_PARAMS (or those of CAL_FILE), zero padded
+
+Record (20 bytes):
+    time        d       unix time (sec)
+    tp1         h       ADC code of TP1
+    tp2         h       ADC code of TP2
+    diff        h       ADC code of TP2 - TP1
+    flow        f       flow rate (mlpm)
+    pumps       B       bit i: pump i of PUMP_CHANNELS running (GUI: bit 0 A, bit 1 B)
+    reserved    1x
+
+With several FLOW_SENSORS the codes are those of the first sensor and the
+flow is the total of the sensors.
+'''
+import argparse
+import os
+import struct
+import time
+import numpy as np
+import settings
+from calibration import code_to_volt, default_cal_params, resolve_cal_params
+from logwriter import LogWriter
+
+MAGIC           = b"FSLG"
+VERSION         = 1
+MAX_PARAMS      = 8
+HEADER_STRUCT   = struct.Struct("<4sHHdI4x{}d".format(MAX_PARAMS))
+RECORD_STRUCT   = struct.Struct("<dhhhfBx")
+RECORD_DTYPE    = np.dtype({
+    "names":    ["time", "tp1", "tp2", "diff", "flow", "pumps"],
+    "formats":  ["<f8", "<i2", "<i2", "<i2", "<f4", "u1"],
+    "offsets":  [0, 8, 10, 12, 14, 18],
+    "itemsize": RECORD_STRUCT.size,
+})
+HEADER_SIZE     = HEADER_STRUCT.size
+
+def pack_header(gain, calParams):
+    if len(calParams) > MAX_PARAMS:
+        raise ValueError("At most {} calibration parameters can be stored.".format(MAX_PARAMS))
+    params = list(calParams) + [0.0]*(MAX_PARAMS - len(calParams))
+    return HEADER_STRUCT.pack(MAGIC, VERSION, RECORD_STRUCT.size, gain, len(calParams), *params)
+
+def unpack_header(data):
+    magic, version, recordSize, gain, nParams, *params = HEADER_STRUCT.unpack(data[:HEADER_SIZE])
+    if magic != MAGIC:
+        raise ValueError("Not a binary flow log.")
+    if version != VERSION or recordSize != RECORD_STRUCT.size:
+        raise ValueError("Unsupported binary flow log version {}.".format(version))
+    return {"version": version, "gain": gain, "calParams": params[:nParams]}
+
+
+class BinaryLogWriter(LogWriter):
+    '''
+    LogWriter writing fixed-width binary records instead of csv rows.
+    Rows are (time, TP1, TP2, flow, (TP1 code, TP2 code, diff code), pump bits).
+    '''
+    extension   = ".bin"
+    mode        = "wb"
+
+    def __init__(self, logDir, gain=None, calParams=None, **kwargs):
+        self.gain       = settings.ADC_GAIN if gain is None else gain
+        self.calParams  = list(resolve_cal_params(default_cal_params() if calParams is None else calParams))
+        LogWriter.__init__(self, logDir, **kwargs)
+
+    def write_header(self):
+        self.file.write(pack_header(self.gain, self.calParams))
+
+    def format_rows(self, rows):
+        pack = RECORD_STRUCT.pack
+        return b"".join([pack(row[0], row[4][0], row[4][1], row[4][2], row[3], row[5]) for row in rows])
+
+
+def read_binlog(path):
+    '''
+    Memory-map a binary flow log. Returns (header, records) where records is
+    a read-only numpy structured array (RECORD_DTYPE) backed by the file.
+    A partly written last record is ignored.
+    '''
+    with open(path, "rb") as file:
+        header = unpack_header(file.read(HEADER_SIZE))
+    count = (os.path.getsize(path) - HEADER_SIZE)//RECORD_STRUCT.size
+    if count <= 0:
+        return header, np.empty(0, dtype=RECORD_DTYPE)
+    records = np.memmap(path, dtype=RECORD_DTYPE, mode="r", offset=HEADER_SIZE, shape=(count,))
+    return header, records
+
+def to_csv(path, csvPath=None):
+    '''Write a binary flow log in the csv layout of LogWriter. Returns the csv path.'''
+    header, records = read_binlog(path)
+    csvPath = csvPath or os.path.splitext(path)[0] + ".csv"
+    mV = code_to_volt(header["gain"])*1000
+    times = [time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(t)) for t in records["time"].tolist()]
+    with open(csvPath, "w") as file:
+        file.write("Time,TP1(mV),TP2(mV),Flow_Rate\n")
+        for t, tp1, tp2, flowRate in zip(times, (records["tp1"]*mV).tolist(),
+                                        (records["tp2"]*mV).tolist(), records["flow"].tolist()):
+            file.write("{},{:.2f},{:.2f},{:.2f}\n".format(t, tp1, tp2, flowRate))
+    return csvPath
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert binary flow logs to csv.")
+    parser.add_argument("binFiles", nargs="+", help="Binary flow log files (.bin).")
+    args = parser.parse_args()
+    for binFile in args.binFiles:
+        print("{} -> {}".format(binFile, to_csv(binFile)))
@@ -0,0 +1,204 @@
+'''
+Calibration of the flow sensor from reference flow measurements.
+
+    $ python3 calfit.py reference.csv flow_log_*.csv [--max-degree 3] [--settle 10] [--output FILE]
+
+reference.csv has one line per measurement with a reference flow meter
+(e.g. a soap bubble flow meter), taken while the flow log was recording:
+
+    start,end,flow
+    2026-10-18 09:30:00,2026-10-18 09:32:00,85.3
+
+start and end bound the measurement ("%Y-%m-%d %H:%M:%S") and flow is
+the reference flow rate (mlpm). The flow logs are the flow_log_*.csv or
+flow_log_*.bin files of the same period. TP2 - TP1 is averaged over the
+readings of each measurement, skipping the first --settle sec, and
+polynomials of degree 1 to --max-degree are fitted by least squares to
+the reference flows. The degree with the lowest residual standard error
+(which counts the extra parameters against the fit) is kept, a higher
+degree only if it lowers the error by more than DEGREE_GAIN.
+
+The fit is written to a calibration file (JSON, version
+calibration.CAL_FILE_VERSION) with the parameters in the order of
+CAL_PARAMS, the fit quality and the measurements. Set CAL_FILE (or
+"calParams" of a sensor of FLOW_SENSORS) to its path to use it.
+
+The csv logs only have TP1 and TP2 of the first sensor, refreshed every
+TP_REFRESH_SEC in differential mode; use binary logs (LOG_FORMAT) to
+calibrate a sensor in differential mode.
+'''
+import argparse
+import datetime
+import json
+import os
+import sys
+import numpy as np
+from calibration import CAL_FILE_VERSION, code_to_volt
+
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+# A higher degree is kept only if its residual standard error is lower by this fraction.
+DEGREE_GAIN = 0.05
+
+def read_reference(path):
+    '''[(start, end, flow)] of a reference csv file (unix times). Raises ValueError.'''
+    references = []
+    with open(path) as file:
+        for number, line in enumerate(file, 1):
+            fields = [field.strip() for field in line.split(",")]
+            if not line.strip() or line.lstrip().startswith("#"):
+                continue
+            try:
+                start, end = [datetime.datetime.strptime(field, TIME_FORMAT).timestamp() for field in fields[:2]]
+                flow = float(fields[2])
+            except (ValueError, IndexError):
+                if number == 1:
+                    continue                # Header
+                raise ValueError("{} line {}: expected start,end,flow".format(path, number))
+            if end <= start:
+                raise ValueError("{} line {}: the end is not after the start".format(path, number))
+            references.append((start, end, flow))
+    return references
+
+def read_log(path):
+    '''(times, TP2 - TP1 (V)) arrays of a csv or binary flow log.'''
+    if path.endswith(".bin"):
+        from binlog import read_binlog
+        header, records = read_binlog(path)
+        return (np.asarray(records["time"], dtype=np.float64),
+                records["diff"].astype(np.float64)*code_to_volt(header["gain"]))
+    times, tp1, tp2 = [], [], []
+    with open(path) as file:
+        next(file, None)                    # Header
+        for line in file:
+            fields = line.split(",", 3)
+            if len(fields) < 3:
+                continue
+            times.append(datetime.datetime.strptime(fields[0], TIME_FORMAT).timestamp())
+            tp1.append(float(fields[1]))
+            tp2.append(float(fields[2]))
+    return np.array(times, dtype=np.float64), (np.array(tp2) - np.array(tp1))/1000
+
+def segment_means(times, diffs, starts, ends):
+    '''Mean, standard deviation and count of diffs within each [start, end].'''
+    order = np.argsort(times, kind="stable")
+    times, diffs = times[order], diffs[order]
+    low = np.searchsorted(times, starts, side="left")
+    high = np.searchsorted(times, ends, side="right")
+    sums = np.concatenate(([0.0], np.cumsum(diffs)))
+    squares = np.concatenate(([0.0], np.cumsum(diffs*diffs)))
+    counts = high - low
+    with np.errstate(invalid="ignore", divide="ignore"):
+        means = (sums[high] - sums[low])/counts
+        stds = np.sqrt(np.maximum((squares[high] - squares[low])/counts - means*means, 0.0))
+    return means, stds, counts
+
+def fit_polynomials(x, y, maxDegree):
+    '''
+    Least-squares polynomials of degree 1 to maxDegree (at most len(x) - 2)
+    of y over x. Returns [(degree, parameters, residual std error, R^2,
+    RMS error, max |error|)].
+    '''
+    maxDegree = min(maxDegree, len(x) - 2)
+    vander = np.vander(x, maxDegree + 1)
+    total = np.sum((y - y.mean())**2)
+    fits = []
+    for degree in range(1, maxDegree + 1):
+        params = np.linalg.lstsq(vander[:, maxDegree - degree:], y, rcond=None)[0]
+        errors = np.polyval(params, x) - y
+        rss = float(np.dot(errors, errors))
+        fits.append((degree, params, np.sqrt(rss/(len(x) - degree - 1)), 1 - rss/total if total > 0 else 1.0,
+                     np.sqrt(rss/len(x)), float(np.max(np.abs(errors)))))
+    return fits
+
+def choose_fit(fits):
+    best = fits[0]
+    for fit in fits[1:]:
+        if fit[2] < best[2]*(1 - DEGREE_GAIN):
+            best = fit
+    return best
+
+def calibrate(references, logs, maxDegree=3, settle=0.0, sensor="1"):
+    '''Fit the reference flows to the logs. Returns (calibration dict, fits). Raises ValueError.'''
+    columns = [read_log(path) for path in logs]
+    times = np.concatenate([column[0] for column in columns])
+    diffs = np.concatenate([column[1] for column in columns])
+    starts = np.array([start for start, _, _ in references]) + settle
+    ends = np.array([end for _, end, _ in references])
+    flows = np.array([flow for _, _, flow in references])
+    means, stds, counts = segment_means(times, diffs, starts, ends)
+    points = []
+    for index, (start, end, flow) in enumerate(references):
+        if counts[index] < 2:
+            print("[Cal   ] {} - {}: {} log readings, skipping this measurement.".format(
+                datetime.datetime.fromtimestamp(start).strftime(TIME_FORMAT),
+                datetime.datetime.fromtimestamp(end).strftime(TIME_FORMAT), counts[index]))
+            continue
+        points.append(index)
+    if len(points) < 3:
+        raise ValueError("{} usable measurements, at least 3 are needed".format(len(points)))
+    x, y = means[points], flows[points]
+    fits = fit_polynomials(x, y, maxDegree)
+    degree, params, residualStd, r2, rmse, maxError = choose_fit(fits)
+    calibration = {
+        "version":      CAL_FILE_VERSION,
+        "sensor":       sensor,
+        "created":      datetime.datetime.now().strftime(TIME_FORMAT),
+        "calParams":    params.tolist(),
+        "degree":       degree,
+        "range":        [float(x.min()), float(x.max())],
+        "fit":          {"residualStd": residualStd, "r2": r2, "rmse": rmse, "maxError": maxError},
+        "degrees":      [{"degree": fit[0], "residualStd": fit[2], "r2": fit[3]} for fit in fits],
+        "points":       [{"start": datetime.datetime.fromtimestamp(references[i][0]).strftime(TIME_FORMAT),
+                          "end": datetime.datetime.fromtimestamp(references[i][1]).strftime(TIME_FORMAT),
+                          "flow": references[i][2], "diff": float(means[i]), "diffStd": float(stds[i]),
+                          "readings": int(counts[i]), "fitted": float(np.polyval(params, means[i]))}
+                         for i in points],
+        "logs":         [os.path.basename(path) for path in logs],
+    }
+    return calibration, fits
+
+def report(calibration, fits):
+    lines = ["[Cal   ] Degree  Residual std (mlpm)     R^2"]
+    for degree, _, residualStd, r2, _, _ in fits:
+        lines.append("[Cal   ] {:>6} {:>20.3f} {:>9.5f}{}".format(
+            degree, residualStd, r2, "  <-" if degree == calibration["degree"] else ""))
+    lines.append("[Cal   ] {:>19} {:>10} {:>10} {:>8} {:>8}".format("Start", "TP2-TP1 mV", "Reference", "Fitted", "Error"))
+    for point in calibration["points"]:
+        lines.append("[Cal   ] {:>19} {:>10.3f} {:>10.2f} {:>8.2f} {:>+8.2f}".format(
+            point["start"], point["diff"]*1000, point["flow"], point["fitted"], point["fitted"] - point["flow"]))
+    fit = calibration["fit"]
+    lines.append("[Cal   ] CAL_PARAMS = {}".format(calibration["calParams"]))
+    lines.append("[Cal   ] RMS error {:.3f} mlpm, max error {:.3f} mlpm, R^2 {:.5f} over TP2 - TP1 {:.3f} to {:.3f} mV."
+                 .format(fit["rmse"], fit["maxError"], fit["r2"], calibration["range"][0]*1000, calibration["range"][1]*1000))
+    low, high = calibration["range"]
+    slopes = np.polyval(np.polyder(calibration["calParams"]), np.linspace(low, high, 200))
+    if np.any(slopes <= 0):
+        lines.append("[Cal   ] Warning: the flow rate does not rise with TP2 - TP1 over the whole range.")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fit the flow calibration to reference flow measurements.")
+    parser.add_argument("reference", help="csv file of start,end,flow (mlpm) reference measurements.")
+    parser.add_argument("logs", nargs="+", help="Flow logs (.csv or .bin) covering the measurements.")
+    parser.add_argument("--max-degree", type=int, default=3, help="Highest polynomial degree tried (default 3).")
+    parser.add_argument("--settle", type=float, default=0.0,
+                        help="Skip the first n sec of each measurement while the flow settles.")
+    parser.add_argument("--sensor", default="1", help="Name of the sensor, recorded in the file.")
+    parser.add_argument("--output", default=None,
+                        help="Calibration file (default: calibration_<sensor>_<date>.json).")
+    args = parser.parse_args()
+    if args.max_degree < 1:
+        parser.error("--max-degree must be at least 1")
+
+    try:
+        calibration, fits = calibrate(read_reference(args.reference), args.logs, args.max_degree,
+                                      args.settle, args.sensor)
+    except (OSError, ValueError) as e:
+        print("[Cal   ] {}".format(e))
+        sys.exit(1)
+    print(report(calibration, fits))
+    output = args.output or "calibration_{}_{}.json".format(args.sensor, datetime.datetime.now().strftime("%Y%m%d_%H-%M-%S"))
+    with open(output, "w") as file:
+        json.dump(calibration, file, indent=4)
+    print("[Cal   ] Written to {}. Set CAL_FILE = \"{}\" in settings.py to use it.".format(output, output))
@@ -0,0 +1,152 @@
+import json
+import os
+import settings
+
+# Full scale range (V) of the ADS1115 for each gain.
+PGA_RANGE = {
+    2/3:    6.144,
+    1:      4.096,
+    2:      2.048,
+    4:      1.024,
+    8:      0.512,
+    16:     0.256,
+}
+CODE_MIN    = -32768
+CODE_MAX    = 32767
+
+# Version of the calibration files written by calfit.py.
+CAL_FILE_VERSION    = 1
+
+_calFiles   = {}        # path -> ((mtime, size), calibration dict)
+
+def code_to_volt(gain):
+    '''Volts per ADC code, the same scaling as AnalogIn.voltage.'''
+    return PGA_RANGE[gain]/32767
+
+def load_calibration(path):
+    '''
+    Calibration dict of a file written by calfit.py. The file is read once
+    and again only when it changes. Raises ValueError.
+    '''
+    key = os.path.abspath(path)
+    try:
+        stat = os.stat(key)
+    except OSError as e:
+        raise ValueError("calibration file {}: {}".format(path, e.strerror))
+    cached = _calFiles.get(key)
+    if cached is not None and cached[0] == (stat.st_mtime_ns, stat.st_size):
+        return cached[1]
+    try:
+        with open(key) as file:
+            calibration = json.load(file)
+    except (OSError, ValueError) as e:
+        raise ValueError("calibration file {}: {}".format(path, e))
+    version = calibration.get("version") if isinstance(calibration, dict) else None
+    if not isinstance(version, int) or version > CAL_FILE_VERSION:
+        raise ValueError("calibration file {}: unsupported version {!r}".format(path, version))
+    calParams = calibration.get("calParams")
+    if (not isinstance(calParams, list) or not calParams
+            or not all(isinstance(p, (int, float)) and not isinstance(p, bool) for p in calParams)):
+        raise ValueError("calibration file {}: calParams is not a list of numbers".format(path))
+    _calFiles[key] = ((stat.st_mtime_ns, stat.st_size), calibration)
+    return calibration
+
+def resolve_cal_params(calParams):
+    '''Polynomial of calParams, a list of parameters or the path of a calibration file.'''
+    if isinstance(calParams, str):
+        return list(load_calibration(calParams)["calParams"])
+    return calParams
+
+def default_cal_params():
+    '''settings.CAL_FILE if it is set, else settings.CAL_PARAMS.'''
+    return settings.CAL_FILE or settings.CAL_PARAMS
+
+class FlowCalibration:
+    '''
+    Conversion from the ADC code of TP2 - TP1 to flow rate (mlpm).
+
+    The calibration polynomial is evaluated once for all 65536 codes and the
+    flow rate is looked up afterwards. calParams is a list or the path of a
+    calibration file (see calfit.py) and gain the ADS1115 gain; None uses
+    default_cal_params() / settings.ADC_GAIN. Both are resolved here, once.
+    A calibration file is read again by reload(), which poll() calls every
+    reloadSec (settings.CAL_RELOAD_SEC): the table is rebuilt when the
+    polynomial changed, and a file that cannot be read keeps the last good
+    table. numpy is imported with the first table, not with this module, to
+    keep it off the startup path.
+    '''
+    def __init__(self, calParams=None, gain=None, reloadSec=None):
+        self._source    = default_cal_params() if calParams is None else calParams
+        self._calParams = list(resolve_cal_params(self._source))
+        self._gain      = settings.ADC_GAIN if gain is None else gain
+        self._lsb       = code_to_volt(self._gain)
+        self._table     = None
+        self._reloadSec = settings.CAL_RELOAD_SEC if reloadSec is None else reloadSec
+        self._checkAt   = 0.0           # time.monotonic() of the next poll() check
+
+    @property
+    def cal_params(self):
+        return self._calParams
+
+    @property
+    def gain(self):
+        return self._gain
+
+    @property
+    def lsb(self):
+        return self._lsb
+
+    @property
+    def table(self):
+        if self._table is None:
+            self._build()
+        return self._table
+
+    def _build(self):
+        import numpy as np
+        codes = np.arange(CODE_MIN, CODE_MAX + 1, dtype=np.float64)
+        self._table = np.maximum(np.polyval(np.asarray(self._calParams, dtype=np.float64), codes*self._lsb), 0.0)
+
+    def reload(self):
+        '''
+        Read the calibration file again if it changed and rebuild the table
+        if its polynomial changed. Returns True when the polynomial changed.
+        '''
+        if not isinstance(self._source, str):
+            return False
+        try:
+            calParams = list(resolve_cal_params(self._source))
+        except ValueError as e:
+            print("[Cal   ] {}, keeping the last good calibration".format(e))
+            return False
+        if calParams == self._calParams:
+            return False
+        self._calParams = calParams
+        if self._table is not None:
+            self._build()
+        print("[Cal   ] Reloaded {}: {}".format(self._source, calParams))
+        return True
+
+    def poll(self, monotonic):
+        '''reload() at most every reloadSec (0 disables), for the sensor loop.'''
+        if not self._reloadSec or monotonic < self._checkAt or not isinstance(self._source, str):
+            return False
+        self._checkAt = monotonic + self._reloadSec
+        return self.reload()
+
+    def flow(self, code):
+        '''Flow rate of one TP2 - TP1 code.'''
+        code = CODE_MIN if code < CODE_MIN else CODE_MAX if code > CODE_MAX else code
+        return float(self.table[code - CODE_MIN])
+
+    def flow_codes(self, codes):
+        '''Flow rates of an array of TP2 - TP1 codes.'''
+        import numpy as np
+        codes = np.clip(np.asarray(codes, dtype=np.int32), CODE_MIN, CODE_MAX)
+        return self.table[codes - CODE_MIN]
+
+    def flow_voltages(self, diffs):
+        '''Flow rates of TP2 - TP1 voltages (V), for logs without ADC codes.'''
+        import numpy as np
+        diffs = np.asarray(diffs, dtype=np.float64)
+        return np.maximum(np.polyval(np.asarray(self._calParams, dtype=np.float64), diffs), 0.0)
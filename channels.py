@@ -0,0 +1,62 @@
+'''
+Pump channels and flow sensors of the headless controller, read from
+settings.PUMP_CHANNELS and settings.FLOW_SENSORS and checked once.
+'''
+import settings
+from calibration import default_cal_params
+
+# Input pairs the ADS1115 can convert differentially (positive, negative).
+DIFF_PAIRS = ((0, 1), (0, 3), (1, 3), (2, 3))
+
+def pump_channels():
+    '''[(name, in1 pin, in2 pin)] of settings.PUMP_CHANNELS. Raises ValueError.'''
+    channels = []
+    for channel in settings.PUMP_CHANNELS:
+        name = str(channel["name"])
+        if len(name) != 1 or not name.isalnum():
+            raise ValueError("pump name {!r} is not one letter or digit".format(name))
+        if name in [other[0] for other in channels]:
+            raise ValueError("pump {} is defined twice".format(name))
+        channels.append((name, channel["in1"], channel["in2"]))
+    if not channels:
+        raise ValueError("no pump channel")
+    return channels
+
+def pump_names():
+    return [name for name, _, _ in pump_channels()]
+
+def sensor_configs():
+    '''Copies of the settings.FLOW_SENSORS dicts with the defaults filled in. Raises ValueError.'''
+    names = pump_names()
+    configs = []
+    for index, sensor in enumerate(settings.FLOW_SENSORS):
+        config = {
+            "name":         str(sensor.get("name", index + 1)),
+            "address":      sensor.get("address", settings.ADC_ADDR),
+            "tp1":          sensor.get("tp1", 0),
+            "tp2":          sensor.get("tp2", 1),
+            "calParams":    sensor.get("calParams") or default_cal_params(),
+            "pumps":        sensor.get("pumps"),
+        }
+        for key in ("tp1", "tp2"):
+            if config[key] not in (0, 1, 2, 3):
+                raise ValueError("sensor {}: {} must be an ADS1115 input 0-3".format(config["name"], key))
+        if config["tp1"] == config["tp2"]:
+            raise ValueError("sensor {}: tp1 and tp2 are the same input".format(config["name"]))
+        if any((other["address"], pin) in [(config["address"], config["tp1"]), (config["address"], config["tp2"])]
+               for other in configs for pin in (other["tp1"], other["tp2"])):
+            raise ValueError("sensor {}: input already used by another sensor".format(config["name"]))
+        if config["pumps"] is not None:
+            config["pumps"] = [str(pump) for pump in config["pumps"]]
+            unknown = [pump for pump in config["pumps"] if pump not in names]
+            if unknown:
+                raise ValueError("sensor {}: unknown pump {}".format(config["name"], ",".join(unknown)))
+        configs.append(config)
+    if not configs:
+        raise ValueError("no flow sensor")
+    return configs
+
+def pump_sensors(pumps):
+    '''Indices of the flow sensors measuring any of pumps ("A", "B", ...).'''
+    return [index for index, config in enumerate(sensor_configs())
+            if config["pumps"] is None or set(config["pumps"]) & set(pumps)]
@@ -0,0 +1,148 @@
+import tkinter as tk
+from tkinter.constants import NW, NE, W
+import time, datetime
+import numpy as np
+import settings
+
+def minmax_buckets(times, values, t0, t1, nBuckets):
+    '''
+    Reduce the samples in [t0, t1] to the min and max of each of nBuckets
+    equal time buckets. Returns (bucket index, min, max) arrays, so the
+    drawing cost depends on nBuckets and not on the number of samples.
+    '''
+    keep = (times >= t0) & (times <= t1)
+    times, values = times[keep], values[keep]
+    if len(times) == 0:
+        return np.empty(0, dtype=int), np.empty(0), np.empty(0)
+    index = ((times - t0)*(nBuckets/(t1 - t0))).astype(int).clip(0, nBuckets - 1)
+    # Samples are in time order, so each bucket is one contiguous run.
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(index)) + 1))
+    return index[starts], np.minimum.reduceat(values, starts), np.maximum.reduceat(values, starts)
+
+
+class FlowChart(tk.Canvas):
+    '''
+    Live flow-rate plot of a FlowBuffer. The line is one canvas item whose
+    coordinates are replaced on every refresh, drawn from min/max buckets
+    (one per pixel column). Pump task windows from taskSource() (the
+    pumpTasks values of MotorFrame) are shaded behind the line.
+    '''
+    MARGIN_LEFT     = 45
+    MARGIN_RIGHT    = 10
+    MARGIN_TOP      = 10
+    MARGIN_BOTTOM   = 20
+    TASK_COLORS     = {"pumpA": settings.GREEN, "pumpB": settings.ORANGE}
+
+    def __init__(self, master, flowBuffer, taskSource=None, spanSec=None,
+                 width=settings.CHART_WIDTH, height=settings.CHART_HEIGHT):
+        super().__init__(master, width=width, height=height, bg=settings.BG_COLOR,
+                         borderwidth=0, highlightthickness=0)
+        self.flowBuffer = flowBuffer
+        self.taskSource = taskSource
+        self.spanSec    = spanSec or settings.CHART_SPAN_SEC
+        self.plotWidth  = width - self.MARGIN_LEFT - self.MARGIN_RIGHT
+        self.plotHeight = height - self.MARGIN_TOP - self.MARGIN_BOTTOM
+        self.interval   = int(1000/settings.CHART_FPS)
+        self.afterId    = None
+
+        x0, y0 = self.MARGIN_LEFT, self.MARGIN_TOP
+        x1, y1 = x0 + self.plotWidth, y0 + self.plotHeight
+        self.create_rectangle(x0, y0, x1, y1, outline=settings.COMMENT)
+        self.yMax_lb    = self.create_text(x0 - 4, y0, anchor=NE, fill=settings.FG_COLOR, text="")
+        self.create_text(x0 - 4, y1, anchor=NE, fill=settings.FG_COLOR, text="0")
+        self.span_lb    = self.create_text(x0, y1 + 4, anchor=NW, fill=settings.FG_COLOR, text="")
+        self.now_lb     = self.create_text(x1, y1 + 4, anchor=NE, fill=settings.FG_COLOR, text="")
+        self.line       = self.create_line(x0, y1, x0, y1, fill=settings.PINK)
+
+    def start(self):
+        self.refresh()
+
+    def stop(self):
+        if self.afterId is not None:
+            self.after_cancel(self.afterId)
+            self.afterId = None
+
+    def set_span(self, spanSec):
+        self.spanSec = spanSec
+        self.draw()
+
+    def refresh(self):
+        self.draw()
+        self.afterId = self.after(self.interval, self.refresh)
+
+    def draw(self):
+        t1 = time.time()
+        t0 = t1 - self.spanSec
+        n = int(self.spanSec/settings.SENSOR_SEC) + 1
+        times, flows = [np.frombuffer(column) for column in self.flowBuffer.last_columns(n, ("time", "flow"))]
+        buckets, mins, maxs = minmax_buckets(times, flows, t0, t1, self.plotWidth)
+
+        yMax = max(10.0, float(maxs.max())*1.1) if len(maxs) else 10.0
+        yScale = self.plotHeight/yMax
+        xBase = self.MARGIN_LEFT
+        yBase = self.MARGIN_TOP + self.plotHeight
+        self.itemconfig(self.yMax_lb, text="{:.0f}".format(yMax))
+        self.itemconfig(self.span_lb, text="-{:.0f} min".format(self.spanSec/60))
+        self.itemconfig(self.now_lb, text=datetime.datetime.fromtimestamp(t1).strftime("%H:%M:%S"))
+
+        self.draw_tasks(t0, t1)
+        if len(buckets) == 0:
+            self.coords(self.line, xBase, yBase, xBase, yBase)
+            return
+        coords = np.empty((len(buckets), 4))
+        coords[:, 0] = coords[:, 2] = xBase + buckets
+        coords[:, 1] = yBase - mins*yScale
+        coords[:, 3] = yBase - maxs*yScale
+        points = coords.ravel().tolist()
+        if len(points) == 4:
+            points += points[-2:]
+        self.coords(self.line, *points)
+
+    def draw_tasks(self, t0, t1):
+        self.delete("task")
+        if self.taskSource is None:
+            return
+        xScale = self.plotWidth/(t1 - t0)
+        y0 = self.MARGIN_TOP
+        y1 = y0 + self.plotHeight
+        for task in list(self.taskSource()):
+            start = task["startTime"].timestamp()
+            stop = task["stopTime"].timestamp()
+            if stop < t0 or start > t1:
+                continue
+            xStart = self.MARGIN_LEFT + (max(start, t0) - t0)*xScale
+            xStop = self.MARGIN_LEFT + (min(stop, t1) - t0)*xScale
+            for row, pump in enumerate(("pumpA", "pumpB")):
+                if task.get(pump):
+                    color = self.TASK_COLORS[pump]
+                    self.create_rectangle(xStart, y0 + 2 + row*6, xStop, y0 + 6 + row*6,
+                                          fill=color, outline="", tags="task")
+                    for edge, x in ((start, xStart), (stop, xStop)):
+                        if t0 <= edge <= t1:
+                            self.create_line(x, y0, x, y1, fill=color, dash=(2, 4), tags="task")
+        self.tag_lower("task", self.line)
+
+
+class FlowChartWindow(tk.Toplevel):
+    '''Toplevel window holding a FlowChart and its time span buttons.'''
+    SPANS = [("1 min", 60), ("10 min", 600), ("1 hr", 3600)]
+
+    def __init__(self, master, flowBuffer, taskSource=None):
+        super().__init__(master)
+        self.title("Flow Rate")
+        self.configure(bg=settings.BG_COLOR)
+        self.resizable(False, False)
+        self.chart = FlowChart(self, flowBuffer, taskSource)
+        self.chart.pack(padx=10, pady=(10, 0))
+        buttons = tk.Frame(self, bg=settings.BG_COLOR)
+        buttons.pack(anchor=W, padx=10, pady=10)
+        for text, spanSec in self.SPANS:
+            if spanSec <= settings.BUFFER_SEC:
+                tk.Button(buttons, text=text, bg=settings.FG_COLOR, fg=settings.BG_COLOR, bd=0, width=6,
+                          command=lambda spanSec=spanSec: self.chart.set_span(spanSec)).pack(side=tk.LEFT, padx=(0, 5))
+        self.protocol('WM_DELETE_WINDOW', self.close)
+        self.chart.start()
+
+    def close(self):
+        self.chart.stop()
+        self.destroy()
@@ -0,0 +1,142 @@
+'''
+Digital filters of the flow rate readings (settings.FLOW_FILTERS).
+
+Each filter takes one reading at a time, update(value, timeStamp), and
+returns the filtered value, keeping only what the next reading needs:
+
+    boxcar  n       Mean of the last n readings (running sum).
+    median  n       Median of the last n readings (sorted window), drops
+                    single spikes.
+    ema     tau     Exponential moving average with a time constant of
+                    tau sec, weighted by the time between readings.
+    kalman  q, r    Kalman filter of a flow that drifts as a random walk:
+                    q is the process noise (mlpm^2/sec) and r the
+                    measurement noise (mlpm^2) of one reading.
+
+A FilterChain runs them in the order of FLOW_FILTERS. boxcar and
+ema/kalman do a few operations per reading whatever n; median is O(n)
+per reading, a bisect plus the list shift of inserting into and deleting
+from its sorted n-long window. The ADC is not read more often, so the
+sensor loop keeps its timing; the ADS1115 itself averages over its
+conversion time, so a lower ADC_DATA_RATE is the oversampling stage
+before these.
+'''
+import bisect
+import math
+from collections import deque
+import settings
+
+class Boxcar:
+    def __init__(self, n):
+        self.n      = _count(n)
+        self.window = deque()
+        self.total  = 0.0
+        self._updates   = 0
+
+    def update(self, value, timeStamp):
+        self.window.append(value)
+        self.total += value
+        if len(self.window) > self.n:
+            self.total -= self.window.popleft()
+        self._updates += 1
+        if self._updates % 10000 == 0:
+            # Re-add now and then so the rounding errors do not pile up.
+            self.total = math.fsum(self.window)
+        return self.total/len(self.window)
+
+
+class Median:
+    def __init__(self, n):
+        self.n      = _count(n)
+        self.window = deque()
+        self.sorted = []
+
+    def update(self, value, timeStamp):
+        self.window.append(value)
+        bisect.insort(self.sorted, value)
+        if len(self.window) > self.n:
+            del self.sorted[bisect.bisect_left(self.sorted, self.window.popleft())]
+        size = len(self.sorted)
+        if size % 2:
+            return self.sorted[size//2]
+        return (self.sorted[size//2 - 1] + self.sorted[size//2])/2
+
+
+class EMA:
+    def __init__(self, tau):
+        if not tau > 0:
+            raise ValueError("ema: tau must be positive")
+        self.tau        = tau
+        self.value      = None
+        self.lastTime   = None
+
+    def update(self, value, timeStamp):
+        if self.value is None:
+            self.value = value
+        elif timeStamp > self.lastTime:
+            alpha = 1 - math.exp(-(timeStamp - self.lastTime)/self.tau)
+            self.value += alpha*(value - self.value)
+        self.lastTime = timeStamp
+        return self.value
+
+
+class Kalman:
+    def __init__(self, q, r):
+        if not (q > 0 and r > 0):
+            raise ValueError("kalman: q and r must be positive")
+        self.q          = q
+        self.r          = r
+        self.value      = None
+        self.variance   = None
+        self.lastTime   = None
+
+    def update(self, value, timeStamp):
+        if self.value is None:
+            self.value      = value
+            self.variance   = self.r
+        else:
+            self.variance += self.q*max(0.0, timeStamp - self.lastTime)
+            gain = self.variance/(self.variance + self.r)
+            self.value += gain*(value - self.value)
+            self.variance *= 1 - gain
+        self.lastTime = timeStamp
+        return self.value
+
+
+FILTERS = {"boxcar": Boxcar, "median": Median, "ema": EMA, "kalman": Kalman}
+
+def _count(n):
+    if isinstance(n, bool) or not isinstance(n, int) or n < 1:
+        raise ValueError("window must be a positive integer, not {!r}".format(n))
+    return n
+
+
+class FilterChain:
+    def __init__(self, filters):
+        self.filters = filters
+
+    def update(self, value, timeStamp):
+        for stage in self.filters:
+            value = stage.update(value, timeStamp)
+        return value
+
+
+def create_filters(spec=None):
+    '''
+    FilterChain of spec (default settings.FLOW_FILTERS), a list of
+    (kind, {parameters}), or None if it is empty. Raises ValueError.
+    '''
+    spec = settings.FLOW_FILTERS if spec is None else spec
+    if not spec:
+        return None
+    filters = []
+    for kind, params in spec:
+        cls = FILTERS.get(kind)
+        if cls is None:
+            raise ValueError("unknown filter {!r} (one of {})".format(kind, ", ".join(FILTERS)))
+        try:
+            filters.append(cls(**params))
+        except TypeError as e:
+            raise ValueError("{}: {}".format(kind, e))
+    return FilterChain(filters)
+
@@ -1,4 +1,3 @@
-from threading import Thread, Event
 import tkinter as tk
 from tkinter import filedialog
 import tkinter.messagebox as msg
@@ -7,63 +6,12 @@ import random
 import settings
 import time, datetime
 import os
-import board
-import busio
-from adafruit_ads1x15 import ads1115 as adafruit_ads1115
-from adafruit_ads1x15.analog_in import AnalogIn
-
-class FS1012:
-    '''
-    FS1012 Pinout
-    1   TP1+    Output  Analog
-    2   TP1-    Output  GND
-    3   HTR1    Input   3V/5V
-    4   HTR2    Input   GND
-    5   TP2-    Output  Analog
-    6   TP2+    Output  GND
-    '''
-    def __init__(self, calParams):
-        try:
-            self.i2c            = busio.I2C(board.SCL, board.SDA)
-            self.ads1115        = adafruit_ads1115.ADS1115(self.i2c, address=settings.ADC_ADDR)
-            self.ads1115.gain   = settings.ADC_GAIN
-            self.channels       = [adafruit_ads1115.P0, adafruit_ads1115.P1, adafruit_ads1115.P2, adafruit_ads1115.P3]
-            self.adschls        = [AnalogIn(self.ads1115, chl) for chl in self.channels] 
-            self._status        = True
-            self.error          = None
-        except Exception as e:
-            self._status        = False
-            self.error          = e
-
-        # TP1+, TP2+, calibration object for voltage-flow convertion
-        self._tp1       = 0
-        self._tp2       = 0
-        self._calParams = calParams     # quadratic
-        self._flowRate  = 0
-    
-    @property
-    def check_status(self):
-        return self._status
-
-    @property
-    def tp1_value(self):
-        self._tp1 = self.adschls[0].voltage if self._status else 0
-        return self._tp1
-
-    @property
-    def tp2_value(self):
-        self._tp2 = self.adschls[1].voltage if self._status else 0
-        return self._tp2
-    
-    @property
-    def flow_rate(self) -> float:
-        diff        = self._tp2 - self._tp1
-        tmp         = 0.0
-        paramsLen   = len(self._calParams)
-        for i in range(paramsLen):
-            tmp += self._calParams[i]*diff**(paramsLen-1-i)
-        self._flowRate = tmp if tmp > 0 else 0.0
-        return self._flowRate
+import queue
+from flowbuffer import create_flow_buffer
+from fs1012 import FS1012, test_sensor
+from calibration import default_cal_params
+from logwriter import create_log_writer, pump_bits
+from loopthread import LoopThread, loop_stats
 
 class FlowFrame(tk.Frame):
     def __init__(self, master, width, height, xOffset, yOffset):
@@ -78,18 +26,31 @@ class FlowFrame(tk.Frame):
 
         # Thread (Logging)
         self.isLogging = False
+        self.logDir = None
         self.loggingThread = None
-        self.csv = None
+        self.logWriter = None
         self.outputEvery = settings.OUTPUT_SEC
+        self.pumpState = None           # Callable returning {"A": bool, "B": bool}, logged in binary logs.
+        self.taskSource = None          # Callable returning the pump tasks shown on the chart.
+        self.chartWindow = None
+        self.onSample = None            # Callable(time.time(), mlpm) called with every sensor reading.
 
         # Thread (Sensor)
         # calParams = [88.28616669316914, -14.145696797096235]
-        calParams = settings.CAL_PARAMS
+        calParams = default_cal_params()
         self.flowSensor = FS1012(calParams)
         self.flowSensorTP1 = 0
         self.flowSensorTP2 = 0
         self.flowRate = 0
-        self.sensorThread = LoopThread(0.5, self.read_sensor)
+        self.rawFlowRate = 0            # Before FLOW_FILTERS
+        self.flowBuffer = create_flow_buffer()      # Every reading as a whole, read by the log and the chart
+        self.sensorThread = LoopThread(settings.SENSOR_SEC, self.read_sensor, name="sensor")
+
+        # GUI updates posted by the sensor thread, applied on the Tk thread
+        self.uiQueue = queue.Queue()
+        self.uiInterval = int(1000/settings.GUI_FPS)
+        self.uiAfterId = None
+        self.indicatorItems = {}
 
         # GUI
         self.panelTitle_lb = tk.Label(text="Flow Sensor", font="Helvetica 18 bold", 
@@ -125,6 +86,7 @@ class FlowFrame(tk.Frame):
         self.update_indicator(False)
         self.sensorThread.setDaemon(True)
         self.sensorThread.start()
+        self.uiAfterId = self.after(self.uiInterval, self.update_ui)
         print("[Sensor frame] The sensor reading starts.")
 
     def check_sensor(self):
@@ -132,7 +94,28 @@ class FlowFrame(tk.Frame):
         return self.flowSensor.check_status
 
     def draw_indicator(self, canvasName, color):
-        return canvasName.create_oval(2, 2, 18, 18, fill=color, outline="")
+        # Draw the oval once, then only change its color.
+        item = self.indicatorItems.get(canvasName)
+        if item is None:
+            item = canvasName.create_oval(2, 2, 18, 18, fill=color, outline="")
+            self.indicatorItems[canvasName] = item
+        elif canvasName.itemcget(item, "fill") != color:
+            canvasName.itemconfig(item, fill=color)
+        return item
+
+    def update_ui(self):
+        # Only the newest state matters, older ones are skipped.
+        state = None
+        try:
+            while True:
+                state = self.uiQueue.get_nowait()
+        except queue.Empty:
+            pass
+        if state is not None:
+            status, flowRate = state
+            self.update_indicator(status)
+            self.sensorFlowRateValue_lb.config(text="{:.2f}".format(flowRate) if status else "0")
+        self.uiAfterId = self.after(self.uiInterval, self.update_ui)
 
     def update_indicator(self, status):
         if status:
@@ -142,26 +125,45 @@ class FlowFrame(tk.Frame):
 
     def read_sensor(self):
         if self.check_sensor():
-            self.update_indicator(True)
-            self.flowSensorTP1 = self.flowSensor.tp1_value
-            self.flowSensorTP2 = self.flowSensor.tp2_value
-            self.flowRate = self.flowSensor.flow_rate       # Need to execute after updating tp1, tp2.
+            # TP1, TP2 and the flow rate of one reading (see FS1012.snapshot).
+            sample = self.flowSensor.snapshot()
+            self.flowSensorTP1 = sample.tp1
+            self.flowSensorTP2 = sample.tp2
+            self.flowRate = sample.flowRate
+            self.rawFlowRate = sample.rawFlowRate
+            timeStamp = sample.time
+            self.flowBuffer.append(timeStamp, self.flowSensorTP1, self.flowSensorTP2, self.flowRate, sample.codes,
+                                   self.rawFlowRate)
+            if self.onSample is not None:
+                self.onSample(timeStamp, self.flowRate)
             # self.flowSensorTP1 = random.randint(1,2000)     # Fake value
             # self.flowSensorTP2 = random.randint(1,2000)     # Fake value
-            self.sensorFlowRateValue_lb.config(text="{:.2f}".format(self.flowRate))
+            self.uiQueue.put((True, self.flowRate))
         else:
             self.flowSensorTP1 = 0
             self.flowSensorTP2 = 0
             self.flowRate = 0
-            self.update_indicator(False)
-            self.sensorFlowRateValue_lb.config(text="0")
+            self.rawFlowRate = 0
+            self.flowBuffer.append(time.time(), 0, 0, 0)
+            self.uiQueue.put((False, 0))
     
     def stop_read_sensor(self):
+        if self.uiAfterId is not None:
+            self.after_cancel(self.uiAfterId)
+            self.uiAfterId = None
         if self.sensorThread is not None and self.sensorThread.is_alive():
             self.sensorThread.stop()
+            self.sensorThread.join(1)
             print("[Sensor frame] The sensor reading stops.")
         return self.sensorThread.isStopped()
 
+    def show_chart(self):
+        if self.chartWindow is not None and self.chartWindow.winfo_exists():
+            self.chartWindow.lift()
+            return
+        from chart import FlowChartWindow
+        self.chartWindow = FlowChartWindow(self, self.flowBuffer, self.taskSource)
+
     def select_log_dir(self):
         if self.logFile_en.get() is None:
             dirPath = filedialog.askdirectory()
@@ -188,10 +190,9 @@ class FlowFrame(tk.Frame):
             return False
         else:
             try:
-                timeStamp = datetime.datetime.now().strftime("%Y%m%d_%H-%M-%S")
-                self.csv = open(self.logDir + "/flow_log_" + timeStamp + ".csv", "w")
-                self.write_csv_header()
-                self.loggingThread = LoopThread(self.outputEvery, self.record_csv)
+                self.logWriter = create_log_writer(self.logDir)
+                self.logWriter.start()
+                self.loggingThread = LoopThread(self.outputEvery, self.record_csv, name="logging")
                 self.loggingThread.setDaemon(True)
                 self.loggingThread.start()
                 print("[Sensor frame] The logging starts.")
@@ -203,64 +204,29 @@ class FlowFrame(tk.Frame):
     def stop_logging(self):
         if self.loggingThread is not None and self.loggingThread.is_alive():
             self.loggingThread.stop()
-            if self.csv is not None:
-                self.csv.close()
+            self.loggingThread.join(1)
+            if self.logWriter is not None:
+                self.logWriter.stop()
+                self.logWriter = None
             print("[Sensor frame] The logging stops.")
             return self.loggingThread.isStopped()
         else:
             return True
 
-    def write_csv_header(self):
-        self.csv.write("Time,TP1(mV),TP2(mV),Flow_Rate")
-        self.csv.seek(self.csv.tell() - 1, os.SEEK_SET)
-        self.csv.write("\n")
-
     def record_csv(self):
-        if time.localtime().tm_min%60 == 0 and time.localtime().tm_sec == 0:
-            timeStamp = datetime.datetime.now().strftime("%Y%m%d_%H-%M-%S")
-            self.csv = open(self.logDir + "/flow_log_" + timeStamp + ".csv", "w")
-            self.write_csv_header()
-        
-        self.csv.write(datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")+",")
-        self.csv.write("{:.2f},{:.2f},{:.2f}".format(self.flowSensorTP1*1000,self.flowSensorTP2*1000,self.flowRate))
-        self.csv.write("\n")
+        row = self.flowBuffer.latest()
+        if row is None:
+            return
+        pumps = pump_bits(self.pumpState()) if self.pumpState is not None else 0
+        self.logWriter.write((time.time(), row.tp1, row.tp2, row.flowRate, row.codes, pumps, (), row.rawFlowRate))
 
     def force_stop_threads(self):
+        if self.chartWindow is not None and self.chartWindow.winfo_exists():
+            self.chartWindow.close()
         self.stop_logging()
-        time.sleep(0.5)
         self.stop_read_sensor()
-        time.sleep(0.5)
-
-class LoopThread(Thread):
-    def __init__(self, interval, func, *args):
-        Thread.__init__(self)
-        self.event = Event()
-        self.interval = interval
-        self.func = func
-        self.args = args
-        
-    def run(self):
-        while not self.event.wait(self.interval - time.time() % self.interval):
-            self.func(*self.args)
-            if self.isStopped():
-                return
-            time.sleep(0.01)
-    
-    def stop(self):
-        self.event.set()
-    
-    def isStopped(self):
-        return self.event.is_set()
-
-
-def test_sensor():
-    calParams = settings.CAL_PARAMS
-    fs1012 = FS1012(calParams)
-    print(fs1012.check_status)
-
-    while True:
-        print("TP1: %.4f mV, TP2: %.4f mV, Flow rate: %.2f mlpm" %(fs1012.tp1_value*1000, fs1012.tp2_value*1000, fs1012.flow_rate))
-        time.sleep(1)
+        for stats in loop_stats().values():
+            print(stats.report())
 
 if __name__ == "__main__":
     try:
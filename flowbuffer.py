@@ -0,0 +1,187 @@
+from array import array
+from collections import namedtuple
+from threading import Lock
+import math
+import settings
+
+# One sample of the buffer. codes are the ADC codes (TP1, TP2, TP2 - TP1) of
+# the first sensor, flowRates the flow rate of each sensor.
+FlowRow = namedtuple("FlowRow", ["time", "tp1", "tp2", "flowRate", "codes", "flowRates", "rawFlowRate"])
+
+class RollingWindow:
+    '''
+    Running statistics over the last `size` samples of one column.
+
+    Sum and sum of squares are updated as samples enter and leave the window,
+    and min/max come from monotonic queues of sample indices stored in
+    preallocated arrays, so every push is O(1) (amortized) without creating
+    Python objects. The sums are recomputed once per window to avoid drift.
+    '''
+    def __init__(self, size):
+        self.size       = size
+        self._sum       = 0.0
+        self._sumSq     = 0.0
+        self._minQ      = array('q', bytes(8*size))
+        self._minHead   = 0
+        self._minTail   = 0
+        self._maxQ      = array('q', bytes(8*size))
+        self._maxHead   = 0
+        self._maxTail   = 0
+
+    def push(self, seq, values, capacity):
+        '''Add sample number seq, whose value is values[seq % capacity].'''
+        size    = self.size
+        value   = values[seq % capacity]
+        oldest  = seq - size
+        if seq % size == 0:
+            self._resync(seq, values, capacity)
+        else:
+            if oldest >= 0:
+                old = values[oldest % capacity]
+                self._sum   -= old
+                self._sumSq -= old*old
+            self._sum   += value
+            self._sumSq += value*value
+
+        minQ = self._minQ
+        if self._minHead < self._minTail and minQ[self._minHead % size] <= oldest:
+            self._minHead += 1
+        while self._minHead < self._minTail and values[minQ[(self._minTail - 1) % size] % capacity] >= value:
+            self._minTail -= 1
+        minQ[self._minTail % size] = seq
+        self._minTail += 1
+
+        maxQ = self._maxQ
+        if self._maxHead < self._maxTail and maxQ[self._maxHead % size] <= oldest:
+            self._maxHead += 1
+        while self._maxHead < self._maxTail and values[maxQ[(self._maxTail - 1) % size] % capacity] <= value:
+            self._maxTail -= 1
+        maxQ[self._maxTail % size] = seq
+        self._maxTail += 1
+
+    def stats(self, count, values, capacity):
+        '''Return (mean, min, max, std) of the last `count` samples.'''
+        count = min(count, self.size)
+        if count == 0:
+            return (0.0, 0.0, 0.0, 0.0)
+        mean    = self._sum/count
+        var     = self._sumSq/count - mean*mean
+        minVal  = values[self._minQ[self._minHead % self.size] % capacity]
+        maxVal  = values[self._maxQ[self._maxHead % self.size] % capacity]
+        return (mean, minVal, maxVal, math.sqrt(var) if var > 0 else 0.0)
+
+    def _resync(self, seq, values, capacity):
+        total   = 0.0
+        totalSq = 0.0
+        for i in range(max(0, seq - self.size + 1), seq + 1):
+            v = values[i % capacity]
+            total   += v
+            totalSq += v*v
+        self._sum   = total
+        self._sumSq = totalSq
+
+
+class FlowBuffer:
+    '''
+    Fixed-capacity ring buffer of the recent flow sensor samples.
+
+    Columns (time, TP1, TP2, flow, unfiltered flow) are preallocated float
+    arrays; the ADC codes (3 per sample) and the flow of each of `sensors`
+    sensors are interleaved in two more arrays. Rolling mean/min/max/std of
+    the flow rate are kept for every window size (in samples) given in
+    `windows`; each window must be shorter than the buffer.
+    '''
+    def __init__(self, capacity, windows=(), sensors=1):
+        self.capacity   = capacity
+        self.sensors    = sensors
+        self.time       = array('d', bytes(8*capacity))
+        self.tp1        = array('d', bytes(8*capacity))
+        self.tp2        = array('d', bytes(8*capacity))
+        self.flow       = array('d', bytes(8*capacity))
+        self.rawFlow    = array('d', bytes(8*capacity))
+        self.codes      = array('q', bytes(8*3*capacity))
+        self.sensorFlow = array('d', bytes(8*sensors*capacity))
+        self._count     = 0
+        self._lock      = Lock()
+        self._windows   = {}
+        for size in windows:
+            if not 0 < size < capacity:
+                raise ValueError("Window of {} samples does not fit in a buffer of {}.".format(size, capacity))
+            self._windows[size] = RollingWindow(size)
+
+    def __len__(self):
+        return min(self._count, self.capacity)
+
+    @property
+    def windows(self):
+        return sorted(self._windows)
+
+    def append(self, timeStamp, tp1, tp2, flow, codes=(0, 0, 0), rawFlow=None, flows=None):
+        '''
+        Add one sample. rawFlow defaults to flow, and flows (one per sensor)
+        to flow for a single sensor, else zeros.
+        '''
+        sensors = self.sensors
+        if flows is None:
+            flows = (flow,) if sensors == 1 else (0.0,)*sensors
+        with self._lock:
+            seq = self._count
+            i = seq % self.capacity
+            self.time[i]    = timeStamp
+            self.tp1[i]     = tp1
+            self.tp2[i]     = tp2
+            self.flow[i]    = flow
+            self.rawFlow[i] = flow if rawFlow is None else rawFlow
+            self.codes[3*i], self.codes[3*i + 1], self.codes[3*i + 2] = codes
+            for j, sensorFlow in enumerate(flows, sensors*i):
+                self.sensorFlow[j] = sensorFlow
+            for window in self._windows.values():
+                window.push(seq, self.flow, self.capacity)
+            self._count = seq + 1
+
+    def latest(self):
+        '''Return the newest sample as a FlowRow, or None if empty.'''
+        with self._lock:
+            if self._count == 0:
+                return None
+            i = (self._count - 1) % self.capacity
+            sensors = self.sensors
+            return FlowRow(self.time[i], self.tp1[i], self.tp2[i], self.flow[i], tuple(self.codes[3*i:3*i + 3]),
+                           tuple(self.sensorFlow[sensors*i:sensors*i + sensors]), self.rawFlow[i])
+
+    def stats(self, window):
+        '''Return (mean, min, max, std) of the flow rate over a configured window.'''
+        with self._lock:
+            return self._windows[window].stats(self._count, self.flow, self.capacity)
+
+    def all_stats(self):
+        '''Return {window: (mean, min, max, std)} of every configured window, taken together.'''
+        with self._lock:
+            return {size: window.stats(self._count, self.flow, self.capacity)
+                    for size, window in sorted(self._windows.items())}
+
+    def last(self, n, column="flow"):
+        '''Return a copy of the newest n values of a column, oldest first.'''
+        return self.last_columns(n, (column,))[0]
+
+    def last_columns(self, n, columns=("time", "flow")):
+        '''Return copies of the newest n values of several columns, taken together.'''
+        with self._lock:
+            n = min(n, self._count, self.capacity)
+            start = (self._count - n) % self.capacity
+            stop = start + n
+            result = []
+            for column in columns:
+                values = getattr(self, column)
+                if stop <= self.capacity:
+                    result.append(values[start:stop])
+                else:
+                    result.append(values[start:] + values[:stop - self.capacity])
+            return result
+
+
+def create_flow_buffer(sensors=1):
+    '''Build a FlowBuffer sized from BUFFER_SEC, STAT_WINDOWS_SEC and SENSOR_SEC.'''
+    capacity = int(settings.BUFFER_SEC/settings.SENSOR_SEC) + 1
+    windows = [max(1, int(sec/settings.SENSOR_SEC)) for sec in settings.STAT_WINDOWS_SEC]
+    return FlowBuffer(capacity, windows, sensors)
@@ -0,0 +1,168 @@
+'''
+Closed-loop flow control of the pumps.
+
+Tasks with a "targetFlow" (mlpm) drive their pumps with PWM instead of a
+constant HIGH. A flow sensor may measure several pumps, so one PID loop
+sets the same duty on every regulated pump, on the flow of the sensors
+of the controlling task (the total flow by default). The loop runs in
+the sensor reading (FlowHandler.onSample), so the duty follows each
+sample within one SENSOR_SEC period plus the I2C read time.
+'''
+import datetime
+from threading import Lock
+import settings
+from logwriter import LogWriter
+
+class PID:
+    '''
+    PID controller with the output clamped to [outMin, outMax]. The
+    derivative acts on the measurement (no kick on setpoint changes) and
+    the integral is frozen while the output is saturated (anti-windup).
+    '''
+    def __init__(self, kp, ki, kd, outMin, outMax):
+        self.kp     = kp
+        self.ki     = ki
+        self.kd     = kd
+        self.outMin = outMin
+        self.outMax = outMax
+        self.reset()
+
+    def reset(self, output=0.0):
+        '''Restart from the given output (feed-forward) with no history.'''
+        self.integral       = min(max(output, self.outMin), self.outMax)
+        self.lastMeasurement    = None
+
+    def update(self, setpoint, measurement, dt):
+        error = setpoint - measurement
+        derivative = 0.0
+        if self.lastMeasurement is not None and dt > 0:
+            derivative = -(measurement - self.lastMeasurement)/dt
+        self.lastMeasurement = measurement
+
+        integral = self.integral + self.ki*error*dt
+        output = self.kp*error + integral + self.kd*derivative
+        if output > self.outMax:
+            output = self.outMax
+            if error < 0:
+                self.integral = integral
+        elif output < self.outMin:
+            output = self.outMin
+            if error > 0:
+                self.integral = integral
+        else:
+            self.integral = integral
+        return output
+
+
+class ControlLogWriter(LogWriter):
+    '''Tracking log of the flow control: (time, target, flow, error, duty) rows.'''
+    prefix = "flow_control_"
+
+    def write_header(self):
+        self.file.write("Time,Target(mlpm),Flow_Rate(mlpm),Error(mlpm),Duty(%)\n")
+
+    def format_rows(self, rows):
+        return "".join("{},{:.2f},{:.2f},{:.2f},{:.1f}\n".format(
+            datetime.datetime.fromtimestamp(row[0]).strftime("%Y-%m-%d %H:%M:%S.%f")[:-3], *row[1:])
+            for row in rows)
+
+
+class _TaskTarget:
+    '''Target flow of one task, its pumps and sensors and its tracking error.'''
+    def __init__(self, target, pumps, sensors):
+        self.target     = target            # mlpm
+        self.pumps      = tuple(pumps)      # "A", "B", ...
+        self.n          = 0                 # Samples
+        self.sumSq      = 0.0               # Sum of the squared errors
+        self.maxError   = 0.0               # Max abs error
+        self.sensors    = sensors           # Sensor indices, or None for the total flow
+
+    def add(self, error):
+        self.n += 1
+        self.sumSq += error*error
+        self.maxError = max(self.maxError, abs(error))
+
+
+class FlowController:
+    '''
+    Regulates the pumps of the running tasks that have a target flow.
+    If several such tasks overlap, the one started last sets the target.
+    '''
+    def __init__(self, pumps):
+        self.pumps      = pumps             # MotorDriver
+        self.pid        = PID(settings.PID_KP, settings.PID_KI, settings.PID_KD,
+                              settings.PID_DUTY_MIN, settings.PID_DUTY_MAX)
+        self.logWriter  = None
+        self.targets    = {}                # taskId -> _TaskTarget
+        self.duty       = 0.0
+        self.lastTime   = None
+        self._lock      = Lock()
+
+    def feed_forward(self, target, pumpCount):
+        '''Duty (%) expected to give target with pumpCount pumps, within [PID_DUTY_MIN, PID_DUTY_MAX].'''
+        duty = 100.0*target/(settings.PUMP_FULL_FLOW*pumpCount)
+        return min(max(duty, settings.PID_DUTY_MIN), settings.PID_DUTY_MAX)
+
+    def start(self, taskId, target, pumps, sensors=None):
+        '''
+        Regulate pumps ("A", "B", ...) of taskId to target (mlpm), measured
+        on the sum of the sensor indices or on the total flow if None.
+        '''
+        with self._lock:
+            regulated = sorted(set(self._regulated_pumps()) | set(pumps))
+            duty = self.feed_forward(target, len(regulated))
+            # Register the task only once its pumps run, so a failed start leaves no target behind.
+            self._apply(regulated, duty)
+            self.duty = duty
+            self.targets[taskId] = _TaskTarget(target, pumps, sensors)
+            self.pid.reset(self.duty)
+            self.lastTime = None
+
+    def stop(self, taskId):
+        '''
+        Stop regulating taskId (its pumps are switched off by the caller).
+        Returns (samples, rms error, max abs error) of the task.
+        '''
+        with self._lock:
+            stats = self.targets.pop(taskId, None) or _TaskTarget(0, (), None)
+            if self.targets:
+                # The task started last now sets the target, on the pumps left.
+                regulated = self._regulated_pumps()
+                self.duty = self.feed_forward(next(reversed(self.targets.values())).target, len(regulated))
+                self.pid.reset(self.duty)
+                self.lastTime = None
+                self._apply(regulated)
+            return stats.n, (stats.sumSq/stats.n)**0.5 if stats.n else 0.0, stats.maxError
+
+    def update(self, timeStamp, flowRate, flowRates=None):
+        '''Called with every flow sample (time.time(), total mlpm, mlpm of each sensor).'''
+        with self._lock:
+            if not self.targets:
+                return
+            taskId = next(reversed(self.targets))
+            stats = self.targets[taskId]
+            target = stats.target
+            if stats.sensors is not None and flowRates is not None:
+                flowRate = sum(flowRates[index] for index in stats.sensors)
+            dt = settings.SENSOR_SEC
+            if self.lastTime is not None and 0 < timeStamp - self.lastTime < 5*settings.SENSOR_SEC:
+                dt = timeStamp - self.lastTime
+            self.lastTime = timeStamp
+            self.duty = self.pid.update(target, flowRate, dt)
+            self._apply(self._regulated_pumps())
+
+            error = target - flowRate
+            stats.add(error)
+            if self.logWriter is not None:
+                self.logWriter.write((timeStamp, target, flowRate, error, self.duty))
+
+    def _regulated_pumps(self):
+        pumps = set()
+        for target in self.targets.values():
+            pumps.update(target.pumps)
+        return sorted(pumps)
+
+    def _apply(self, pumps, duty=None):
+        duty = self.duty if duty is None else duty
+        for pump in pumps:
+            self.pumps.run_pwm(pump, duty)
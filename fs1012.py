@@ -0,0 +1,178 @@
+'''
+FS1012 flow sensor read through the ADS1115.
+
+Kept apart from the GUI (flow.py) so the headless controller does not
+import tkinter. numpy is only imported when the calibration table is
+built, in the constructor.
+
+FS1012.snapshot() returns one reading as an immutable FlowSample. The
+conversions of a reading are taken under the bus lock of the backend and
+the sample is kept for SNAPSHOT_MAX_AGE sec, so readers in other threads
+(the GUI, test_sensor, a diagnostics thread) share it instead of mixing
+their conversions into it or starting their own. The flow rate of a
+sample has been through the FLOW_FILTERS of the sensor (see filters.py),
+once per reading; the unfiltered one is kept next to it.
+'''
+import time
+from collections import namedtuple
+import settings
+from hardware import get_backend, P0, P1
+from calibration import FlowCalibration, default_cal_params
+from channels import DIFF_PAIRS
+from sensorbus import SensorBus
+from filters import create_filters
+
+# time:         time.time() of the reading
+# monotonic:    time.monotonic() of the reading, for its age
+# tp1, tp2:     TP1, TP2 (V)
+# codes:        ADC codes (TP1, TP2, TP2 - TP1)
+# flowRate:     mlpm after FLOW_FILTERS, 0 if the sensor was not found
+# rawFlowRate:  mlpm of this reading alone
+FlowSample = namedtuple("FlowSample", ["time", "monotonic", "tp1", "tp2", "codes", "flowRate", "rawFlowRate"])
+
+class FS1012:
+    '''
+    FS1012 Pinout
+    1   TP1+    Output  Analog
+    2   TP1-    Output  GND
+    3   HTR1    Input   3V/5V
+    4   HTR2    Input   GND
+    5   TP2-    Output  Analog
+    6   TP2+    Output  GND
+    '''
+    def __init__(self, calParams, mode=None, address=None, pins=None, name="1", filters=None):
+        # TP1 and TP2 on the inputs pins (default P0, P1) of the ADS1115 at address.
+        self._differential  = (mode or settings.ADC_MODE) == "differential"
+        self.name           = name
+        self.address        = settings.ADC_ADDR if address is None else address
+        self.pins           = (P0, P1) if pins is None else tuple(pins)
+        # The ADS1115 only converts the pairs of DIFF_PAIRS, lower input
+        # positive, so the sign gives TP2 - TP1 from either order.
+        self.diffPins       = tuple(sorted(self.pins))
+        self._diffSign      = -1 if self.pins[0] < self.pins[1] else 1
+        try:
+            if self._differential and self.diffPins not in DIFF_PAIRS:
+                raise ValueError("The ADS1115 cannot convert P{} - P{}.".format(*self.diffPins))
+            self.ads1115        = get_backend().ADS1115(self.address, settings.ADC_GAIN)
+            self.ads1115.dataRate   = settings.ADC_DATA_RATE
+            self._status        = True
+            self.error          = None
+        except Exception as e:
+            self._status        = False
+            self.error          = e
+
+        # TP1+, TP2+, TP2 - TP1 (V and ADC code) of the conversions in
+        # progress, calibration object for code-flow convertion
+        self._tp1       = 0
+        self._tp2       = 0
+        self._diff      = 0
+        self._tp1Code   = 0
+        self._tp2Code   = 0
+        self._diffCode  = 0
+        # Calibration polynomial (calParams: parameters or calibration file
+        # path), scaled with the gain the ADS1115 converts with.
+        self.calibration    = FlowCalibration(calParams, self.ads1115.gain if self._status else settings.ADC_GAIN)
+        self._calParams = self.calibration.cal_params
+        self.calibration.table          # Build the lookup table now, not at the first reading.
+        self._sample    = None          # Last FlowSample
+        # FilterChain of the flow rate (filters: spec like FLOW_FILTERS), or None
+        self.filters    = create_filters(filters)
+        self._bus       = SensorBus([self])
+
+    @property
+    def check_status(self):
+        return self._status
+
+    @property
+    def is_differential(self):
+        return self._differential
+
+    def snapshot(self, maxAge=None):
+        '''
+        The last FlowSample if it is at most maxAge (default
+        SNAPSHOT_MAX_AGE) sec old, else a new reading.
+        '''
+        return self._bus.snapshot(maxAge)[0]
+
+    @property
+    def sample(self):
+        # Last FlowSample without reading, or None
+        return self._sample
+
+    @property
+    def tp1_value(self):
+        return self.snapshot().tp1
+
+    @property
+    def tp2_value(self):
+        return self.snapshot().tp2
+
+    @property
+    def diff_value(self):
+        sample = self.snapshot()
+        return sample.codes[2]*self.calibration.lsb
+
+    @property
+    def flow_rate(self) -> float:
+        return self.snapshot().flowRate
+
+    @property
+    def raw_codes(self):
+        # TP1, TP2, TP2 - TP1 of the last reading
+        return self._sample.codes if self._sample is not None else (0, 0, 0)
+
+    def conversions(self, withTP=True):
+        '''
+        ADC conversions (key, pin, negative pin) of one reading, for
+        SensorBus. In differential mode TP1 and TP2 are only converted with
+        withTP, and TP2 - TP1 is converted last.
+        '''
+        if not self._status:
+            return []
+        tp = [("tp1", self.pins[0], None), ("tp2", self.pins[1], None)]
+        if not self._differential:
+            return tp
+        return (tp if withTP else []) + [("diff",) + self.diffPins]
+
+    def set_code(self, key, code):
+        '''Store the result of a conversion of conversions().'''
+        if key == "tp1":
+            self._tp1Code = code
+            self._tp1 = code*self.calibration.lsb
+        elif key == "tp2":
+            self._tp2Code = code
+            self._tp2 = code*self.calibration.lsb
+        else:
+            self._diffCode = self._diffSign*code
+            self._diff = self._diffCode*self.calibration.lsb
+
+    def store_sample(self, timeStamp, monotonic):
+        '''Make the FlowSample of the conversions set since the last one (called by SensorBus).'''
+        diffCode = self._diffCode if self._differential else self._tp2Code - self._tp1Code
+        diffCode = max(-32768, min(32767, diffCode))
+        self.calibration.poll(monotonic)
+        rawFlowRate = flowRate = self.calibration.flow(diffCode) if self._status else 0.0
+        if self._status and self.filters is not None:
+            flowRate = self.filters.update(rawFlowRate, timeStamp)
+        self._sample = FlowSample(timeStamp, monotonic, self._tp1, self._tp2,
+                                  (self._tp1Code, self._tp2Code, diffCode), flowRate, rawFlowRate)
+        return self._sample
+
+def test_sensor():
+    calParams = default_cal_params()
+    fs1012 = FS1012(calParams)
+    print(fs1012.check_status)
+
+    while True:
+        sample = fs1012.snapshot()
+        if fs1012.is_differential:
+            print("TP2-TP1: %.4f mV, Flow rate: %.2f mlpm" %(sample.codes[2]*fs1012.calibration.lsb*1000, sample.flowRate))
+        else:
+            print("TP1: %.4f mV, TP2: %.4f mV, Flow rate: %.2f mlpm" %(sample.tp1*1000, sample.tp2*1000, sample.flowRate))
+        time.sleep(1)
+
+if __name__ == "__main__":
+    try:
+        test_sensor()
+    except Exception as e:
+        print(e)
@@ -0,0 +1,361 @@
+'''
+Hardware backends for MotorDriver and FS1012.
+
+"rpi":  RPi.GPIO and the Adafruit ADS1115 driver on the Raspberry Pi.
+"sim":  Simulated GPIO and ADS1115, for running the controller on any
+        machine. The in1 pin of every pump of PUMP_CHANNELS drives a
+        first-order flow model (HIGH or a PWM duty), and each ADC returns
+        on the inputs of its FLOW_SENSORS the TP1/TP2 codes that the
+        sensor calibration maps to the flow of its pumps, with noise and
+        I2C latency.
+
+The ADS1115 of both backends is driven conversion by conversion
+(start_conversion / start_continuous, then read_conversion), which lets
+SensorBus keep several ADCs converting at the same time. Each backend returns one ADS1115 object per address
+and puts all of them on one I2C bus. Its busLock is held by whoever
+reads sensors over a series of conversions (see SensorBus), so two
+readers never mix their conversions. The mux and continuous attributes
+of an ADS1115 tell what it is converting.
+
+The backend is chosen by settings.HW_BACKEND, the AIR_SAMPLER_BACKEND
+environment variable or set_backend(), and is created on first use so
+that nothing touches the hardware libraries at import time.
+'''
+import math
+import os
+import random
+import time
+from threading import Lock, RLock
+import settings
+from channels import DIFF_PAIRS, pump_channels, sensor_configs
+
+P0, P1, P2, P3 = 0, 1, 2, 3
+
+# ADS1115 config register fields.
+_DATA_RATES = {8: 0, 16: 1, 32: 2, 64: 3, 128: 4, 250: 5, 475: 6, 860: 7}
+_GAINS      = {2/3: 0, 1: 1, 2: 2, 4: 3, 8: 4, 16: 5}
+# The internal clock of the ADS1115 is off by up to 10 %, and the converter
+# wakes up from power-down before it starts a continuous conversion.
+_CLOCK_MARGIN   = 1.2
+_POWER_UP_SEC   = 0.0005
+
+def first_continuous_delay(conversionTime):
+    '''Time from the start of continuous mode to its first result, with margin.'''
+    return _CLOCK_MARGIN*conversionTime + _POWER_UP_SEC
+
+def mux_bits(pin, negativePin=None):
+    '''MUX field of the ADS1115 config register for pin (- negativePin).'''
+    if negativePin is None:
+        return 4 + pin
+    return DIFF_PAIRS.index((pin, negativePin))
+
+_backend = None
+_backendName = None
+
+def set_backend(name):
+    '''Select the backend before the first get_backend() call.'''
+    global _backend, _backendName
+    if _backend is not None and _backend.name != name:
+        raise RuntimeError("The {} backend is already in use.".format(_backend.name))
+    _backendName = name
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        name = _backendName or os.environ.get("AIR_SAMPLER_BACKEND") or settings.HW_BACKEND
+        if name == "rpi":
+            _backend = RPiBackend()
+        elif name == "sim":
+            _backend = SimBackend()
+        else:
+            raise ValueError("Unknown hardware backend: {}".format(name))
+    return _backend
+
+
+class RPiBackend:
+    name = "rpi"
+
+    def __init__(self):
+        import RPi.GPIO as GPIO
+        self.GPIO = GPIO
+        self.i2c  = None
+        self.busLock    = RLock()       # Held over a whole sensor reading
+        self._adcs  = {}
+
+    def ADS1115(self, address, gain):
+        adc = self._adcs.get(address)
+        if adc is None:
+            if self.i2c is None:
+                import board
+                import busio
+                self.i2c = busio.I2C(board.SCL, board.SDA)
+            adc = self._adcs[address] = AdafruitADS1115(self.i2c, address, gain)
+        return adc
+
+
+class AdafruitADS1115:
+    _CONFIG         = 0x01
+    _CONVERSION     = 0x00
+
+    def __init__(self, i2c, address, gain):
+        from adafruit_ads1x15 import ads1115 as adafruit_ads1115
+        self.i2c        = i2c
+        self.ads        = adafruit_ads1115.ADS1115(self.i2c, address=address)
+        self.ads.gain   = gain
+        self.address    = address
+        self.gain       = gain
+        self.dataRate   = settings.ADC_DATA_RATE
+        self.continuous = False
+        self.mux        = None          # (pin, negative pin) of the last conversion started
+        self._firstAt   = 0.0           # time.monotonic() of the first continuous result
+        self._buffer    = bytearray(3)
+
+    @property
+    def conversion_time(self):
+        return 1.0/self.dataRate
+
+    def _write_config(self, pin, negativePin, continuous):
+        config = (0x8000 | mux_bits(pin, negativePin) << 12 | _GAINS[self.gain] << 9
+                  | (0 if continuous else 0x0100) | _DATA_RATES[self.dataRate] << 5 | 0x0003)
+        self._buffer[0] = self._CONFIG
+        self._buffer[1] = config >> 8
+        self._buffer[2] = config & 0xFF
+        with self.ads.i2c_device as device:
+            device.write(self._buffer)
+        self.mux = (pin, negativePin)
+
+    def start_conversion(self, pin, negativePin=None):
+        '''Start one single-shot conversion; read it with read_conversion().'''
+        self._write_config(pin, negativePin, False)
+        self.continuous = False
+
+    def start_continuous(self, pin, negativePin=None):
+        '''Convert pin (- negativePin) continuously; read_conversion() returns the latest result.'''
+        self._write_config(pin, negativePin, True)
+        self.continuous = True
+        self._firstAt   = time.monotonic() + first_continuous_delay(self.conversion_time)
+
+    def read_conversion(self):
+        if self.continuous:
+            # The OS bit does not tell when the first result of a new mux is in:
+            # until then the register still holds the previous conversion.
+            wait = self._firstAt - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+        with self.ads.i2c_device as device:
+            if not self.continuous:
+                # OS bit: 1 once the single-shot conversion is done.
+                deadline = time.monotonic() + 2*self.conversion_time
+                while True:
+                    device.write_then_readinto(bytes([self._CONFIG]), self._buffer, in_end=2)
+                    if self._buffer[0] & 0x80 or time.monotonic() > deadline:
+                        break
+            device.write_then_readinto(bytes([self._CONVERSION]), self._buffer, in_end=2)
+        code = self._buffer[0] << 8 | self._buffer[1]
+        return code - 0x10000 if code & 0x8000 else code
+
+
+class SimPWM:
+    '''The RPi.GPIO.PWM object of SimGPIO; the duty is reported as an output level 0-1.'''
+    def __init__(self, gpio, pin, frequency):
+        self.gpio       = gpio
+        self.pin        = pin
+        self.frequency  = frequency
+        self.duty       = 0.0
+
+    def start(self, duty):
+        self.ChangeDutyCycle(duty)
+
+    def ChangeDutyCycle(self, duty):
+        if not 0 <= duty <= 100:
+            raise ValueError("dutycycle must have a value from 0.0 to 100.0")
+        self.duty = duty
+        if self.gpio.onOutput is not None:
+            self.gpio.onOutput(self.pin, duty/100)
+
+    def ChangeFrequency(self, frequency):
+        self.frequency = frequency
+
+    def stop(self):
+        self.ChangeDutyCycle(0)
+
+
+class SimGPIO:
+    '''The subset of RPi.GPIO used by MotorDriver.'''
+    BOARD   = 10
+    BCM     = 11
+    OUT     = 0
+    IN      = 1
+    LOW     = 0
+    HIGH    = 1
+
+    def __init__(self):
+        self.mode   = None
+        self.pins   = {}
+        self.onOutput   = None          # Called with (pin, value) on every output()
+
+    def setmode(self, mode):
+        self.mode = mode
+
+    def setwarnings(self, flag):
+        pass
+
+    def setup(self, pin, direction):
+        self.pins.setdefault(pin, self.LOW)
+
+    def output(self, pin, value):
+        self.pins[pin] = self.HIGH if value else self.LOW
+        if self.onOutput is not None:
+            self.onOutput(pin, value)
+
+    def input(self, pin):
+        return self.pins.get(pin, self.LOW)
+
+    def PWM(self, pin, frequency):
+        return SimPWM(self, pin, frequency)
+
+    def cleanup(self):
+        self.pins.clear()
+
+
+class SimPump:
+    '''
+    First-order response of the flow of one pump to its drive level (0-1).
+    Below the deadband level the motor stalls; above it the flow rises
+    linearly to maxFlow.
+    '''
+    def __init__(self, maxFlow, tau, deadband=0.0):
+        self.maxFlow    = maxFlow
+        self.tau        = tau
+        self.deadband   = deadband
+        self.level      = 0.0
+        self.flow       = 0.0
+        self._lastTime  = time.monotonic()
+
+    def set_level(self, level):
+        self.update()
+        self.level = level
+
+    def update(self):
+        now = time.monotonic()
+        target = max(0.0, self.level - self.deadband)/(1 - self.deadband)*self.maxFlow
+        self.flow = target + (self.flow - target)*math.exp(-(now - self._lastTime)/self.tau)
+        self._lastTime = now
+        return self.flow
+
+
+class SimBackend:
+    name = "sim"
+
+    def __init__(self):
+        self.GPIO   = SimGPIO()
+        self.GPIO.onOutput = self._on_output
+        self.pumps  = {}                # in1 pin -> SimPump
+        self.pumpPins   = {}            # pump name -> in1 pin
+        for name, in1, _ in pump_channels():
+            self.pumps[in1] = SimPump(settings.SIM_PUMP_FLOW, settings.SIM_PUMP_TAU, settings.SIM_PUMP_DEADBAND)
+            self.pumpPins[name] = in1
+        self.busLock    = RLock()       # Held over a whole sensor reading
+        self._transferLock  = Lock()    # One I2C transaction at a time
+        self._adcs  = {}
+
+    def _on_output(self, pin, value):
+        # value is GPIO.HIGH/LOW from output() or the PWM duty (0-1).
+        if pin in self.pumps:
+            self.pumps[pin].set_level(float(value))
+
+    def total_flow(self):
+        return sum(pump.update() for pump in self.pumps.values())
+
+    def flow(self, names=None):
+        '''Flow of the named pumps (all pumps if names is None).'''
+        if names is None:
+            return self.total_flow()
+        return sum(self.pumps[self.pumpPins[name]].update() for name in names)
+
+    def transfer(self):
+        '''Hold the bus for one I2C transaction.'''
+        with self._transferLock:
+            time.sleep(settings.SIM_I2C_LATENCY)
+
+    def ADS1115(self, address, gain):
+        adc = self._adcs.get(address)
+        if adc is None:
+            adc = self._adcs[address] = SimADS1115(self, address, gain)
+        return adc
+
+
+class SimADS1115:
+    '''
+    Simulated ADS1115 with TP1 and TP2 of its FLOW_SENSORS on their inputs
+    (TP1 on P0 and TP2 on P1 of the total flow if no sensor uses this
+    address). Every I2C transaction holds the shared bus for
+    SIM_I2C_LATENCY; a single-shot conversion takes 1/dataRate, during
+    which the bus is free for the other ADCs.
+    '''
+    def __init__(self, backend, address, gain):
+        from calibration import FlowCalibration, CODE_MIN
+        self.backend    = backend
+        self.address    = address
+        self.gain       = gain
+        self.dataRate   = settings.ADC_DATA_RATE
+        self.continuous = False
+        self._lock      = Lock()
+        self._calibration   = FlowCalibration(gain=gain)
+        self._codeMin   = CODE_MIN
+        self.mux        = None
+        self._readyAt   = 0.0
+        # [tp1 input, tp2 input, pump names or None, calibration, (table, start, increasing part of the table)]
+        self._sensors   = [[config["tp1"], config["tp2"], config["pumps"],
+                            FlowCalibration(config["calParams"], gain), None]
+                           for config in sensor_configs() if config["address"] == address]
+        if not self._sensors:
+            self._sensors = [[P0, P1, None, self._calibration, None]]
+
+    @property
+    def conversion_time(self):
+        return 1.0/self.dataRate
+
+    def _diff_code(self, flow, sensor):
+        # Smallest TP2 - TP1 code whose calibrated flow reaches `flow`, on the
+        # increasing part of the calibration curve.
+        import numpy as np
+        table = sensor[3].table
+        if sensor[4] is None or sensor[4][0] is not table:
+            start = len(table) - 1 - int(np.argmin(table[::-1]))
+            sensor[4] = (table, start, np.maximum.accumulate(table[start:]))
+        _, start, curve = sensor[4]
+        index = min(int(np.searchsorted(curve, flow)), len(curve) - 1)
+        return start + index + self._codeMin
+
+    def _code(self, pin, negativePin):
+        lsb = self._calibration.lsb
+        codes = [0.0, 0.0, 0.0, 0.0]
+        for sensor in self._sensors:
+            if pin in sensor[:2] or negativePin in sensor[:2]:
+                tp1 = settings.SIM_TP1_VOLT/lsb + random.gauss(0, settings.SIM_ADC_NOISE)
+                codes[sensor[0]] = tp1
+                codes[sensor[1]] = (tp1 + self._diff_code(self.backend.flow(sensor[2]), sensor)
+                                    + random.gauss(0, settings.SIM_ADC_NOISE))
+        code = codes[pin] - (codes[negativePin] if negativePin is not None else 0.0)
+        return max(-32768, min(32767, int(round(code))))
+
+    def start_conversion(self, pin, negativePin=None):
+        with self._lock:
+            self.backend.transfer()
+            self.mux        = (pin, negativePin)
+            self.continuous = False
+            self._readyAt   = time.monotonic() + self.conversion_time
+
+    def start_continuous(self, pin, negativePin=None):
+        self.start_conversion(pin, negativePin)
+        self.continuous = True
+        self._readyAt   = time.monotonic() + first_continuous_delay(self.conversion_time)
+
+    def read_conversion(self):
+        with self._lock:
+            wait = self._readyAt - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            self.backend.transfer()
+            return self._code(*(self.mux or (P0, P1)))
@@ -0,0 +1,194 @@
+'''
+Write-ahead journal of the pump runs of the headless controller.
+
+Every record is one short text line appended to the journal file and
+fsynced:
+
+    R <id>                  run scheduled
+    S <id> <time>           run starting, written before the pumps go on
+    E <id> <time> <volume>  run ended, written after the pumps went off,
+                            volume in ml or "-"
+    C <id>                  run cancelled
+
+A crash between a record and the pump edge thus leaves the run open in
+the journal, never closed while its pumps may still run: a run with an
+S record whose pumps never went on is replayed like any started run.
+
+The run id "<start>-<stop>-<pumps>[-<target flow>][-v<target volume>]"
+(e.g. "1672444800-1672445400-AB" or "1672444800-1672445400-A-100-v25")
+holds the planned start and stop time, the pump names (one character
+each, see PUMP_CHANNELS), the target flow of the
+flow control and the target volume, so a run can be rebuilt from its id
+alone. The targets are written with repr, which gives the same float
+back, and may contain "-" themselves ("1e-05"), so only the first three
+fields are split on "-". A torn last line is ignored on replay.
+
+On startup the journal is replayed. A run that was scheduled or started
+but has not ended, and whose stop time is still ahead, is resumed for
+its remaining duration. Runs whose stop time has passed are reported as
+lost, and so are started runs with a target volume, since the volume
+pumped before the restart is unknown. The file is then compacted to the resumed runs. It is
+compacted again after JOURNAL_COMPACT_RECORDS appends, by writing the
+open runs to a new file and renaming it over the old one.
+'''
+import datetime
+import os
+import time
+from threading import Lock
+import settings
+from schedule import PUMPS, run_pumps
+
+def run_id(run):
+    '''Journal id of a run dict (startTime, stopTime, pumpA, pumpB, ..., targetFlow, targetVolume).'''
+    pumps = "".join(run_pumps(run))
+    runId = "{:.0f}-{:.0f}-{}".format(run["startTime"].timestamp(), run["stopTime"].timestamp(), pumps)
+    if run.get("targetFlow") is not None:
+        runId += "-{!r}".format(run["targetFlow"])
+    if run.get("targetVolume") is not None:
+        runId += "-v{!r}".format(run["targetVolume"])
+    return runId
+
+def parse_run_id(runId):
+    '''
+    Inverse of run_id: (start, stop, pump names, targetFlow, targetVolume)
+    with the times as time.time() values.
+    '''
+    fields = runId.split("-", 3)
+    if len(fields) < 3 or not fields[2]:
+        raise ValueError("invalid run id {!r}".format(runId))
+    targetFlow = targetVolume = None
+    if len(fields) == 4:
+        # "<flow>", "v<volume>" or "<flow>-v<volume>"; a float never holds a "v".
+        flow, _, volume = fields[3].partition("v")
+        if flow:
+            if not flow.endswith("-") and volume:
+                raise ValueError("invalid run id {!r}".format(runId))
+            targetFlow = float(flow[:-1] if volume else flow)
+        if volume:
+            targetVolume = float(volume)
+        elif fields[3].endswith("v"):
+            raise ValueError("invalid run id {!r}".format(runId))
+    return float(fields[0]), float(fields[1]), tuple(fields[2]), targetFlow, targetVolume
+
+
+class Journal:
+    def __init__(self, path, compactRecords=None):
+        self.path           = path
+        self.compactRecords = compactRecords or settings.JOURNAL_COMPACT_RECORDS
+        self.openRuns       = {}        # run id -> start time (time.time()) or None
+        self.appended       = 0         # Records since the last compaction
+        self._lock          = Lock()
+        self._file          = None
+
+    def replay(self, now=None):
+        '''
+        Read the journal and compact it. Returns (resume, lost, records):
+        the runs to resume as run dicts starting now, the ids of the runs
+        that can no longer finish and the number of records read.
+        '''
+        now = time.time() if now is None else now
+        records = 0
+        openRuns = {}
+        try:
+            with open(self.path, "r") as file:
+                for line in file:
+                    fields = line.split()
+                    try:
+                        op, runId = fields[0], fields[1]
+                        if op == "R":
+                            openRuns.setdefault(runId, None)
+                        elif op == "S":
+                            openRuns[runId] = float(fields[2])
+                        elif op in ("E", "C"):
+                            openRuns.pop(runId, None)
+                        else:
+                            continue
+                    except (IndexError, ValueError):
+                        continue
+                    records += 1
+        except FileNotFoundError:
+            pass
+
+        resume, lost = [], []
+        self.openRuns = {}
+        for runId, startedAt in openRuns.items():
+            try:
+                start, stop, pumps, targetFlow, targetVolume = parse_run_id(runId)
+            except ValueError:
+                continue
+            if stop <= now or (targetVolume is not None and startedAt is not None) \
+                    or any("pump" + pump not in PUMPS for pump in pumps):
+                # Also runs of a pump that is no longer in PUMP_CHANNELS.
+                lost.append(runId)
+            elif start <= now:
+                # Started, or due while the controller was down.
+                self.openRuns[runId] = startedAt
+                resume.append({"startTime": datetime.datetime.fromtimestamp(now),
+                               "stopTime": datetime.datetime.fromtimestamp(stop),
+                               **{pump: pump[4:] in pumps for pump in PUMPS}, "targetFlow": targetFlow,
+                               "targetVolume": targetVolume, "tasks": [], "journalId": runId})
+            # Runs that have not started yet are set again from the task file.
+        self.compact()
+        return resume, lost, records
+
+    def scheduled(self, runIds):
+        self.append(["R " + runId for runId in runIds])
+
+    def started(self, runId, startedAt):
+        self.append(["S {} {:.3f}".format(runId, startedAt)])
+
+    def stopped(self, runId, stoppedAt, volume=None):
+        volume = "-" if volume is None else "{:.3f}".format(volume)
+        self.append(["E {} {:.3f} {}".format(runId, stoppedAt, volume)])
+
+    def cancelled(self, runId):
+        self.append(["C " + runId])
+
+    def append(self, lines):
+        if not lines:
+            return
+        with self._lock:
+            for line in lines:
+                op, runId = line.split(" ", 2)[:2]
+                if op == "R":
+                    self.openRuns.setdefault(runId, None)
+                elif op == "S":
+                    self.openRuns[runId] = float(line.split(" ")[2])
+                else:
+                    self.openRuns.pop(runId, None)
+            if self._file is None:
+                self._file = open(self.path, "a")
+            self._file.write("\n".join(lines) + "\n")
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self.appended += len(lines)
+            if self.appended >= self.compactRecords:
+                self._compact()
+
+    def compact(self):
+        with self._lock:
+            self._compact()
+
+    def _compact(self):
+        # Rewrite the open runs only; closed runs are dropped.
+        lines = []
+        for runId, startedAt in self.openRuns.items():
+            lines.append("R " + runId)
+            if startedAt is not None:
+                lines.append("S {} {:.3f}".format(runId, startedAt))
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        tmpPath = self.path + ".tmp"
+        with open(tmpPath, "w") as file:
+            file.write("".join(line + "\n" for line in lines))
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmpPath, self.path)
+        self.appended = 0
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
@@ -0,0 +1,304 @@
+'''
+Statistics of an archive of csv flow logs.
+
+    $ python3 logstats.py LOGDIR [LOGDIR or flow_log_*.csv ...] [--tasks task_summary.csv]
+          [--cal-file FILE | --cal-params P0,P1,...] [--gap SEC] [--workers N] [--output summary.csv]
+
+The flow_log_*.csv files are read by a pool of --workers processes
+(default: one per core), one file at a time, and each worker sends back
+only the sums of the hours and tasks the file covers, so the memory use
+does not grow with the size of the archive. Each row of the summary is
+one hour, one task of task_summary.csv (found in the log directories or
+given with --tasks) or the whole archive:
+
+    samples, mean / std / min / max flow (mlpm), volume (ml, trapezoidal
+    rule), gaps longer than --gap sec between the rows and their total time
+
+Rows further apart than --gap are not integrated. With --cal-file or
+--cal-params the flow is recomputed from the TP1 and TP2 columns with
+that calibration (see calfit.py) and the logged volume is listed next to
+the new one. The csv logs only have TP1 and TP2 of the first sensor,
+refreshed every TP_REFRESH_SEC in differential mode.
+
+The times are the local times of the logs.
+'''
+import argparse
+import csv
+import glob
+import os
+import sys
+import numpy as np
+import settings
+from calibration import FlowCalibration
+
+HEADER = ("Period", "Start", "End", "Samples", "Mean_Flow(mlpm)", "Std_Flow(mlpm)", "Min_Flow(mlpm)",
+          "Max_Flow(mlpm)", "Volume(ml)", "Gaps", "Gap_Time(s)")
+
+class Stats:
+    '''Flow statistics of one period, summed over the files that cover it.'''
+    def __init__(self):
+        self.samples        = 0
+        self.total          = 0.0
+        self.squares        = 0.0
+        self.minFlow        = float("inf")
+        self.maxFlow        = float("-inf")
+        self.volume         = 0.0
+        self.loggedVolume   = 0.0
+        self.gaps           = 0
+        self.gapSec         = 0.0
+        self.first          = None      # Seconds since 1970 of the local time
+        self.last           = None
+
+    def add(self, flows, volume, loggedVolume, gaps, gapSec, first, last):
+        self.samples += len(flows)
+        self.total += float(flows.sum())
+        self.squares += float(np.dot(flows, flows))
+        self.minFlow = min(self.minFlow, float(flows.min()))
+        self.maxFlow = max(self.maxFlow, float(flows.max()))
+        self.volume += volume
+        self.loggedVolume += loggedVolume
+        self.gaps += gaps
+        self.gapSec += gapSec
+        self._span(first, last)
+
+    def merge(self, other):
+        self.samples += other.samples
+        self.total += other.total
+        self.squares += other.squares
+        self.minFlow = min(self.minFlow, other.minFlow)
+        self.maxFlow = max(self.maxFlow, other.maxFlow)
+        self.volume += other.volume
+        self.loggedVolume += other.loggedVolume
+        self.gaps += other.gaps
+        self.gapSec += other.gapSec
+        if other.first is not None:
+            self._span(other.first, other.last)
+
+    def _span(self, first, last):
+        self.first = first if self.first is None else min(self.first, first)
+        self.last = last if self.last is None else max(self.last, last)
+
+    def row(self, period, recalibrated=False):
+        mean = self.total/self.samples if self.samples else 0.0
+        std = np.sqrt(max(self.squares/self.samples - mean*mean, 0.0)) if self.samples else 0.0
+        row = [period, _time(self.first), _time(self.last), self.samples, "{:.2f}".format(mean), "{:.2f}".format(std),
+               "{:.2f}".format(self.minFlow if self.samples else 0.0), "{:.2f}".format(self.maxFlow if self.samples else 0.0),
+               "{:.3f}".format(self.volume), self.gaps, "{:.0f}".format(self.gapSec)]
+        if recalibrated:
+            row.append("{:.3f}".format(self.loggedVolume))
+        return row
+
+
+def _time(seconds):
+    return "" if seconds is None else str(np.datetime64(int(seconds), "s").astype("datetime64[m]")).replace("T", " ")
+
+def read_flow_log(path):
+    '''(times (s), TP1 (mV), TP2 (mV), flow (mlpm)) arrays of a csv flow log, sorted by time.'''
+    with open(path) as file:
+        header = file.readline().strip().split(",")
+        if header[:3] != ["Time", "TP1(mV)", "TP2(mV)"] or "Flow_Rate" not in header:
+            raise ValueError("not a flow log")
+        flowColumn = header.index("Flow_Rate")
+        # A log cut off by a power loss can end with a partial row.
+        rows = [line.split(",") for line in file]
+    rows = [row for row in rows if len(row) == len(header)]
+    times = np.array([row[0] for row in rows], dtype="datetime64[s]").astype(np.int64)
+    tp1 = np.array([row[1] for row in rows], dtype=np.float64)
+    tp2 = np.array([row[2] for row in rows], dtype=np.float64)
+    flows = np.array([row[flowColumn] for row in rows], dtype=np.float64)
+    if len(times) > 1 and np.any(times[1:] < times[:-1]):
+        order = np.argsort(times, kind="stable")
+        times, tp1, tp2, flows = times[order], tp1[order], tp2[order], flows[order]
+    return times, tp1, tp2, flows
+
+
+_tasks          = None      # (ids, starts, stops) of the tasks
+_calibration    = None      # FlowCalibration of the recomputed flow, or None
+_gapSec         = None
+
+def _init_worker(tasks, calParams, gapSec):
+    global _tasks, _calibration, _gapSec
+    _tasks = tasks
+    _calibration = FlowCalibration(calParams) if calParams is not None else None
+    _gapSec = gapSec
+
+def _volumes(times, flows):
+    '''Trapezoidal volume (ml) of each interval between rows, 0 over the gaps.'''
+    steps = np.diff(times).astype(np.float64)
+    return np.where(steps > _gapSec, 0.0, (flows[1:] + flows[:-1])/2*steps/60)
+
+def analyse_file(path):
+    '''
+    Per hour and per task Stats of one flow log (in a worker). Returns
+    (path, hours {hour: Stats}, tasks {task index: Stats}, (first, last) or
+    None, error or None).
+    '''
+    try:
+        times, tp1, tp2, loggedFlows = read_flow_log(path)
+    except (OSError, ValueError, UnicodeDecodeError) as e:
+        return path, {}, {}, None, str(e)
+    if len(times) == 0:
+        return path, {}, {}, None, None
+    if _calibration is not None:
+        flows = _calibration.flow_voltages((tp2 - tp1)/1000)
+    else:
+        flows = loggedFlows
+    steps = np.diff(times)
+    isGap = steps > _gapSec
+    volumes = _volumes(times, flows)
+    loggedVolumes = _volumes(times, loggedFlows)
+
+    # An interval between two rows counts in the hour of its first row.
+    hourKeys, starts = np.unique(times//3600, return_index=True)
+    ends = np.append(starts[1:], len(times))
+    hours = {}
+    for key, start, end in zip(hourKeys.tolist(), starts.tolist(), ends.tolist()):
+        last = min(end, len(steps))
+        stats = hours[key] = Stats()
+        stats.add(flows[start:end], float(volumes[start:last].sum()), float(loggedVolumes[start:last].sum()),
+                  int(isGap[start:last].sum()), float(steps[start:last][isGap[start:last]].sum()),
+                  int(times[start]), int(times[end - 1]))
+
+    tasks = {}
+    ids, taskStarts, taskStops = _tasks
+    for index in np.nonzero((taskStarts <= times[-1]) & (taskStops >= times[0]))[0].tolist():
+        start = int(np.searchsorted(times, taskStarts[index], side="left"))
+        end = int(np.searchsorted(times, taskStops[index], side="right"))
+        if end <= start:
+            continue
+        last = end - 1
+        # Keyed by index: the task numbers start again with every run.
+        stats = tasks[index] = Stats()
+        stats.add(flows[start:end], float(volumes[start:last].sum()), float(loggedVolumes[start:last].sum()),
+                  int(isGap[start:last].sum()), float(steps[start:last][isGap[start:last]].sum()),
+                  int(times[start]), int(times[last]))
+    return path, hours, tasks, (int(times[0]), int(times[-1])), None
+
+def read_tasks(paths):
+    '''(ids, starts, stops) of the tasks of task_summary.csv files, times in local seconds.'''
+    ids, starts, stops = [], [], []
+    for path in paths:
+        with open(path) as file:
+            for row in csv.DictReader(file):
+                try:
+                    start, stop = np.array([row["Start"], row["Stop"]], dtype="datetime64[s]").astype(np.int64).tolist()
+                except (KeyError, ValueError):
+                    continue
+                ids.append(row["Task"])
+                starts.append(start)
+                stops.append(stop)
+    return ids, np.array(starts, dtype=np.int64), np.array(stops, dtype=np.int64)
+
+def find_logs(paths):
+    logs = []
+    summaries = []
+    for path in paths:
+        if os.path.isdir(path):
+            logs.extend(glob.glob(os.path.join(path, "**", "flow_log_*.csv"), recursive=True))
+            summaries.extend(glob.glob(os.path.join(path, "**", "task_summary.csv"), recursive=True))
+        else:
+            logs.append(path)
+    return sorted(set(logs)), sorted(set(summaries))
+
+def analyse(logs, tasks, calParams=None, gapSec=None, workers=None):
+    '''
+    Stats of the logs: ({hour: Stats}, {task index: Stats}, total Stats, errors).
+    The files are streamed through a pool of workers (None: one per core).
+    '''
+    from multiprocessing import Pool
+    gapSec = 3*settings.OUTPUT_SEC if gapSec is None else gapSec
+    workers = workers or os.cpu_count() or 1
+    hours, taskStats, spans, errors = {}, {}, [], []
+
+    def collect(results):
+        for path, fileHours, fileTasks, span, error in results:
+            if error is not None:
+                errors.append((path, error))
+                continue
+            for table, parts in ((hours, fileHours), (taskStats, fileTasks)):
+                for key, stats in parts.items():
+                    table.setdefault(key, Stats()).merge(stats)
+            if span is not None:
+                spans.append(span)
+
+    if workers == 1:
+        _init_worker(tasks, calParams, gapSec)
+        collect(map(analyse_file, logs))
+    else:
+        with Pool(workers, initializer=_init_worker, initargs=(tasks, calParams, gapSec)) as pool:
+            collect(pool.imap_unordered(analyse_file, logs, chunksize=max(1, min(16, len(logs)//(workers*4)))))
+
+    # Gaps between the files, counted in the hour of the row before the gap.
+    spans.sort()
+    lastTime = None
+    for first, last in spans:
+        if lastTime is not None and first - lastTime > gapSec:
+            stats = hours.setdefault(lastTime//3600, Stats())
+            stats.gaps += 1
+            stats.gapSec += first - lastTime
+        lastTime = last if lastTime is None else max(lastTime, last)
+
+    total = Stats()
+    for stats in hours.values():
+        total.merge(stats)
+    return hours, taskStats, total, errors
+
+def summary_rows(hours, tasks, taskStats, total, recalibrated=False):
+    header = list(HEADER) + (["Logged_Volume(ml)"] if recalibrated else [])
+    rows = [stats.row(_time(hour*3600), recalibrated) for hour, stats in sorted(hours.items())]
+    rows += [stats.row("Task " + tasks[0][index], recalibrated)
+             for index, stats in sorted(taskStats.items(), key=lambda item: (item[1].first, item[0]))]
+    rows.append(total.row("Total", recalibrated))
+    return header, rows
+
+def format_table(header, rows):
+    widths = [max(len(str(row[i])) for row in [header] + rows) for i in range(len(header))]
+    lines = []
+    for row in [header] + rows:
+        lines.append("  ".join(str(value).ljust(width) if i < 3 else str(value).rjust(width)
+                               for i, (value, width) in enumerate(zip(row, widths))))
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Hourly and per-task statistics of csv flow logs.")
+    parser.add_argument("paths", nargs="+", help="Log directories (searched recursively) or flow_log_*.csv files.")
+    parser.add_argument("--tasks", action="append", default=None,
+                        help="task_summary.csv of the tasks (default: those in the log directories).")
+    parser.add_argument("--cal-file", default=None, help="Recompute the flow with this calibration file.")
+    parser.add_argument("--cal-params", default=None, help="Recompute the flow with these comma separated CAL_PARAMS.")
+    parser.add_argument("--gap", type=float, default=None,
+                        help="Rows further apart than n sec are a gap (default: 3 x OUTPUT_SEC).")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: one per core).")
+    parser.add_argument("--output", default=None, help="Also write the summary table to this csv file.")
+    args = parser.parse_args()
+
+    calParams = None
+    try:
+        if args.cal_file and args.cal_params:
+            parser.error("--cal-file and --cal-params are exclusive")
+        if args.cal_file:
+            calParams = args.cal_file
+            FlowCalibration(calParams)          # Fail here, not in every worker.
+        elif args.cal_params:
+            calParams = [float(p) for p in args.cal_params.split(",")]
+    except ValueError as e:
+        parser.error(str(e))
+
+    logs, summaries = find_logs(args.paths)
+    if not logs:
+        print("[Stats ] No flow logs found.")
+        sys.exit(1)
+    tasks = read_tasks(args.tasks if args.tasks is not None else summaries)
+    hours, taskStats, total, errors = analyse(logs, tasks, calParams, args.gap, args.workers)
+    for path, error in errors:
+        print("[Stats ] {}: {}. Skipping this file.".format(path, error))
+    header, rows = summary_rows(hours, tasks, taskStats, total, calParams is not None)
+    print(format_table(header, rows))
+    print("[Stats ] {} files, {} tasks.".format(len(logs) - len(errors), len(taskStats)))
+    if args.output:
+        with open(args.output, "w", newline="") as file:
+            writer = csv.writer(file)
+            writer.writerow(header)
+            writer.writerows(rows)
+    sys.exit(1 if errors else 0)
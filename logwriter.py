@@ -0,0 +1,174 @@
+import os
+import queue
+import time, datetime
+from threading import Thread
+import settings
+
+def pump_bits(pumpStatus, names=("A", "B")):
+    '''Pack {"A": bool, "B": bool, ...} into the pump bits of a log row, bit i for names[i].'''
+    return sum(1 << index for index, name in enumerate(names) if pumpStatus.get(name))
+
+class LogWriter(Thread):
+    '''
+    Background writer of the flow log.
+
+    Rows are queued by the sampling side with write(), which never blocks:
+    if the queue is full the row is dropped and counted. The writer thread
+    drains the queue in batches, flushes every flushSec and fsyncs every
+    fsyncSec, and starts a new file at every rotateSec boundary (local
+    time), closing the previous one. The first file is opened in the
+    constructor so a bad directory is reported to the caller.
+    '''
+    prefix      = "flow_log_"
+    extension   = ".csv"
+    mode        = "w"
+
+    def __init__(self, logDir, flushSec=None, fsyncSec=None, rotateSec=None, queueSize=None, sensorNames=None,
+                 rawFlow=None):
+        Thread.__init__(self, name="LogWriter")
+        self.daemon     = True
+        self.logDir     = logDir
+        self.sensorNames    = list(sensorNames or [])   # Flow_Rate_<name> columns, one per sensor
+        # Flow_Rate_Raw column, by default when the flow is filtered
+        self.rawFlow    = bool(settings.FLOW_FILTERS) if rawFlow is None else rawFlow
+        self.flushSec   = settings.LOG_FLUSH_SEC if flushSec is None else flushSec
+        self.fsyncSec   = settings.LOG_FSYNC_SEC if fsyncSec is None else fsyncSec
+        self.rotateSec  = settings.LOG_ROTATE_SEC if rotateSec is None else rotateSec
+        self._queue     = queue.Queue(settings.LOG_QUEUE_SIZE if queueSize is None else queueSize)
+        self.rowsWritten    = 0
+        self.rowsDropped    = 0
+        self.filesOpened    = 0
+        self.lastError      = None
+        self.file       = None
+        self.fileName   = None
+
+        now = time.time()
+        self._period = self.period_of(now)
+        self.open_file(now)
+
+    def period_of(self, timeStamp):
+        return int((timeStamp + time.localtime(timeStamp).tm_gmtoff)//self.rotateSec)
+
+    def open_file(self, timeStamp):
+        if self.file is not None:
+            self.close_file()
+        name = datetime.datetime.fromtimestamp(timeStamp).strftime("%Y%m%d_%H-%M-%S")
+        self.fileName = os.path.join(self.logDir, self.prefix + name + self.extension)
+        self.file = open(self.fileName, self.mode)
+        self.filesOpened += 1
+        self.write_header()
+
+    def close_file(self):
+        if self.file is None:
+            return
+        try:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+        finally:
+            self.file.close()
+            self.file = None
+
+    def write_header(self):
+        self.file.write("Time,TP1(mV),TP2(mV),Flow_Rate" + (",Flow_Rate_Raw" if self.rawFlow else "")
+                        + "".join(",Flow_Rate_" + name for name in self.sensorNames) + "\n")
+
+    def format_rows(self, rows):
+        lines = []
+        for row in rows:
+            timeStamp, tp1, tp2, flowRate = row[:4]
+            extra = ""
+            if self.rawFlow:
+                extra = ",{:.2f}".format(row[7])
+            if self.sensorNames:
+                extra += "".join(",{:.2f}".format(flow) for flow in row[6])
+            lines.append("{},{:.2f},{:.2f},{:.2f}{}\n".format(
+                time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(timeStamp)), tp1*1000, tp2*1000, flowRate, extra))
+        return "".join(lines)
+
+    def write(self, row):
+        '''
+        Queue (timestamp, TP1 (V), TP2 (V), flow rate, (TP1, TP2, diff codes), pump bits,
+        flow of each sensor, unfiltered flow rate) for writing. The csv
+        file uses the first four fields, the unfiltered flow if rawFlow
+        and the sensor flows if the writer has sensorNames.
+        '''
+        try:
+            self._queue.put_nowait(row)
+            return True
+        except queue.Full:
+            self.rowsDropped += 1
+            return False
+
+    def run(self):
+        lastFlush = lastFsync = time.monotonic()
+        running = True
+        while running:
+            rows = []
+            try:
+                rows.append(self._queue.get(timeout=self.flushSec))
+                while True:
+                    rows.append(self._queue.get_nowait())
+            except queue.Empty:
+                pass
+            if None in rows:
+                rows = rows[:rows.index(None)]
+                running = False
+
+            try:
+                self.write_rows(rows)
+                now = time.monotonic()
+                if now - lastFlush >= self.flushSec:
+                    self.file.flush()
+                    lastFlush = now
+                if now - lastFsync >= self.fsyncSec:
+                    os.fsync(self.file.fileno())
+                    lastFsync = now
+            except (OSError, ValueError) as e:
+                self.lastError = e
+                print("[Logger] Error: {}".format(e))
+
+        self.close_file()
+
+    def write_rows(self, rows):
+        if self.file is None:
+            # The last rotation failed, retry with a new file.
+            self.open_file(time.time())
+        start = 0
+        for i, row in enumerate(rows):
+            period = self.period_of(row[0])
+            if period != self._period:
+                if i > start:
+                    self.file.write(self.format_rows(rows[start:i]))
+                self._period = period
+                self.open_file(period*self.rotateSec - time.localtime(row[0]).tm_gmtoff)
+                start = i
+        if len(rows) > start:
+            self.file.write(self.format_rows(rows[start:]))
+        self.rowsWritten += len(rows)
+
+    def snapshot(self):
+        '''Counters of the writer, read without waiting for the writer thread.'''
+        return {
+            "file":         self.fileName,
+            "rowsWritten":  self.rowsWritten,
+            "rowsDropped":  self.rowsDropped,
+            "rowsQueued":   self._queue.qsize(),
+            "filesOpened":  self.filesOpened,
+            "lastError":    None if self.lastError is None else str(self.lastError),
+        }
+
+    def stop(self):
+        '''Write the queued rows, close the file and end the thread.'''
+        self._queue.put(None)
+        self.join()
+
+
+def create_log_writer(logDir, sensorNames=None):
+    '''
+    Return the writer for settings.LOG_FORMAT ("csv" or "binary"). The
+    csv file gets a flow column for each of sensorNames.
+    '''
+    if settings.LOG_FORMAT == "binary":
+        from binlog import BinaryLogWriter
+        return BinaryLogWriter(logDir)
+    return LogWriter(logDir, sensorNames=sensorNames)
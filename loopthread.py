@@ -0,0 +1,137 @@
+from threading import Thread, Event, Lock
+from array import array
+import json
+import time
+
+_loopStats = {}
+
+class LoopStats:
+    '''
+    Timing of a LoopThread: how late each tick fires after its scheduled
+    time, how long the callback runs, and how many ticks were skipped
+    because the callback overran the period. Latency and duration are
+    counted in fixed histogram bins (ms), so recording is O(1) and memory
+    does not grow with the run time.
+    '''
+    BOUNDS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+    def __init__(self, name, interval):
+        self.name       = name
+        self.interval   = interval
+        self._lock      = Lock()
+        self.reset()
+        _loopStats[name] = self
+
+    def reset(self):
+        with self._lock:
+            self.ticks          = 0
+            self.missedTicks    = 0
+            self.overruns       = 0
+            self.latencySum     = 0.0
+            self.latencyMax     = 0.0
+            self.durationSum    = 0.0
+            self.durationMax    = 0.0
+            self.latencyHist    = array('L', [0]*(len(self.BOUNDS_MS) + 1))
+            self.durationHist   = array('L', [0]*(len(self.BOUNDS_MS) + 1))
+
+    def _bin(self, ms):
+        for i, bound in enumerate(self.BOUNDS_MS):
+            if ms < bound:
+                return i
+        return len(self.BOUNDS_MS)
+
+    def record(self, scheduled, fired, finished):
+        '''Record one tick (times in sec from time.time()).'''
+        latency = fired - scheduled
+        duration = finished - fired
+        with self._lock:
+            self.ticks += 1
+            self.latencySum += latency
+            self.durationSum += duration
+            if latency > self.latencyMax:
+                self.latencyMax = latency
+            if duration > self.durationMax:
+                self.durationMax = duration
+            self.latencyHist[self._bin(latency*1000)] += 1
+            self.durationHist[self._bin(duration*1000)] += 1
+            if duration > self.interval:
+                self.overruns += 1
+            # Ticks whose scheduled time passed while this one was late or running.
+            missed = int((finished - scheduled)//self.interval)
+            if missed > 0:
+                self.missedTicks += missed
+
+    def _percentile(self, hist, fraction):
+        # Upper bound (ms) of the bin holding the given fraction of the ticks.
+        target = fraction*self.ticks
+        total = 0
+        for i, count in enumerate(hist):
+            total += count
+            if total >= target and count > 0:
+                return self.BOUNDS_MS[i] if i < len(self.BOUNDS_MS) else float("inf")
+        return 0
+
+    def snapshot(self):
+        with self._lock:
+            ticks = self.ticks or 1
+            return {
+                "name":             self.name,
+                "interval":         self.interval,
+                "ticks":            self.ticks,
+                "missedTicks":      self.missedTicks,
+                "overruns":         self.overruns,
+                "latencyMeanMs":    self.latencySum/ticks*1000,
+                "latencyMaxMs":     self.latencyMax*1000,
+                "latencyP50Ms":     self._percentile(self.latencyHist, 0.5),
+                "latencyP99Ms":     self._percentile(self.latencyHist, 0.99),
+                "durationMeanMs":   self.durationSum/ticks*1000,
+                "durationMaxMs":    self.durationMax*1000,
+                "durationP99Ms":    self._percentile(self.durationHist, 0.99),
+                "binsMs":           list(self.BOUNDS_MS),
+                "latencyHist":      list(self.latencyHist),
+                "durationHist":     list(self.durationHist),
+            }
+
+    def report(self):
+        s = self.snapshot()
+        return ("[Loop  ] {name} ({interval} s): {ticks} ticks, {missedTicks} missed, {overruns} overruns, "
+                "latency mean {latencyMeanMs:.2f} ms / p99 < {latencyP99Ms} ms / max {latencyMaxMs:.2f} ms, "
+                "callback mean {durationMeanMs:.2f} ms / max {durationMaxMs:.2f} ms").format(**s)
+
+
+def loop_stats():
+    '''The latest LoopStats of each name.'''
+    return dict(_loopStats)
+
+def write_loop_stats(path):
+    with open(path, "w") as file:
+        json.dump([stats.snapshot() for stats in _loopStats.values()], file, indent=4)
+
+
+class LoopThread(Thread):
+    def __init__(self, interval, func, *args, name=None):
+        Thread.__init__(self)
+        self.event = Event()
+        self.interval = interval
+        self.func = func
+        self.args = args
+        self.stats = LoopStats(name or func.__name__, interval)
+
+    def run(self):
+        while True:
+            now = time.time()
+            scheduled = now + self.interval - now % self.interval
+            if self.event.wait(scheduled - now):
+                return
+            fired = time.time()
+            self.func(*self.args)
+            self.stats.record(scheduled, fired, time.time())
+            if self.isStopped():
+                return
+            time.sleep(0.01)
+
+    def stop(self):
+        self.event.set()
+
+    def isStopped(self):
+        return self.event.is_set()
@@ -1,3 +1,8 @@
+import sys
+import startprofile
+if "--profile-startup" in sys.argv:
+    # Before the other imports, so they are timed.
+    startprofile.enable()
 import tkinter as tk
 from tkinter import font
 import tkinter.messagebox as msg
@@ -5,6 +10,7 @@ import time
 from flow import FlowFrame
 from motor import MotorFrame
 import settings
+startprofile.mark("imports")
 
 
 class Window(tk.Tk):
@@ -30,15 +36,25 @@ class Window(tk.Tk):
         self.menuBar = tk.Menu(self)
         self.fileMenu = tk.Menu(self.menuBar, tearoff=0)
         self.fileMenu.add_command(label='Exit', command=self.close_window)
+        self.viewMenu = tk.Menu(self.menuBar, tearoff=0)
+        self.viewMenu.add_command(label='Flow Chart', command=self.show_chart)
         self.helpMenu = tk.Menu(self.menuBar, tearoff=0)
         self.helpMenu.add_command(label='About', command=self.show_about)
         self.menuBar.add_cascade(label='File', menu=self.fileMenu)
+        self.menuBar.add_cascade(label='View', menu=self.viewMenu)
         self.menuBar.add_cascade(label='Help', menu=self.helpMenu)
         self.config(menu=self.menuBar)
         self.protocol('WM_DELETE_WINDOW', self.close_window)
 
         self.sensorFrame = FlowFrame(self, width=settings.WIDTH, height=settings.HEIGHT*0.4, xOffset=0, yOffset=0)
         self.motorFrame = MotorFrame(self, width=settings.WIDTH, height=settings.HEIGHT*0.4, xOffset=0, yOffset=140)
+        self.sensorFrame.pumpState = self.motorFrame.check_pump_status
+        self.sensorFrame.taskSource = lambda: self.motorFrame.pumpTasks.values()
+        self.sensorFrame.onSample = self.motorFrame.on_flow_sample
+        self.motorFrame.summaryDir = lambda: self.sensorFrame.logDir if self.sensorFrame.isLogging else None
+
+    def show_chart(self):
+        self.sensorFrame.show_chart()
 
     def show_about(self):
         msg.showinfo("About", "The GUI for air sampler controller",
@@ -55,6 +71,10 @@ if __name__ == "__main__":
         print("[Main APP] Start the APP.")
         
         window = Window()
+        startprofile.mark("window")
+        startprofile.milestone("Window ready")
+        for line in startprofile.report():
+            print(line)
         window.mainloop()
     finally:
         print("[Main APP] Close the APP.")
@@ -0,0 +1,149 @@
+'''
+Local metrics and status endpoint of the headless controller.
+
+    GET /metrics    Prometheus text format
+    GET /status     JSON
+
+Enabled with METRICS_PORT in settings.py or none_gui_main.py --metrics-port.
+The server runs in its own daemon thread and only renders the dict
+returned by its status source (Main.status), which is built from values
+already in memory: the last sensor reading and the rolling flow
+statistics of the FlowBuffer, the pump states, the edge queue, the
+LoopStats and the log writer counters. A scrape never reads
+the I2C bus or waits for the sensor loop.
+'''
+import json
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+
+PREFIX = "sampler_"
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(key, str(value).replace('"', '\\"')) for key, value in labels.items()) + "}"
+
+def _metric(lines, name, kind, help, samples):
+    '''Append one metric family; samples are (labels dict, value) or (suffix, labels dict, value).'''
+    lines.append("# HELP {}{} {}".format(PREFIX, name, help))
+    lines.append("# TYPE {}{} {}".format(PREFIX, name, kind))
+    for sample in samples:
+        suffix, labels, value = sample if len(sample) == 3 else ("",) + tuple(sample)
+        if value is None:
+            continue
+        lines.append("{}{}{}{} {}".format(PREFIX, name, suffix, _labels(labels), float(value)))
+
+def prometheus_text(status):
+    '''Render a Main.status() dict in the Prometheus text exposition format.'''
+    lines = []
+    _metric(lines, "uptime_seconds", "gauge", "Seconds since the controller started.",
+            [({}, status["uptime"])])
+    sensor = status.get("sensor")
+    if sensor is not None:
+        _metric(lines, "sensor_ok", "gauge", "1 if the last sensor check succeeded.", [({}, sensor["ok"])])
+        _metric(lines, "flow_rate_mlpm", "gauge", "Last flow rate reading (sum of the sensors).", [({}, sensor["flowRate"])])
+        _metric(lines, "flow_rate_raw_mlpm", "gauge", "Last flow rate reading before FLOW_FILTERS.",
+                [({}, sensor["rawFlowRate"])])
+        _metric(lines, "flow_rate_window_mlpm", "gauge",
+                "Rolling mean, min, max and std of the flow rate over the STAT_WINDOWS_SEC windows.",
+                [({"window": "{:g}".format(window["sec"]), "stat": stat}, window[stat])
+                 for window in sensor["windows"] for stat in ("mean", "min", "max", "std")])
+        _metric(lines, "sensor_flow_rate_mlpm", "gauge", "Last flow rate reading of each sensor.",
+                [({"sensor": item["name"]}, item["flowRate"]) for item in sensor["sensors"]])
+        _metric(lines, "sensor_found", "gauge", "1 if the ADS1115 of the sensor answered at startup.",
+                [({"sensor": item["name"]}, item["ok"]) for item in sensor["sensors"]])
+        _metric(lines, "tp_volts", "gauge", "Last thermopile readings of the first sensor.",
+                [({"tp": "1"}, sensor["tp1"]), ({"tp": "2"}, sensor["tp2"])])
+        _metric(lines, "sample_timestamp_seconds", "gauge", "Unix time of the last sensor reading.",
+                [({}, sensor["sampleTime"])])
+    _metric(lines, "pump_running", "gauge", "1 if the pump is on.",
+            [({"pump": pump}, running) for pump, running in sorted(status["pumps"].items())])
+    _metric(lines, "pump_duty_percent", "gauge", "PWM duty set by the flow control.",
+            [({}, status["flowControl"]["duty"])])
+    _metric(lines, "flow_target_tasks", "gauge", "Running tasks regulated to a target flow.",
+            [({}, status["flowControl"]["targets"])])
+    tasks = status["tasks"]
+    _metric(lines, "pending_edges", "gauge", "Pump edges waiting in the scheduler.", [({}, tasks["pendingEdges"])])
+    _metric(lines, "runs", "gauge", "Pump runs set.", [({}, tasks["runs"])])
+    _metric(lines, "running_tasks", "gauge", "Pump runs being integrated.", [({}, tasks["running"])])
+
+    loops = status["loops"]
+    _metric(lines, "loop_ticks_total", "counter", "Ticks of each loop.",
+            [({"loop": loop["name"]}, loop["ticks"]) for loop in loops])
+    _metric(lines, "loop_missed_ticks_total", "counter", "Ticks skipped because a callback ran late.",
+            [({"loop": loop["name"]}, loop["missedTicks"]) for loop in loops])
+    _metric(lines, "loop_overruns_total", "counter", "Callbacks longer than the loop interval.",
+            [({"loop": loop["name"]}, loop["overruns"]) for loop in loops])
+    for name, key, help in (("loop_latency_seconds", "latency", "Delay of each tick after its scheduled time."),
+                            ("loop_duration_seconds", "duration", "Run time of each loop callback.")):
+        samples = []
+        for loop in loops:
+            total = 0
+            for bound, count in zip(loop["binsMs"] + ["+Inf"], loop[key + "Hist"]):
+                total += count
+                le = bound if bound == "+Inf" else "{:g}".format(bound/1000)
+                samples.append(("_bucket", {"loop": loop["name"], "le": le}, total))
+            samples.append(("_sum", {"loop": loop["name"]}, loop[key + "MeanMs"]*loop["ticks"]/1000))
+            samples.append(("_count", {"loop": loop["name"]}, loop["ticks"]))
+        _metric(lines, name, "histogram", help, samples)
+
+    logs = status["logs"]
+    _metric(lines, "log_rows_written_total", "counter", "Rows written to each log.",
+            [({"log": log}, stats["rowsWritten"]) for log, stats in sorted(logs.items())])
+    _metric(lines, "log_rows_dropped_total", "counter", "Rows dropped because the log queue was full.",
+            [({"log": log}, stats["rowsDropped"]) for log, stats in sorted(logs.items())])
+    _metric(lines, "log_rows_queued", "gauge", "Rows waiting for the log writer.",
+            [({"log": log}, stats["rowsQueued"]) for log, stats in sorted(logs.items())])
+    _metric(lines, "log_files_opened_total", "counter", "Log files opened (rotations + 1).",
+            [({"log": log}, stats["filesOpened"]) for log, stats in sorted(logs.items())])
+    _metric(lines, "log_errors", "gauge", "1 if the last write of the log failed.",
+            [({"log": log}, stats["lastError"] is not None) for log, stats in sorted(logs.items())])
+    return "\n".join(lines) + "\n"
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        path = self.path.split("?", 1)[0]
+        if path not in ("/metrics", "/status"):
+            self.send_error(404)
+            return
+        try:
+            status = self.server.statusSource()
+            if path == "/metrics":
+                body = prometheus_text(status).encode()
+                contentType = "text/plain; version=0.0.4; charset=utf-8"
+            else:
+                body = json.dumps(status, indent=4, default=str).encode()
+                contentType = "application/json"
+        except Exception as e:
+            self.send_error(500, str(e))
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", contentType)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Scrapes every few seconds would flood the journal of systemd.
+        pass
+
+
+class MetricsServer:
+    '''HTTP server of /metrics and /status on (host, port), in a daemon thread.'''
+    def __init__(self, statusSource, host, port):
+        self.httpd = ThreadingHTTPServer((host, port), MetricsHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.statusSource = statusSource
+        self.thread = Thread(target=self.httpd.serve_forever, name="metrics", daemon=True)
+
+    @property
+    def address(self):
+        return self.httpd.server_address[:2]
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
@@ -3,83 +3,13 @@ import tkinter.ttk as ttk
 import tkinter.messagebox as msg
 from tkinter.constants import CENTER, W, E, NW
 import settings
-import RPi.GPIO as GPIO
+from hardware import get_backend
+from motordriver import MotorDriver
 import time, datetime
-from threading import Timer
-
-class MotorDriver:
-    '''
-        This class is suitable for both DRV8833 and L9110(s),
-        and the connections for both driver are shown below:
-
-        ################### DRV8833 ###################
-        VM        ==  power for motors (5V)
-        GND       ==  ground
-        STBY      ==  powering with 5V to enable driver
-        ANI1      ==  inpA1
-        ANI2      ==  inpA2
-        BIN1      ==  inpB1
-        BIN2      ==  inpB2
-        AO1/BO1   ==  motor +
-        AO2/BO2   ==  motor - 
-
-        ################### L9110(S) ##################
-        VCC       ==  power for motors (5V)
-        GND       ==  ground
-        A-IA      ==  inpA1
-        A-IB      ==  inpA2
-        B-IA      ==  inpB1
-        B-IB      ==  inpB2
-        OA1/OB1   ==  motor +
-        OA2/OB2   ==  motor - 
-    '''
-
-    def __init__(self, inpA1, inpA2, inpB1, inpB2):
-        self._runMotorA  = False
-        self._runMotorB  = False
-        self.inpA1    = inpA1
-        self.inpA2    = inpA2
-        self.inpB1    = inpB1
-        self.inpB2    = inpB2
-        
-        GPIO.setup(self.inpA1, GPIO.OUT)
-        GPIO.setup(self.inpA2, GPIO.OUT)
-        GPIO.setup(self.inpB1, GPIO.OUT)
-        GPIO.setup(self.inpB2, GPIO.OUT)
-        
-        GPIO.output(self.inpA1, GPIO.LOW)
-        GPIO.output(self.inpA2, GPIO.LOW)
-        GPIO.output(self.inpB1, GPIO.LOW)
-        GPIO.output(self.inpB2, GPIO.LOW)
-
-    # @property
-    def runMotorAStatus(self):
-        return self._runMotorA
-
-    # @runMotorA.setter
-    def runMotorA(self, value: bool):
-        self._runMotorA = value
-        if value:
-            GPIO.output(self.inpA1, GPIO.HIGH)
-            return "[MotorA] Is running."
-        else: 
-            GPIO.output(self.inpA1, GPIO.LOW)
-            return "[MotorA] Is stopped."
-
-    # @property
-    def runMotorBStatus(self):
-        return self._runMotorB
-
-    # @runMotorB.setter
-    def runMotorB(self, value: bool):
-        self._runMotorB = value
-        if value:
-            GPIO.output(self.inpB1, GPIO.HIGH)
-            return "[MotorB] Is running."
-        else:
-            GPIO.output(self.inpB1, GPIO.LOW)
-            return "[MotorB] Is stopped."
-
+import queue
+from scheduler import TaskScheduler
+from schedule import find_overlaps
+from volume import VolumeTracker, format_summary
 
 class MotorFrame(tk.Frame):
     def __init__(self, master, width, height, xOffset, yOffset):
@@ -94,8 +24,18 @@ class MotorFrame(tk.Frame):
         
         # Tasks
         self.pumpTasks = {}
+        self.volumes = VolumeTracker()  # Sampled volume of the running tasks
+        self.summaryDir = None          # Callable returning the directory of task_summary.csv, or None
+        self.scheduler = TaskScheduler(onResult=self.post_pump_status)
+        self.scheduler.start()
+
+        # GUI updates posted by the scheduler thread, applied on the Tk thread
+        self.uiQueue = queue.Queue()
+        self.uiInterval = int(1000/settings.GUI_FPS)
+        self.indicatorItems = {}
 
         # Pumps setup
+        GPIO = get_backend().GPIO
         if settings.GPIO_MODE == "BOARD":
             GPIO.setmode(GPIO.BOARD)
         else:
@@ -156,6 +96,8 @@ class MotorFrame(tk.Frame):
         self.setDuration_sb = tk.Spinbox(from_=1, to=999, width=4, bd=0)
         self.setDurationUnit_cb = ttk.Combobox(values=['sec','min','hr'], width=3, state="readonly")
         self.setDurationUnit_cb.current(0)
+        self.setVolume_lb = tk.Label(text="Volume (ml)", fg=settings.FG_COLOR, bg=settings.BG_COLOR)
+        self.setVolume_en = tk.Entry(width=6)
         self.setTask_btn = tk.Button(text="Set Task", 
              bg=settings.FG_COLOR, fg=settings.BG_COLOR, height=1, bd=0, padx=5, pady=20,
              command=self.set_pump_task)
@@ -164,6 +106,8 @@ class MotorFrame(tk.Frame):
         self.setDuration_lb.place(x=345+xOffset, y=100+yOffset, anchor=W)
         self.setDuration_sb.place(x=465+xOffset, y=100+yOffset, anchor=E)
         self.setDurationUnit_cb.place(x=525+xOffset, y=100+yOffset, anchor=E)
+        self.setVolume_lb.place(x=365+xOffset, y=20+yOffset, anchor=W)
+        self.setVolume_en.place(x=525+xOffset, y=20+yOffset, anchor=E)
         self.setTask_btn.place(x=600+xOffset, y=80+yOffset, anchor=E)
 
         # Tree view of tasks
@@ -196,9 +140,33 @@ class MotorFrame(tk.Frame):
         self.taskListDeleteAll_btn.place(x=150+xOffset, y=300+yOffset, anchor=W)
 
         self.update_indicator(self.pumpAIndicator_cv, self.pumpBIndicator_cv)
+        self.uiAfterId = self.after(self.uiInterval, self.update_ui)
 
     def draw_indicator(self, canvasName, color):
-        return canvasName.create_oval(2, 2, 18, 18, fill=color, outline="")
+        # Draw the oval once, then only change its color.
+        item = self.indicatorItems.get(canvasName)
+        if item is None:
+            item = canvasName.create_oval(2, 2, 18, 18, fill=color, outline="")
+            self.indicatorItems[canvasName] = item
+        elif canvasName.itemcget(item, "fill") != color:
+            canvasName.itemconfig(item, fill=color)
+        return item
+
+    def post_pump_status(self, result=None):
+        # Called from the scheduler thread after every pump edge.
+        self.uiQueue.put(self.check_pump_status())
+
+    def update_ui(self):
+        changed = False
+        try:
+            while True:
+                self.uiQueue.get_nowait()
+                changed = True
+        except queue.Empty:
+            pass
+        if changed:
+            self.update_indicator(self.pumpAIndicator_cv, self.pumpBIndicator_cv)
+        self.uiAfterId = self.after(self.uiInterval, self.update_ui)
 
     def check_pump_status(self):
         return {"A": self.pumps.runMotorAStatus(), "B":self.pumps.runMotorBStatus()}
@@ -248,22 +216,15 @@ class MotorFrame(tk.Frame):
         self.update_indicator(self.pumpAIndicator_cv, self.pumpBIndicator_cv)
         print(var, "at", datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
 
-    def set_task(self, execTimeObj, func, *args):
+    def set_task(self, taskId, execTimeObj, func, *args):
         funcArgs = ",".join(map(str, args))
         funcName = func.__name__
-        def wrap_func():
-            func(*args)
-
-        secToExec = (execTimeObj - datetime.datetime.now()).total_seconds()
-        if secToExec > 0:
+        if self.scheduler.add_edge(taskId, execTimeObj, func, *args):
             print("%s(%s) will execute at %s." 
                 %(funcName, funcArgs, execTimeObj.strftime("%Y-%m-%d %H:%M:%S")))
-            taskTimer = Timer(secToExec, wrap_func)
-            taskTimer.daemon = True
-            taskTimer.start()
-            return taskTimer
+            return True
         else:
-            return None 
+            return False
 
     def set_pump_task(self):
         targetPump = [self.setTaskPumpA_val.get(), self.setTaskPumpB_val.get()]
@@ -283,6 +244,16 @@ class MotorFrame(tk.Frame):
             else:
                 msg.showerror("Error", "Invalid time unit. Please retry.")
                 return
+            # An optional target volume stops the task early; the duration is then the maximum.
+            targetVolume = None
+            if self.setVolume_en.get().strip():
+                try:
+                    targetVolume = float(self.setVolume_en.get())
+                except ValueError:
+                    targetVolume = 0
+                if targetVolume <= 0:
+                    msg.showerror("Error", "Invalid target volume. Please retry.")
+                    return
 
             try:
                 startTimeObj = datetime.datetime.strptime(startTime, "%Y-%m-%d %H:%M:%S")
@@ -291,41 +262,75 @@ class MotorFrame(tk.Frame):
                     return
 
                 stopTimeObj = startTimeObj + deltaTime
+                pumps = [pump for pump, target in zip(("pumpA", "pumpB"), targetPump) if target]
+                overlaps = find_overlaps(self.pumpTasks, startTimeObj, stopTimeObj, pumps)
+                if overlaps:
+                    msg.showerror("Error", "This task overlaps task {} on the same pump. Please retry."
+                                  .format(",".join(overlaps)))
+                    return
+
                 checkMsg = "This task will start at {} for {} {}, continue?".format(startTime, duration, durationUnit)
+                durationText = str(duration)+" "+str(durationUnit)
+                if targetVolume is not None:
+                    checkMsg = "This task will start at {} and pump {:g} ml within {} {}, continue?".format(
+                        startTime, targetVolume, duration, durationUnit)
+                    durationText += " / {:g} ml".format(targetVolume)
                 if msg.askokcancel("Set Task", checkMsg):
                     self.taskList_tv.insert(parent="", iid=self.taskCounts, index="end",
                     values=(self.taskCounts, startTime, stopTimeObj.strftime("%Y-%m-%d %H:%M:%S"),
-                     str(duration)+" "+str(durationUnit), targetPump[0], targetPump[1]))
+                     durationText, targetPump[0], targetPump[1]))
                     print("A task will be execute at %s for %s %s" %(startTime, duration, durationUnit))
-                    taskDict = {}
-                    taskA = []
-                    taskB = []
+                    taskId = str(self.taskCounts)
                     if targetPump[0]:
-                        taskA = [self.set_task(startTimeObj, self.pumps.runMotorA, True),
-                            self.set_task(stopTimeObj, self.pumps.runMotorA, False)]
-                        # taskA = [self.set_task(startTimeObj, self.test_task_a, True),
-                                # self.set_task(stopTimeObj, self.test_task_a, False)]
+                        self.set_task(taskId, startTimeObj, self.pumps.runMotorA, True)
+                        self.set_task(taskId, stopTimeObj, self.pumps.runMotorA, False)
+                        # self.set_task(taskId, startTimeObj, self.test_task_a, True)
+                        # self.set_task(taskId, stopTimeObj, self.test_task_a, False)
                     if targetPump[1]:
-                        taskB = [self.set_task(startTimeObj, self.pumps.runMotorA, True),
-                            self.set_task(stopTimeObj, self.pumps.runMotorA, False)]
-                        # taskB = [self.set_task(startTimeObj, self.test_task_b, True),
-                                # self.set_task(stopTimeObj, self.test_task_b, False)]
-                    taskDict[str(self.taskCounts)] = {"taskA": taskA, "taskB": taskB }
-                    self.pumpTasks.update(taskDict)
+                        self.set_task(taskId, startTimeObj, self.pumps.runMotorB, True)
+                        self.set_task(taskId, stopTimeObj, self.pumps.runMotorB, False)
+                        # self.set_task(taskId, startTimeObj, self.test_task_b, True)
+                        # self.set_task(taskId, stopTimeObj, self.test_task_b, False)
+                    self.set_task(taskId, startTimeObj, self.start_volume, taskId, targetVolume)
+                    self.set_task(taskId, stopTimeObj, self.stop_volume, taskId)
+                    self.pumpTasks[taskId] = {"startTime": startTimeObj, "stopTime": stopTimeObj,
+                        "pumpA": bool(targetPump[0]), "pumpB": bool(targetPump[1]), "targetVolume": targetVolume}
                     self.taskCounts+=1
 
             except Exception as e:
                 msg.showerror("Error", e)
                 return
 
+    def start_volume(self, taskId, targetVolume=None):
+        self.volumes.start(taskId, targetVolume=targetVolume)
+
+    def stop_volume(self, taskId):
+        self.volumes.summaryDir = self.summaryDir() if self.summaryDir is not None else None
+        summary = self.volumes.stop(taskId)
+        if summary is not None and summary["samples"] > 0:
+            print(format_summary(summary))
+
+    def on_flow_sample(self, timeStamp, flowRate):
+        # Called from the sensor thread. Tasks reaching their target volume
+        # are stopped right away and their pending stop edges cancelled.
+        for taskId in self.volumes.update(timeStamp, flowRate):
+            self.scheduler.cancel(taskId)
+            task = self.pumpTasks.get(taskId, {})
+            if task.get("pumpA"):
+                self.pumps.runMotorA(False)
+            if task.get("pumpB"):
+                self.pumps.runMotorB(False)
+            print("Task {} reached its target volume at {}.".format(
+                taskId, datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
+            self.stop_volume(taskId)
+            self.post_pump_status()
+
     def delete_task(self, tasks):
         for task in tasks:
             self.taskList_tv.delete(task)
-            if len(self.pumpTasks) !=0:
-                for pumpTaskKey in self.pumpTasks[task]:
-                    for item in self.pumpTasks[task][pumpTaskKey]:
-                        item.cancel()
-                self.pumpTasks.pop(task)
+            self.scheduler.cancel(task)
+            self.pumpTasks.pop(task, None)
+            self.volumes.running.pop(task, None)
 
     def delete_pump_task(self):
         tasks = self.taskList_tv.selection()
@@ -345,6 +350,10 @@ class MotorFrame(tk.Frame):
                 self.delete_task(tasks)
 
     def shutdown_pumps(self):
+        if self.uiAfterId is not None:
+            self.after_cancel(self.uiAfterId)
+            self.uiAfterId = None
+        self.scheduler.stop()
         self.pumps.runMotorA(False)
         self.pumps.runMotorB(False)
-        GPIO.cleanup()
+        self.pumps.GPIO.cleanup()
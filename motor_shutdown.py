@@ -1,30 +1,30 @@
-import RPi.GPIO as GPIO
 import settings
-from motor import MotorDriver
+from hardware import get_backend
+from motordriver import MotorDriver
+from channels import pump_channels
 
 def shutdown():
+    GPIO = get_backend().GPIO
+    driver = None
     try:
         if settings.GPIO_MODE == "BOARD":
             GPIO.setmode(GPIO.BOARD)
         else:
             GPIO.setmode(GPIO.BCM)
         # GPIO.setwarnings(False)
-        inpA1   = settings.INPA1
-        inpA2   = settings.INPA2
-        inpB1   = settings.INPB1
-        inpB2   = settings.INPB2
-        driver  = MotorDriver(inpA1, inpA2, inpB1, inpB2)
+        driver  = MotorDriver(channels=pump_channels())
 
-        driver.runMotorA(False)
-        driver.runMotorB(False)
+        for name in driver.names:
+            driver.run(name, False)
 
     except Exception as e:
         print("The program is exiting due to", e)
     
     finally:
-        driver.runMotorA(False)
-        driver.runMotorB(False)
+        if driver is not None:
+            for name in driver.names:
+                driver.run(name, False)
         GPIO.cleanup()
 
 if __name__ == '__main__':
-    shutdown()
\ No newline at end of file
+    shutdown()
@@ -0,0 +1,118 @@
+'''
+Pump driver (DRV8833 / L9110) on the GPIO pins, without the GUI of
+motor.py, so the headless controller and motor_shutdown.py do not import
+tkinter.
+'''
+import settings
+from hardware import get_backend
+
+class MotorDriver:
+    '''
+        This class is suitable for both DRV8833 and L9110(s),
+        and the connections for both driver are shown below:
+
+        ################### DRV8833 ###################
+        VM        ==  power for motors (5V)
+        GND       ==  ground
+        STBY      ==  powering with 5V to enable driver
+        ANI1      ==  inpA1
+        ANI2      ==  inpA2
+        BIN1      ==  inpB1
+        BIN2      ==  inpB2
+        AO1/BO1   ==  motor +
+        AO2/BO2   ==  motor - 
+
+        With PWM, the duty cycle (0-100 %) is set on inpA1/inpB1 at
+        settings.PWM_FREQ Hz while inpA2/inpB2 stay LOW.
+
+        ################### L9110(S) ##################
+        VCC       ==  power for motors (5V)
+        GND       ==  ground
+        A-IA      ==  inpA1
+        A-IB      ==  inpA2
+        B-IA      ==  inpB1
+        B-IB      ==  inpB2
+        OA1/OB1   ==  motor +
+        OA2/OB2   ==  motor - 
+
+        Any number of pumps can be driven with channels=[(name, in1, in2)]
+        (settings.PUMP_CHANNELS), in1/in2 being wired like inpA1/inpA2.
+    '''
+
+    def __init__(self, inpA1=None, inpA2=None, inpB1=None, inpB2=None, channels=None):
+        # channels: [(name, in1, in2)] of any number of pumps, by default
+        # pump A on inpA1/inpA2 and pump B on inpB1/inpB2.
+        if channels is None:
+            channels = [("A", inpA1, inpA2), ("B", inpB1, inpB2)]
+        self.channels = {name: (in1, in2) for name, in1, in2 in channels}
+        self._running = {name: False for name in self.channels}
+        self.GPIO     = get_backend().GPIO
+        self._pwm     = {}
+        GPIO          = self.GPIO
+
+        for in1, in2 in self.channels.values():
+            GPIO.setup(in1, GPIO.OUT)
+            GPIO.setup(in2, GPIO.OUT)
+            GPIO.output(in1, GPIO.LOW)
+            GPIO.output(in2, GPIO.LOW)
+
+    @property
+    def names(self):
+        return list(self.channels)
+
+    def status(self, name):
+        return self._running[name]
+
+    def statuses(self):
+        return dict(self._running)
+
+    def run(self, name, value: bool):
+        in1 = self.channels[name][0]
+        self._running[name] = value
+        self._stop_pwm(in1)
+        if value:
+            self.GPIO.output(in1, self.GPIO.HIGH)
+            return "[Motor{}] Is running.".format(name)
+        else:
+            self.GPIO.output(in1, self.GPIO.LOW)
+            return "[Motor{}] Is stopped.".format(name)
+
+    def run_pwm(self, name, duty):
+        self._running[name] = duty > 0
+        self._set_duty(self.channels[name][0], duty)
+        return duty
+
+    # @property
+    def runMotorAStatus(self):
+        return self.status("A")
+
+    # @runMotorA.setter
+    def runMotorA(self, value: bool):
+        return self.run("A", value)
+
+    # @property
+    def runMotorBStatus(self):
+        return self.status("B")
+
+    # @runMotorB.setter
+    def runMotorB(self, value: bool):
+        return self.run("B", value)
+
+    def runMotorAPWM(self, duty):
+        return self.run_pwm("A", duty)
+
+    def runMotorBPWM(self, duty):
+        return self.run_pwm("B", duty)
+
+    def _set_duty(self, pin, duty):
+        pwm = self._pwm.get(pin)
+        if pwm is None:
+            pwm = self._pwm[pin] = self.GPIO.PWM(pin, settings.PWM_FREQ)
+            pwm.start(duty)
+        else:
+            pwm.ChangeDutyCycle(duty)
+
+    def _stop_pwm(self, pin):
+        pwm = self._pwm.pop(pin, None)
+        if pwm is not None:
+            pwm.stop()
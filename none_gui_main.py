@@ -1,194 +1,373 @@
+import sys
+import startprofile
+if "--profile-startup" in sys.argv:
+    # Before the other imports, so they are timed.
+    startprofile.enable()
 import argparse
+import hashlib
 import json
 import os
 import time, datetime
-from threading import Thread, Event, Timer
+from threading import Lock, RLock
 import settings
-from flow import FS1012
-from motor import MotorDriver
-import RPi.GPIO as GPIO
+from fs1012 import FS1012
+from motordriver import MotorDriver
+from sensorbus import SensorBus
+from channels import pump_channels, pump_names, sensor_configs
+from scheduler import TaskScheduler
+from schedule import PUMPS, compile_tasks, find_overlaps, run_pumps
+from recurrence import TaskStream
+from journal import Journal, run_id
+from flowcontrol import FlowController, ControlLogWriter
+from volume import VolumeTracker, format_summary
+from flowbuffer import FlowRow, create_flow_buffer
+from logwriter import create_log_writer, pump_bits
+from loopthread import LoopThread, loop_stats, write_loop_stats
+from hardware import get_backend, set_backend
 
 initialTime = datetime.datetime.now()
 def print_info(infoString):
-   print("[{:>11.4f}]".format((datetime.datetime.now() - initialTime).total_seconds()), infoString)
+   timeStamp = "[{:>11.4f}]".format((datetime.datetime.now() - initialTime).total_seconds())
+   for line in str(infoString).splitlines() or [""]:
+      print(timeStamp, line)
 print_info("[Main  ] Starting the program at {}.".format(datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
+startprofile.mark("imports")
 
-class LoopThread(Thread):
-    def __init__(self, interval, func, *args):
-        Thread.__init__(self)
-        self.event = Event()
-        self.interval = interval
-        self.func = func
-        self.args = args
-        
-    def run(self):
-        while not self.event.wait(self.interval - time.time() % self.interval):
-            self.func(*self.args)
-            if self.isStopped():
-                return
-            time.sleep(0.01)
-    
-    def stop(self):
-        self.event.set()
-    
-    def isStopped(self):
-        return self.event.is_set()
+def run_key(run):
+    return (run["startTime"], run["stopTime"], tuple(run_pumps(run)), run.get("targetFlow"), run.get("targetVolume"))
 
 class MotorHandler:
-    def __init__(self) -> None:
+    def __init__(self, scheduler=None) -> None:
         pass
         # Tasks
-        self.pumpTasks = []
+        self.pumpTasks = {}
+        self.taskCounts = 0
+        self.taskStream = None
+        self.taskLock = RLock()         # Refill (scheduler thread) vs. reload
+        self.stopLock = Lock()          # Stop edge (scheduler thread) vs. target volume (sensor thread)
+        self.journal = None
+        self.volumes = VolumeTracker()   # Sampled volume of the running tasks
+        self.sensorPumps = None         # Pump names measured by each flow sensor (None: all), see run_sensors
+        if scheduler is None:
+            scheduler = TaskScheduler(onResult=lambda result: print_info(str(result)))
+            scheduler.start()
+        self.scheduler = scheduler
 
         # Pumps setup
+        GPIO = get_backend().GPIO
         GPIO.setmode(GPIO.BCM)
         if settings.GPIO_MODE == "BOARD":
             GPIO.setmode(GPIO.BOARD)
         # GPIO.setwarnings(False)
-        inpA1   = settings.INPA1
-        inpA2   = settings.INPA2
-        inpB1   = settings.INPB1
-        inpB2   = settings.INPB2
-        self.pumps  = MotorDriver(inpA1, inpA2, inpB1, inpB2)
-        print_info(str(self.pumps.runMotorA(False)))
-        print_info(str(self.pumps.runMotorB(False)))
+        self.pumps  = MotorDriver(channels=pump_channels())
+        self.flowControl = FlowController(self.pumps)
+        for name in self.pumps.names:
+            print_info(str(self.pumps.run(name, False)))
         self.pumpStatus = self.check_pump_status()
 
     def check_pump_status(self):
-        return {"A": self.pumps.runMotorAStatus(), "B":self.pumps.runMotorBStatus()}
+        return self.pumps.statuses()
+
+    def run_sensors(self, pumps):
+        '''Indices of the flow sensors measuring any of pumps, or None to use the total flow.'''
+        if self.sensorPumps is None:
+            return None
+        sensors = [index for index, measured in enumerate(self.sensorPumps)
+                   if measured is None or set(measured) & set(pumps)]
+        return None if len(sensors) == len(self.sensorPumps) else sensors
 
-    def set_task(self, execTimeObj, func, *args):
+    def set_task(self, taskId, execTimeObj, func, *args):
         funcArgs = ",".join(map(str, args))
         funcName = func.__name__
-        def wrap_func():
-            tmp = func(*args)
-            print_info(str(tmp))
-
-        secToExec = (execTimeObj - datetime.datetime.now()).total_seconds()
-        if secToExec > 0:
+        if self.scheduler.add_edge(taskId, execTimeObj, func, *args):
             print_info("[Motor ] {}({}) will execute at {}."
                 .format(funcName, funcArgs, execTimeObj.strftime("%Y-%m-%d %H:%M:%S")))
-            taskTimer = Timer(secToExec, wrap_func)
-            taskTimer.daemon = True
-            taskTimer.start()
-            return taskTimer
+            return True
         else:
-            return None 
+            return False
 
-    def set_pump_task(self, taskDict):
-        targetPump = [taskDict["pumpA"], taskDict["pumpB"]]
-        if not True in targetPump:
-            print_info("[Motor ] Please set at least one pump to true. Skipping this task.")
+    def set_pump_tasks(self, taskDicts):
+        '''Compile a list of task dicts (see schedule.py) and set the merged runs.'''
+        schedule = compile_tasks(taskDicts)
+        for line in schedule.report().splitlines():
+            print_info(line)
+        taskIds = [self.set_run(run, journal=False) for run in schedule.runs]
+        if self.journal is not None:
+            self.journal.scheduled([self.pumpTasks[taskId]["journalId"] for taskId in taskIds])
+        return schedule
+
+    def set_run(self, run, journal=True):
+        '''Set one run with a start and a stop edge for its pumps.'''
+        taskId = str(self.taskCounts)
+        run.setdefault("journalId", run_id(run))
+        self.set_task(taskId, run["startTime"], self.start_run, taskId)
+        self.set_task(taskId, run["stopTime"], self.stop_run, taskId)
+        self.pumpTasks[taskId] = run
+        self.taskCounts += 1
+        if journal and self.journal is not None:
+            self.journal.scheduled([run["journalId"]])
+        return taskId
+
+    def start_run(self, taskId):
+        run = self.pumpTasks[taskId]
+        results = []
+        pumps = run_pumps(run)
+        sensors = self.run_sensors(pumps)
+        run["startedAt"] = time.time()
+        # Journal the start before the pumps go on (see journal.py).
+        if self.journal is not None:
+            self.journal.started(run["journalId"], run["startedAt"])
+        self.volumes.start(taskId, run["startedAt"], run.get("targetFlow"), run.get("targetVolume"), sensors)
+        if run.get("targetFlow") is not None:
+            self.flowControl.start(taskId, run["targetFlow"], pumps, sensors)
+            results.append("[Motor ] Pump {} regulated to {} mlpm.".format(",".join(pumps), run["targetFlow"]))
         else:
-            startTime = taskDict["startTime"]
-            duration = taskDict["duration"]
-            durationUnit = taskDict["durationUnit"]
-            deltaTime = datetime.timedelta(seconds=1)
-            if durationUnit == "sec":
-                deltaTime = datetime.timedelta(seconds=int(duration))
-            elif durationUnit == "min":
-                deltaTime = datetime.timedelta(minutes=int(duration))
-            elif durationUnit == "hr":
-                deltaTime = datetime.timedelta(hours=int(duration))
-            else:
-                print_info("[Motor ] Invalid time unit. Skipping this task.")
-                return
-
-            try:
-                startTimeObj = datetime.datetime.strptime(startTime, "%Y-%m-%d %H:%M:%S")
-                if (startTimeObj - datetime.datetime.now()).total_seconds() < 0:
-                    print_info("[Motor ] Invalid start time. Skipping this task.")
-                    return
-                stopTimeObj = startTimeObj + deltaTime
-                print_info("[Motor ] A task will be execute at {} for {} {}"
-                            .format(startTime, duration, durationUnit))
-                
-                taskA = []
-                taskB = []
-                if targetPump[0]:
-                    taskA = [self.set_task(startTimeObj, self.pumps.runMotorA, True),
-                        self.set_task(stopTimeObj, self.pumps.runMotorA, False)]
-                if targetPump[1]:
-                    taskB = [self.set_task(startTimeObj, self.pumps.runMotorB, True),
-                        self.set_task(stopTimeObj, self.pumps.runMotorB, False)]
-                # taskDict = {"taskA": taskA, "taskB": taskB }
-                self.pumpTasks.append({"taskA": taskA, "taskB": taskB })
-
-            except Exception as e:
-                print_info("[Motor ] Error: {}. Skipping this task.".format(e))
-                return
+            for pump in pumps:
+                results.append(self.pumps.run(pump, True))
+        return "\n".join(map(str, results))
+
+    def stop_run(self, taskId):
+        run = self.pumpTasks.get(taskId)
+        with self.stopLock:
+            if run is None or run.get("stopped"):
+                return "[Motor ] Task {} has already stopped.".format(taskId)
+            run["stopped"] = True
+        results = []
+        if run.get("targetFlow") is not None:
+            samples, rmsError, maxError = self.flowControl.stop(taskId)
+            results.append("[Motor ] Task {} tracking error: rms {:.2f}, max {:.2f} mlpm over {} samples."
+                            .format(taskId, rmsError, maxError, samples))
+        for pump in run_pumps(run):
+            results.append(self.pumps.run(pump, False))
+        stoppedAt = time.time()
+        volume = None
+        summary = self.volumes.stop(taskId, stoppedAt)
+        # Without the flow sensor no sample arrives and the volume is unknown.
+        if summary is not None and summary["samples"] > 0:
+            volume = summary["volume"]
+            results.append(format_summary(summary))
+        if self.journal is not None:
+            self.journal.stopped(run["journalId"], stoppedAt, volume)
+        return "\n".join(map(str, results))
+
+    def on_flow_sample(self, timeStamp, flowRate, flowRates=None):
+        '''
+        Flow sample (time.time(), total mlpm, mlpm of each sensor) from the
+        sensor thread. Runs that reach their target volume are stopped
+        here, without waiting for the scheduler, and their stop edge is
+        cancelled.
+        '''
+        for taskId in self.volumes.update(timeStamp, flowRate, flowRates):
+            self.scheduler.cancel(taskId)
+            print_info("[Motor ] Task {} reached its target volume.".format(taskId))
+            print_info(self.stop_run(taskId))
+        self.flowControl.update(timeStamp, flowRate, flowRates)
+
+    def open_journal(self, path):
+        '''Replay the journal at path, resume the interrupted runs and journal the new ones.'''
+        t0 = time.perf_counter()
+        self.journal = Journal(path)
+        # Resume one second from now so the start edges are not in the past.
+        resume, lost, records = self.journal.replay(time.time() + 1)
+        for run in resume:
+            self.set_run(run)
+        print_info("[Motor ] Replayed {} journal records in {:.1f} ms: {} runs resumed, {} runs lost."
+                    .format(records, (time.perf_counter() - t0)*1000, len(resume), len(lost)))
+        for runId in lost:
+            print_info("[Motor ] Run {} could not be resumed.".format(runId))
+
+    def set_task_stream(self, taskDicts):
+        '''
+        Set one-off and recurring task dicts (see recurrence.py). Only the
+        tasks of the next RECUR_HORIZON_SEC sec are set; a "refill" edge at
+        the start of the last run sets the next batch.
+        '''
+        self.taskStream = TaskStream(taskDicts)
+        for index, message in self.taskStream.errors:
+            print_info("[Motor ] Task {}: {}. Skipping this task.".format(index, message))
+        print_info(self.refill_tasks())
+
+    def refill_tasks(self):
+        with self.taskLock:
+            if self.taskStream is None:
+                return "[Motor ] No task stream."
+            self.prune_runs()
+            until = datetime.datetime.now() + datetime.timedelta(seconds=settings.RECUR_HORIZON_SEC)
+            schedule = self.set_pump_tasks(self.taskStream.take(until))
+            return self.set_refill(schedule)
+
+    def set_refill(self, schedule):
+        if self.taskStream.exhausted:
+            return "[Motor ] All tasks are set."
+        # The stop edge of the last run is still pending while the refill
+        # runs, so the scheduler never looks idle in between.
+        refillTime = schedule.runs[-1]["startTime"] if schedule.runs else None
+        if refillTime is None or not self.scheduler.add_edge("refill", refillTime, self.refill_tasks):
+            refillTime = datetime.datetime.now() + datetime.timedelta(seconds=1)
+            self.scheduler.add_edge("refill", refillTime, self.refill_tasks)
+        return "[Motor ] The next tasks will be set at {}.".format(refillTime.strftime("%Y-%m-%d %H:%M:%S"))
+
+    def reload_tasks(self, taskDicts):
+        '''
+        Replace the tasks with a new task list, changing only the runs that
+        differ. Runs that have started are kept as they are, and new runs
+        overlapping them on the same pump are skipped.
+        '''
+        with self.taskLock:
+            self.prune_runs()
+            now = datetime.datetime.now()
+            # Only runs that have not stopped are left, so these are the running ones.
+            started = {taskId: run for taskId, run in self.pumpTasks.items() if run["startTime"] <= now}
+            self.scheduler.cancel("refill")
+            self.taskStream = TaskStream(taskDicts)
+            for index, message in self.taskStream.errors:
+                print_info("[Motor ] Task {}: {}. Skipping this task.".format(index, message))
+            # Cover every run already set so unchanged runs are kept.
+            until = max([now + datetime.timedelta(seconds=settings.RECUR_HORIZON_SEC)]
+                        + [run["startTime"] for run in self.pumpTasks.values()])
+            schedule = compile_tasks(self.taskStream.take(until))
+
+            wanted = {}
+            skipped = 0
+            for run in schedule.runs:
+                clashes = [pump for pump in PUMPS
+                           if run[pump] and find_overlaps(started, run["startTime"], run["stopTime"], [pump])]
+                if clashes:
+                    skipped += 1
+                    run = dict(run, **{pump: False for pump in clashes})
+                    if not run_pumps(run):
+                        continue
+                wanted[run_key(run)] = run
+            current = {run_key(run): taskId for taskId, run in self.pumpTasks.items() if taskId not in started}
+            removed = [taskId for key, taskId in current.items() if key not in wanted]
+            for taskId in removed:
+                self.delete_task(taskId)
+            added = [self.set_run(run) for key, run in wanted.items() if key not in current]
+
+            # Tasks that have already started show up as past tasks.
+            for task, message in schedule.errors:
+                if message != "start time is in the past":
+                    print_info("[Sched ] Task {}: {}. Skipping this task.".format(task, message))
+            for pump, other, task in schedule.conflicts:
+                print_info("[Sched ] Task {} overlaps task {} on {}.".format(task, other, pump))
+            for task, message in schedule.warnings:
+                print_info("[Sched ] Task {}: {}.".format(task, message))
+            print_info("[Motor ] Tasks reloaded: {} added, {} cancelled, {} unchanged, {} overlapping a started run."
+                        .format(len(added), len(removed), len(wanted) - len(added), skipped))
+            print_info(self.set_refill(schedule))
+
+    def prune_runs(self):
+        '''Forget the runs that have stopped, so a long recurring campaign does not pile them up.'''
+        for taskId in [taskId for taskId, run in self.pumpTasks.items() if run.get("stopped")]:
+            del self.pumpTasks[taskId]
+
+    def delete_task(self, taskId):
+        self.scheduler.cancel(taskId)
+        run = self.pumpTasks.pop(taskId, None)
+        if run is not None and self.journal is not None:
+            self.journal.cancelled(run["journalId"])
 
     def delete_tasks(self):
-        for task in self.pumpTasks:
-            for taskKey in task:
-                for item in task[taskKey]:
-                    item.cancel()
+        with self.taskLock:
+            self.taskStream = None
+            self.scheduler.cancel_all()
+            self.pumpTasks.clear()
         print_info("[Motor ] All tasks are deleted.")
-            # self.pumpTasks.pop(task)
 
     def check_remain_tasks(self):
-        remainTasks = 0
-        for task in self.pumpTasks:
-            for taskKey in task:
-                for item in task[taskKey]:
-                    if item != None and item.is_alive(): 
-                        remainTasks += 1
-        return remainTasks
+        return self.scheduler.pending_count()
+
+    def next_edges(self, n=1):
+        return self.scheduler.next_edges(n)
 
     def shutdown_pumps(self):
-        print_info(self.pumps.runMotorA(False))
-        print_info(self.pumps.runMotorB(False))
+        self.scheduler.stop()
+        for name in self.pumps.names:
+            print_info(self.pumps.run(name, False))
         print_info("[Motor ] All pumps are stopped.")
+        # Runs still open in the journal are resumed on the next start.
+        if self.journal is not None:
+            self.journal.close()
         # GPIO.cleanup()
 
 
 class FlowHandler:
-    def __init__(self) -> None:
+    def __init__(self, startThread=True) -> None:
         # Thread (Logging)
         self.isLogging = False
         self.loggingThread = None
-        self.csv = None
+        self.logWriter = None
+        self.logDir = None
         self.outputEvery = settings.OUTPUT_SEC
+        self.pumpState = None           # Callable returning {"A": bool, "B": bool, ...}, logged in binary logs.
+        self.pumpNames = pump_names()[:8]   # Pumps of the log pump bits
+        self.onSample = None            # Called with (time.time(), total flow rate, flow rate of each sensor) after each reading
 
         # Thread (Sensor)
-        calParams = settings.CAL_PARAMS
-        self.flowSensor = FS1012(calParams)
+        self.sensorConfigs = sensor_configs()
+        self.flowSensors = [FS1012(config["calParams"], address=config["address"],
+                                   pins=(config["tp1"], config["tp2"]), name=config["name"])
+                            for config in self.sensorConfigs]
+        for sensor in self.flowSensors:
+            if not sensor.check_status:
+                print_info("[Sensor] Sensor {} at 0x{:02X}: {}".format(sensor.name, sensor.address, sensor.error))
+        self.flowSensor = self.flowSensors[0]      # TP1, TP2 of the log
+        self.sensorBus = SensorBus(self.flowSensors)
         self.flowSensorTP1 = 0
         self.flowSensorTP2 = 0
         self.flowRate = 0
-        self.sensorThread = LoopThread(0.5, self.read_sensor)
-        self.sensorThread.setDaemon(True)
-        self.sensorThread.start()
+        self.flowRates = [0.0]*len(self.flowSensors)
+        self.sensorOk = False
+        # Every reading as a whole; the log, the status and the window stats read it from here.
+        self.flowBuffer = create_flow_buffer(len(self.flowSensors))
+        self.sensorThread = None
+        if startThread:
+            self.sensorThread = LoopThread(settings.SENSOR_SEC, self.read_sensor, name="sensor")
+            self.sensorThread.setDaemon(True)
+            self.sensorThread.start()
         print_info("[Sensor] The sensor reading starts.")
 
     def check_sensor(self):
-        return self.flowSensor.check_status
+        return any(sensor.check_status for sensor in self.flowSensors)
 
     def read_sensor(self):
-        if self.check_sensor():
-            self.flowSensorTP1 = self.flowSensor.tp1_value
-            self.flowSensorTP2 = self.flowSensor.tp2_value
-            self.flowRate = self.flowSensor.flow_rate       # Need to execute after updating tp1, tp2.
+        self.sensorOk = self.check_sensor()
+        if self.sensorOk:
+            # One reading of every sensor (see SensorBus.snapshot).
+            samples = self.sensorBus.snapshot()
+            self.flowSensorTP1, self.flowSensorTP2 = samples[0].tp1, samples[0].tp2
+            self.flowRates = [sample.flowRate for sample in samples]
+            self.flowRate = sum(self.flowRates)
+            timeStamp = samples[0].time
+            self.flowBuffer.append(timeStamp, self.flowSensorTP1, self.flowSensorTP2, self.flowRate, samples[0].codes,
+                                   sum(sample.rawFlowRate for sample in samples), self.flowRates)
+            if self.onSample is not None:
+                self.onSample(timeStamp, self.flowRate, self.flowRates)
         else:
             self.flowSensorTP1 = 0
             self.flowSensorTP2 = 0
             self.flowRate = 0
+            self.flowRates = [0.0]*len(self.flowSensors)
+            self.flowBuffer.append(time.time(), 0, 0, 0, flows=self.flowRates)
     
     def stop_read_sensor(self):
         if self.sensorThread is not None and self.sensorThread.is_alive():
             self.sensorThread.stop()
-            print_info("[Sensor] The sensor reading stops.")
-        return self.sensorThread.isStopped()
+            self.sensorThread.join(1)
+        print_info("[Sensor] The sensor reading stops.")
+        return self.sensorThread is None or self.sensorThread.isStopped()
 
-    def start_logging(self, logDir):
+    def start_logging(self, logDir, startThread=True):
         self.logDir = logDir
         try:
-            timeStamp = datetime.datetime.now().strftime("%Y%m%d_%H-%M-%S")
-            self.csv = open(self.logDir + "/flow_log_" + timeStamp + ".csv", "w")
-            self.write_csv_header()
-            self.loggingThread = LoopThread(self.outputEvery, self.record_csv)
-            self.loggingThread.setDaemon(True)
-            self.loggingThread.start()
+            # One flow column per sensor when there are several.
+            sensorNames = [sensor.name for sensor in self.flowSensors] if len(self.flowSensors) > 1 else None
+            self.logWriter = create_log_writer(self.logDir, sensorNames)
+            self.logWriter.start()
+            if startThread:
+                self.loggingThread = LoopThread(self.outputEvery, self.record_csv, name="logging")
+                self.loggingThread.setDaemon(True)
+                self.loggingThread.start()
             print_info("[Sensor] The logging starts.")
             return True
         except FileNotFoundError:
@@ -198,33 +377,35 @@ class FlowHandler:
     def stop_logging(self):
         if self.loggingThread is not None and self.loggingThread.is_alive():
             self.loggingThread.stop()
-            if self.csv is not None:
-                self.csv.close()
+            self.loggingThread.join(1)
+        if self.logWriter is not None:
+            self.logWriter.stop()
+            self.logWriter = None
             print_info("[Sensor] The logging stops.")
-            return self.loggingThread.isStopped()
-        else:
-            return True
-
-    def write_csv_header(self):
-        self.csv.write("Time,TP1(mV),TP2(mV),Flow_Rate")
-        self.csv.seek(self.csv.tell() - 1, os.SEEK_SET)
-        self.csv.write("\n")
+        return True
 
     def record_csv(self):
-        if time.localtime().tm_min%60 == 0 and time.localtime().tm_sec == 0:
-            timeStamp = datetime.datetime.now().strftime("%Y%m%d_%H-%M-%S")
-            self.csv = open(self.logDir + "/flow_log_" + timeStamp + ".csv", "w")
-            self.write_csv_header()
-        
-        self.csv.write(datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")+",")
-        self.csv.write("{:.2f},{:.2f},{:.2f}".format(self.flowSensorTP1*1000,self.flowSensorTP2*1000,self.flowRate))
-        self.csv.write("\n")
+        row = self.flowBuffer.latest()
+        if row is None:
+            return
+        pumps = pump_bits(self.pumpState(), self.pumpNames) if self.pumpState is not None else 0
+        self.logWriter.write((time.time(), row.tp1, row.tp2, row.flowRate, row.codes, pumps, row.flowRates,
+                              row.rawFlowRate))
 
     def force_stop_threads(self):
         self.stop_logging()
-        time.sleep(0.5)
         self.stop_read_sensor()
-        time.sleep(0.5)
+        self.report_loop_stats()
+
+    def report_loop_stats(self):
+        for stats in loop_stats().values():
+            print_info(stats.report())
+        if self.logDir is not None:
+            timeStamp = datetime.datetime.now().strftime("%Y%m%d_%H-%M-%S")
+            try:
+                write_loop_stats(os.path.join(self.logDir, "loop_stats_" + timeStamp + ".json"))
+            except OSError as e:
+                print_info("[Sensor] Cannot write the loop statistics: {}".format(e))
 
 
 class Main():
@@ -232,12 +413,32 @@ class Main():
         parser = argparse.ArgumentParser()
         parser.add_argument("taskJson",
                             help="Choose the JSON file where stores the tasks.")
+        parser.add_argument("--backend", choices=["rpi", "sim"], default=None,
+                            help="Hardware backend (default: settings.HW_BACKEND).")
+        parser.add_argument("--asyncio", action="store_true",
+                            help="Run sensing, logging and pump tasks on one asyncio event loop.")
+        parser.add_argument("--metrics-port", type=int, default=None,
+                            help="Serve /metrics and /status on this port (default: settings.METRICS_PORT, 0 = off).")
+        parser.add_argument("--profile-startup", action="store_true",
+                            help="Report the import and init time of each module once the tasks are set.")
         args = parser.parse_args()
+        self.useAsyncio = args.asyncio
+        self.metricsPort = settings.METRICS_PORT if args.metrics_port is None else args.metrics_port
+        self.metricsServer = None
+        self.sensorHandler = None
+        self.startedAt = time.time()
+        if args.backend is not None:
+            set_backend(args.backend)
         self.taskJson = args.taskJson
         print_info("[Main  ] Using the task file: {}".format(self.taskJson))
 
-        with open(self.taskJson, 'r') as file:
-            jsonData = json.load(file)
+        with open(self.taskJson, 'rb') as file:
+            data = file.read()
+        jsonData = json.loads(data)
+        self.taskFileStat = self.stat_task_file()
+        self.taskFileDigest = hashlib.sha1(data).digest()
+        self.reloadThread = None
+        self.controlLog = None
 
         print_info("[Main  ] Finished reading json file.")
 
@@ -245,39 +446,153 @@ class Main():
         self.setLogging = jsonData["flowRateLogging"]
         self.setLoggingLocation = jsonData["flowRateLoggingLocation"]
         self.pumpTasks = jsonData["pumpTasks"]
+        startprofile.mark("arguments and task file")
 
-    def run(self):
-        self.pumpHandler = MotorHandler()
+    def run(self, scheduler=None, startThreads=True):
+        self.pumpHandler = MotorHandler(scheduler)
         # self.pumpHandler.shutdown_pumps()
-        
-        if self.haveSensor and self.setLogging:
-            self.sensorHandler = FlowHandler()
-            self.sensorHandler.start_logging(self.setLoggingLocation)
+        startprofile.mark("pumps")
 
-        for task in self.pumpTasks:
-            self.pumpHandler.set_pump_task(task)
+        # The pump edges are set before the sensor is started, so the
+        # calibration table (numpy) and the ADC do not delay them.
+        if settings.JOURNAL_FILE:
+            self.pumpHandler.open_journal(settings.JOURNAL_FILE)
+            startprofile.mark("journal")
+        self.pumpHandler.set_task_stream(self.pumpTasks)
+        startprofile.mark("tasks")
+        startprofile.milestone("First pump edges scheduled")
+
+        if self.haveSensor and self.setLogging:
+            self.sensorHandler = FlowHandler(startThreads)
+            self.sensorHandler.pumpState = self.pumpHandler.check_pump_status
+            self.sensorHandler.start_logging(self.setLoggingLocation, startThreads)
+            self.sensorHandler.onSample = self.pumpHandler.on_flow_sample
+            self.pumpHandler.sensorPumps = [config["pumps"] for config in self.sensorHandler.sensorConfigs]
+            self.pumpHandler.volumes.summaryDir = self.sensorHandler.logDir
+            if self.sensorHandler.logDir is not None:
+                self.controlLog = ControlLogWriter(self.sensorHandler.logDir)
+                self.controlLog.start()
+                self.pumpHandler.flowControl.logWriter = self.controlLog
+        elif any(isinstance(task, dict) and "targetVolume" in task for task in self.pumpTasks):
+            print_info("[Main  ] Target volumes need the flow sensor and logging. These tasks run for their full duration.")
+        startprofile.mark("sensor and logging")
+
+        if startThreads and settings.TASK_RELOAD_SEC > 0:
+            self.reloadThread = LoopThread(settings.TASK_RELOAD_SEC, self.check_task_file, name="reload")
+            self.reloadThread.start()
+        if self.metricsPort:
+            from metrics import MetricsServer
+            try:
+                self.metricsServer = MetricsServer(self.status, settings.METRICS_HOST, self.metricsPort)
+                self.metricsServer.start()
+                print_info("[Main  ] Serving metrics on http://{}:{}/metrics and /status."
+                            .format(*self.metricsServer.address))
+            except OSError as e:
+                print_info("[Main  ] Cannot serve metrics: {}".format(e))
+            startprofile.mark("metrics")
+        for line in startprofile.report():
+            print_info(line)
+
+    def status(self):
+        '''Snapshot of the controller for the metrics endpoint, from in-memory values only.'''
+        now = time.time()
+        pumpHandler = self.pumpHandler
+        status = {
+            "time":         now,
+            "uptime":       now - self.startedAt,
+            "sensor":       None,
+            "pumps":        pumpHandler.check_pump_status(),
+            "flowControl":  {"duty": pumpHandler.flowControl.duty, "targets": len(pumpHandler.flowControl.targets)},
+            "tasks":        {"pendingEdges": pumpHandler.check_remain_tasks(), "runs": len(pumpHandler.pumpTasks),
+                             "running": len(pumpHandler.volumes.running)},
+            "loops":        [stats.snapshot() for stats in loop_stats().values()],
+            "logs":         {},
+        }
+        sensorHandler = self.sensorHandler
+        if sensorHandler is not None:
+            flowBuffer = sensorHandler.flowBuffer
+            row = flowBuffer.latest()
+            windows = flowBuffer.all_stats() if row is not None else {}
+            if row is None:
+                row = FlowRow(None, 0, 0, 0, (0, 0, 0), (0.0,)*flowBuffer.sensors, 0)
+            status["sensor"] = {"ok": sensorHandler.sensorOk, "flowRate": row.flowRate,
+                                "rawFlowRate": row.rawFlowRate, "tp1": row.tp1, "tp2": row.tp2,
+                                "sampleTime": row.time,
+                                "sensors": [{"name": sensor.name, "address": sensor.address, "ok": sensor.check_status,
+                                             "flowRate": flowRate}
+                                            for sensor, flowRate in zip(sensorHandler.flowSensors, row.flowRates)],
+                                "windows": [{"sec": size*settings.SENSOR_SEC, "mean": mean, "min": minFlow,
+                                             "max": maxFlow, "std": std}
+                                            for size, (mean, minFlow, maxFlow, std) in windows.items()]}
+            if sensorHandler.logWriter is not None:
+                status["logs"]["flow"] = sensorHandler.logWriter.snapshot()
+        if self.controlLog is not None:
+            status["logs"]["control"] = self.controlLog.snapshot()
+        for stats in status["logs"].values():
+            stats["rowsPerSec"] = stats["rowsWritten"]/status["uptime"] if status["uptime"] > 0 else 0.0
+        return status
+
+    def stat_task_file(self):
+        try:
+            stat = os.stat(self.taskJson)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def check_task_file(self):
+        '''Reload the pump tasks if the task file has changed.'''
+        fileStat = self.stat_task_file()
+        if fileStat is None or fileStat == self.taskFileStat:
+            return
+        self.taskFileStat = fileStat
+        try:
+            with open(self.taskJson, 'rb') as file:
+                data = file.read()
+            digest = hashlib.sha1(data).digest()
+            if digest == self.taskFileDigest:
+                return
+            pumpTasks = json.loads(data)["pumpTasks"]
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            print_info("[Main  ] Cannot reload the task file: {}".format(e))
+            return
+        self.taskFileDigest = digest
+        print_info("[Main  ] The task file has changed. Reloading the tasks.")
+        self.pumpTasks = pumpTasks
+        self.pumpHandler.reload_tasks(self.pumpTasks)
 
     def stop(self):
+        if self.metricsServer is not None:
+            self.metricsServer.stop()
+        if self.reloadThread is not None:
+            self.reloadThread.stop()
+            self.reloadThread.join()
         if self.haveSensor and self.setLogging:
             self.sensorHandler.force_stop_threads()
+        if self.controlLog is not None:
+            self.controlLog.stop()
         self.pumpHandler.delete_tasks()
         self.pumpHandler.shutdown_pumps()
 
 if __name__ == "__main__":
+    main = None
     try:
         main = Main()
-        main.run()
-    
-        while True:
-            if main.pumpHandler.check_remain_tasks() < 1:
-                print_info("[Main  ] No task to run.")
-                break
-            time.sleep(5)
+        if main.useAsyncio:
+            from async_runtime import run_async
+            run_async(main, print_info)
+        else:
+            main.run()
+            while True:
+                if main.pumpHandler.check_remain_tasks() < 1:
+                    print_info("[Main  ] No task to run.")
+                    break
+                time.sleep(5)
 
     except Exception as e:
         print_info(e)
     
     finally:
-        print_info("[Main  ] Exiting the program.")
-        main.stop()
-        GPIO.cleanup()
\ No newline at end of file
+        if main is not None and not main.useAsyncio:
+            print_info("[Main  ] Exiting the program.")
+            main.stop()
+        get_backend().GPIO.cleanup()
\ No newline at end of file
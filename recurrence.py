@@ -0,0 +1,171 @@
+'''
+Recurring pump tasks.
+
+A task in "pumpTasks" may carry a "repeat" rule instead of being listed
+once per sampling window:
+
+    {
+        "startTime": "2022-12-31 00:00:00",
+        "duration": 10,
+        "durationUnit": "min",
+        "pumpA": true,
+        "pumpB": false,
+        "repeat": {
+            "every": 1,
+            "everyUnit": "hr",
+            "until": "2023-01-21 00:00:00",
+            "weekdays": ["Mon", "Tue", "Wed", "Thu", "Fri"],
+            "hours": [8, 9, 10, 11, 12, 13, 14, 15, 16, 17]
+        }
+    }
+
+The task runs at startTime + k*every for k = 0, 1, ... up to "until"
+(inclusive) or for "count" repetitions. "weekdays" and "hours" are optional
+masks on the start of each repetition; masked repetitions still count.
+
+Rules are expanded lazily: TaskStream merges every rule and the one-off
+tasks into one stream in start time order and only materializes the
+occurrences of the next batch, so memory and startup time do not depend
+on the length of the campaign.
+'''
+import datetime
+import heapq
+import math
+from schedule import DURATION_UNITS, parse_time
+
+WEEKDAYS = ("Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun")
+
+def parse_rule(taskDict):
+    '''
+    Validate the "repeat" rule of a task. Returns (start, duration, every,
+    count, until, weekdays, hours) with the times as datetime/timedelta,
+    or raises ValueError.
+    '''
+    rule = taskDict["repeat"]
+    if not isinstance(rule, dict):
+        raise ValueError("repeat is not an object")
+    unit = DURATION_UNITS.get(rule.get("everyUnit"))
+    if unit is None:
+        raise ValueError("invalid repeat unit {!r}".format(rule.get("everyUnit")))
+    try:
+        every = int(rule.get("every"))
+        duration = int(taskDict["duration"])*DURATION_UNITS[taskDict["durationUnit"]]
+    except (KeyError, TypeError, ValueError):
+        raise ValueError("invalid duration or repeat interval")
+    if every <= 0:
+        raise ValueError("repeat interval must be positive")
+    every *= unit
+    if not 0 < duration < every:
+        raise ValueError("duration must be shorter than the repeat interval")
+    if ("count" in rule) == ("until" in rule):
+        raise ValueError("repeat needs either count or until")
+    count = rule.get("count")
+    if count is not None and (not isinstance(count, int) or count <= 0):
+        raise ValueError("invalid repeat count {!r}".format(count))
+    until = parse_time(rule["until"]) if "until" in rule else None
+    weekdays = rule.get("weekdays")
+    if weekdays is not None:
+        if not weekdays or any(day not in WEEKDAYS for day in weekdays):
+            raise ValueError("invalid weekdays {!r}".format(weekdays))
+        weekdays = {WEEKDAYS.index(day) for day in weekdays}
+    hours = rule.get("hours")
+    if hours is not None:
+        if not hours or any(not isinstance(hour, int) or not 0 <= hour < 24 for hour in hours):
+            raise ValueError("invalid hours {!r}".format(hours))
+        hours = set(hours)
+    return (parse_time(taskDict["startTime"]), datetime.timedelta(seconds=duration),
+            every, count, until, weekdays, hours)
+
+def expand_task(taskDict, name, after=None):
+    '''
+    Generate the occurrences of a recurring task starting after `after`
+    (datetime, default: now) as (start, stop, taskDict) in start time order.
+    The occurrence dicts have no "repeat" rule and are named "<name>#<k>".
+    Raises ValueError for an invalid rule.
+    '''
+    start, duration, every, count, until, weekdays, hours = parse_rule(taskDict)
+    after = datetime.datetime.now() if after is None else after
+    step = datetime.timedelta(seconds=every)
+    # Skip the past repetitions without generating them.
+    k = max(0, math.ceil((after - start).total_seconds()/every))
+    # The weekday and hour masks repeat after lcm(every, 1 week); stop if
+    # no repetition matches within one such period.
+    period = math.lcm(every, 7*24*3600)//every
+    return _occurrences(taskDict, name, start, duration, step, k, count, until, weekdays, hours, period)
+
+def _occurrences(taskDict, name, start, duration, step, k, count, until, weekdays, hours, period):
+    missed = 0
+    while count is None or k < count:
+        occurStart = start + k*step
+        if until is not None and occurStart > until:
+            return
+        if ((weekdays is None or occurStart.weekday() in weekdays)
+                and (hours is None or occurStart.hour in hours)):
+            missed = 0
+            occurrence = {key: value for key, value in taskDict.items() if key != "repeat"}
+            occurrence["startTime"] = occurStart
+            occurrence["name"] = "{}#{}".format(name, k)
+            yield occurStart, occurStart + duration, occurrence
+        else:
+            missed += 1
+            if missed > period:
+                return
+        k += 1
+
+
+class TaskStream:
+    '''
+    The one-off and recurring tasks of a task list merged in start time
+    order. take() returns the task dicts of the next batch, ready for
+    schedule.compile_tasks.
+    '''
+    def __init__(self, taskDicts, after=None):
+        self.errors = []                # (task index, message) of invalid rules
+        streams = []
+        oneOff = []
+        for index, taskDict in enumerate(taskDicts):
+            if isinstance(taskDict, dict) and "repeat" in taskDict:
+                try:
+                    streams.append(expand_task(taskDict, str(index), after))
+                except (KeyError, ValueError) as e:
+                    self.errors.append((index, str(e)))
+            else:
+                oneOff.append(self._one_off(taskDict, str(index)))
+        # Invalid one-off tasks sort first so compile_tasks reports them at once.
+        oneOff.sort(key=lambda item: item[0])
+        self._stream = heapq.merge(oneOff, *streams, key=lambda item: item[0])
+        self._next = next(self._stream, None)
+
+    @staticmethod
+    def _one_off(taskDict, name):
+        try:
+            start = parse_time(taskDict["startTime"])
+            stop = start + datetime.timedelta(
+                seconds=int(taskDict["duration"])*DURATION_UNITS[taskDict["durationUnit"]])
+        except (KeyError, TypeError, ValueError):
+            start = stop = datetime.datetime.min
+        if isinstance(taskDict, dict):
+            taskDict = dict(taskDict, name=name)
+        return start, stop, taskDict
+
+    @property
+    def exhausted(self):
+        return self._next is None
+
+    def take(self, until):
+        '''
+        Task dicts starting up to `until` (datetime), at least one if any is
+        left. The batch only ends where no task of it is running, so runs of
+        consecutive batches never overlap.
+        '''
+        batch = []
+        latestStop = datetime.datetime.min
+        while self._next is not None:
+            start, stop, taskDict = self._next
+            # Invalid tasks (sorted first with datetime.min) do not count.
+            if latestStop > datetime.datetime.min and start > until and start > latestStop:
+                break
+            batch.append(taskDict)
+            latestStop = max(latestStop, stop)
+            self._next = next(self._stream, None)
+        return batch
@@ -0,0 +1,282 @@
+'''
+Compile pump tasks (task.json "pumpTasks" entries) into runs and edges.
+
+Every task is validated, then the tasks are swept in start time order
+while keeping the last run of each pump. A task that starts before the
+current run of its pump ends overlaps it: with overlap "merge" the run is
+extended (the pump stays on until the latest stop), with "reject" the
+task is dropped. Tasks touching end to start are merged as well, so a
+stop edge never switches off a pump that another task starts at the same
+time. Runs with the same start and stop on several pumps are combined, so
+each run has the same shape as a MotorHandler.pumpTasks entry. A task
+may set a "targetFlow" (mlpm) for the flow control, at most PUMP_FULL_FLOW
+per pump of the task; a merged run keeps the highest target of its tasks. A task may also set a "targetVolume"
+(ml): its run then stops as soon as the sampled volume reaches the target,
+the duration being the longest it may run. A merged run has no target
+volume and runs until its stop time, and neither has a run that overlaps
+another run measured by the same flow sensor, since its volume would
+include the flow of the other run.
+
+Usage:
+    python3 schedule.py task.json [--overlap reject] [--edges]
+'''
+import argparse
+import datetime
+import json
+import sys
+import time
+import settings
+from channels import pump_names, pump_sensors
+
+TIME_FORMAT     = "%Y-%m-%d %H:%M:%S"
+DURATION_UNITS  = {"sec": 1, "min": 60, "hr": 3600}
+PUMPS           = tuple("pump" + name for name in pump_names())     # settings.PUMP_CHANNELS
+OVERLAPS        = ("merge", "reject")
+
+def parse_time(text):
+    '''Parse a "%Y-%m-%d %H:%M:%S" start time (datetimes are returned as is).'''
+    if isinstance(text, datetime.datetime):
+        return text
+    # fromisoformat is much faster than strptime; the length and separator
+    # checks keep it to the task.json format.
+    if not isinstance(text, str) or len(text) != 19 or text[10] != " ":
+        raise ValueError("invalid start time {!r}".format(text))
+    try:
+        return datetime.datetime.fromisoformat(text)
+    except ValueError:
+        raise ValueError("invalid start time {!r}".format(text))
+
+def parse_task(taskDict):
+    '''
+    Validate one task dict. Returns (start, stop, pumps, targetFlow,
+    targetVolume) with the times as time.time() values, or raises ValueError.
+    '''
+    if not isinstance(taskDict, dict):
+        raise ValueError("task is not an object")
+    missing = [key for key in ("startTime", "duration", "durationUnit") if key not in taskDict]
+    if missing:
+        raise ValueError("missing {}".format(", ".join(missing)))
+    unknown = [key for key in taskDict if key.startswith("pump") and key not in PUMPS]
+    if unknown:
+        raise ValueError("unknown pump {}".format(", ".join(unknown)))
+    if "repeat" in taskDict:
+        raise ValueError("recurring task must be expanded first (see recurrence.py)")
+    pumps = tuple(pump for pump in PUMPS if taskDict.get(pump) is True)
+    if not pumps:
+        raise ValueError("no pump is set to true")
+    unit = DURATION_UNITS.get(taskDict["durationUnit"])
+    if unit is None:
+        raise ValueError("invalid time unit {!r}".format(taskDict["durationUnit"]))
+    try:
+        duration = int(taskDict["duration"])
+    except (TypeError, ValueError):
+        raise ValueError("invalid duration {!r}".format(taskDict["duration"]))
+    if duration <= 0:
+        raise ValueError("duration must be positive")
+    targetFlow = taskDict.get("targetFlow")
+    if targetFlow is not None and not is_positive(targetFlow):
+        raise ValueError("invalid target flow {!r}".format(targetFlow))
+    if targetFlow is not None and targetFlow > settings.PUMP_FULL_FLOW*len(pumps):
+        raise ValueError("target flow {} mlpm is above the {} mlpm of {} pump(s) at full duty (PUMP_FULL_FLOW)"
+                         .format(targetFlow, settings.PUMP_FULL_FLOW*len(pumps), len(pumps)))
+    targetVolume = taskDict.get("targetVolume")
+    if targetVolume is not None and not is_positive(targetVolume):
+        raise ValueError("invalid target volume {!r}".format(targetVolume))
+    start = parse_time(taskDict["startTime"]).timestamp()
+    return start, start + duration*unit, pumps, targetFlow, targetVolume
+
+def is_positive(value):
+    return not isinstance(value, bool) and isinstance(value, (int, float)) and value > 0
+
+def run_pumps(run):
+    '''Names ("A", "B", ...) of the pumps switched by a run dict.'''
+    return [pump[4:] for pump in PUMPS if run.get(pump)]
+
+def find_overlaps(pumpTasks, startTimeObj, stopTimeObj, pumps):
+    '''
+    Task ids in pumpTasks (taskId -> {"startTime", "stopTime", "pumpA",
+    "pumpB", ...}) that overlap the given interval on any of the pumps.
+    '''
+    return [taskId for taskId, task in pumpTasks.items()
+            if task["startTime"] < stopTimeObj and startTimeObj < task["stopTime"]
+            and any(task.get(pump) for pump in pumps)]
+
+
+def max_target(a, b):
+    '''The higher of two target flows, either of which may be None.'''
+    if a is None or b is None:
+        return a if b is None else b
+    return max(a, b)
+
+
+class Schedule:
+    '''
+    Result of compile_tasks.
+
+    Tasks are identified by their "name" if they have one, else by their
+    index in the task list.
+
+    runs:       Merged pump runs in start time order, each a dict with
+                "startTime", "stopTime" (datetime), "pumpA", "pumpB", ...
+                (one key per pump of PUMPS),
+                "targetFlow" (mlpm or None), "targetVolume" (ml or None)
+                and "tasks" (the source tasks).
+    errors:     (task, message) of the skipped tasks.
+    conflicts:  (pump, earlier task, task) of each merged overlap.
+    warnings:   (task, message) of the tasks kept with a change.
+    '''
+    def __init__(self, taskCount=0, overlap="merge"):
+        self.taskCount  = taskCount
+        self.overlap    = overlap
+        self.runs       = []
+        self.errors     = []
+        self.conflicts  = []
+        self.warnings   = []
+
+    def edges(self):
+        '''Pump edges of every run as (datetime, pump, value), earliest first.'''
+        edges = []
+        for run in self.runs:
+            for pump in PUMPS:
+                if run[pump]:
+                    edges.append((run["startTime"], pump, True))
+                    edges.append((run["stopTime"], pump, False))
+        edges.sort(key=lambda edge: (edge[0], edge[1]))
+        return edges
+
+    def report(self):
+        lines = ["[Sched ] {} tasks -> {} runs, {} edges, {} errors, {} overlaps ({})".format(
+            self.taskCount, len(self.runs), sum(len(run_pumps(run)) for run in self.runs)*2,
+            len(self.errors), len(self.conflicts), self.overlap)]
+        for index, message in self.errors:
+            lines.append("[Sched ] Task {}: {}. Skipping this task.".format(index, message))
+        for pump, other, index in self.conflicts:
+            lines.append("[Sched ] Task {} overlaps task {} on {}.".format(index, other, pump))
+        for index, message in self.warnings:
+            lines.append("[Sched ] Task {}: {}.".format(index, message))
+        return "\n".join(lines)
+
+
+def compile_tasks(taskDicts, now=None, overlap=None):
+    '''
+    Validate, sort and merge task dicts into a Schedule. Tasks starting
+    before now (default: the current time) are skipped. O(n log n).
+    '''
+    overlap = overlap or settings.SCHEDULE_OVERLAP
+    if overlap not in OVERLAPS:
+        raise ValueError("overlap must be one of {}".format(", ".join(OVERLAPS)))
+    now = time.time() if now is None else now.timestamp()
+    schedule = Schedule(len(taskDicts), overlap)
+
+    labels = [taskDict.get("name", index) if isinstance(taskDict, dict) else index
+              for index, taskDict in enumerate(taskDicts)]
+    tasks = []
+    for index, taskDict in enumerate(taskDicts):
+        try:
+            start, stop, pumps, targetFlow, targetVolume = parse_task(taskDict)
+        except ValueError as e:
+            schedule.errors.append((labels[index], str(e)))
+            continue
+        if start <= now:
+            schedule.errors.append((labels[index], "start time is in the past"))
+            continue
+        tasks.append((start, stop, index, pumps, targetFlow, targetVolume))
+    tasks.sort()
+
+    # Last run of each pump: [start, stop, task indices, index of the task
+    # with the latest stop, target flow, target volume].
+    runs = {pump: [] for pump in PUMPS}
+    for start, stop, index, pumps, targetFlow, targetVolume in tasks:
+        clashes = [pump for pump in pumps if runs[pump] and start < runs[pump][-1][1]]
+        if clashes and overlap == "reject":
+            schedule.errors.append((labels[index], "overlaps task {} on {}".format(
+                labels[runs[clashes[0]][-1][3]], clashes[0])))
+            continue
+        for pump in clashes:
+            schedule.conflicts.append((pump, labels[runs[pump][-1][3]], labels[index]))
+        for pump in pumps:
+            pumpRuns = runs[pump]
+            if pumpRuns and start <= pumpRuns[-1][1]:
+                run = pumpRuns[-1]
+                run[2].append(index)
+                if stop > run[1]:
+                    run[1] = stop
+                    run[3] = index
+                run[4] = max_target(run[4], targetFlow)
+                run[5] = None
+            else:
+                pumpRuns.append([start, stop, [index], index, targetFlow, targetVolume])
+
+    combined = {}
+    for pump in PUMPS:
+        for start, stop, indices, _, targetFlow, targetVolume in runs[pump]:
+            tasks = [labels[index] for index in indices]
+            run = combined.get((start, stop))
+            if run is None:
+                combined[(start, stop)] = {
+                    "startTime": datetime.datetime.fromtimestamp(start),
+                    "stopTime": datetime.datetime.fromtimestamp(stop),
+                    **{other: other == pump for other in PUMPS}, "targetFlow": targetFlow,
+                    "targetVolume": targetVolume, "tasks": tasks}
+            else:
+                run[pump] = True
+                run["targetFlow"] = max_target(run["targetFlow"], targetFlow)
+                # The volume is measured on the sensors of the run's pumps,
+                # so only the task that runs all of them keeps its target volume.
+                if run["tasks"] != tasks:
+                    run["targetVolume"] = None
+                run["tasks"] = list(dict.fromkeys(run["tasks"] + tasks))
+    schedule.runs = [combined[key] for key in sorted(combined)]
+    drop_shared_volumes(schedule)
+    return schedule
+
+def drop_shared_volumes(schedule):
+    '''
+    Clear the target volume of the runs that overlap another run measured
+    by one of their flow sensors, with a warning in schedule.warnings.
+    '''
+    runs = schedule.runs
+    sensors = [set(pump_sensors(run_pumps(run))) for run in runs]
+    for i, run in enumerate(runs):
+        # The runs are in start time order: stop at the first one starting after this one.
+        for j in range(i + 1, len(runs)):
+            other = runs[j]
+            if other["startTime"] >= run["stopTime"]:
+                break
+            if not sensors[i] & sensors[j]:
+                continue
+            for first, second in ((run, other), (other, run)):
+                if first["targetVolume"] is not None:
+                    first["targetVolume"] = None
+                    schedule.warnings.append((",".join(map(str, first["tasks"])),
+                        "target volume dropped, the run overlaps task {} on the same flow sensor"
+                        .format(",".join(map(str, second["tasks"])))))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check the pump tasks of a task file.")
+    parser.add_argument("taskJson", help="JSON file with the pumpTasks list.")
+    parser.add_argument("--overlap", choices=OVERLAPS, default=None,
+                        help="Merge or reject overlapping tasks (default: settings.SCHEDULE_OVERLAP).")
+    parser.add_argument("--now", default=None,
+                        help="Check against this time (\"{}\") instead of the current time.".format(TIME_FORMAT))
+    parser.add_argument("--edges", action="store_true", help="Print the compiled edge list.")
+    args = parser.parse_args()
+
+    from recurrence import TaskStream
+    with open(args.taskJson, 'r') as file:
+        taskDicts = json.load(file)["pumpTasks"]
+    now = parse_time(args.now) if args.now else None
+    t0 = time.perf_counter()
+    # Expand the recurring tasks over the whole campaign.
+    stream = TaskStream(taskDicts, now)
+    schedule = compile_tasks(stream.take(datetime.datetime.max), now, args.overlap)
+    elapsed = time.perf_counter() - t0
+    for index, message in stream.errors:
+        print("[Sched ] Task {}: {}. Skipping this task.".format(index, message))
+    print(schedule.report())
+    print("[Sched ] Compiled in {:.3f} s.".format(elapsed))
+    if args.edges:
+        for execTime, pump, value in schedule.edges():
+            print("{} {} {}".format(execTime.strftime(TIME_FORMAT), pump, "ON" if value else "OFF"))
+    sys.exit(1 if stream.errors or schedule.errors or schedule.conflicts else 0)
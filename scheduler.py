@@ -0,0 +1,162 @@
+import heapq
+import itertools
+import datetime
+import time
+from threading import Thread, Condition
+
+class EdgeQueue:
+    '''
+    Pending pump edges of every task.
+
+    Edges are kept in a heap ordered by execution time. Each task id owns a
+    token; cancelling a task drops its token so the remaining heap entries
+    become stale and are discarded when they reach the top (or when the heap
+    is compacted). This keeps cancel and the pending count O(1) and push/pop
+    O(log n) however many tasks are set. Subclasses run the due edges and
+    are woken up through _notify() when the earliest edge changes.
+    '''
+    def __init__(self):
+        self._cond      = Condition()
+        self._heap      = []            # [execTime, seq, token, taskId, func, args]
+        self._tokens    = {}            # taskId -> token ([pending edge count])
+        self._pending   = 0             # Number of live edges in the heap
+        self._counter   = itertools.count()
+
+    def _notify(self):
+        self._cond.notify()
+
+    def add_edge(self, taskId, execTimeObj, func, *args):
+        '''
+        Schedule func(*args) at execTimeObj (datetime) under taskId.
+        Returns False if the time is already in the past.
+        '''
+        execTime = execTimeObj.timestamp()
+        if execTime <= time.time():
+            return False
+        with self._cond:
+            token = self._tokens.get(taskId)
+            if token is None:
+                token = self._tokens[taskId] = [0]
+            token[0] += 1
+            self._pending += 1
+            heapq.heappush(self._heap, [execTime, next(self._counter), token, taskId, func, args])
+            if self._heap[0][2] is token:
+                self._notify()
+        return True
+
+    def cancel(self, taskId):
+        '''Cancel every pending edge of taskId. Returns the number of edges cancelled.'''
+        with self._cond:
+            token = self._tokens.pop(taskId, None)
+            if token is None:
+                return 0
+            self._pending -= token[0]
+            self._compact()
+            self._notify()
+            return token[0]
+
+    def cancel_all(self):
+        with self._cond:
+            cancelled = self._pending
+            self._heap.clear()
+            self._tokens.clear()
+            self._pending = 0
+            self._notify()
+            return cancelled
+
+    def pending_count(self, taskId=None):
+        '''Number of pending edges in total, or for one task id.'''
+        with self._cond:
+            if taskId is None:
+                return self._pending
+            token = self._tokens.get(taskId)
+            return token[0] if token is not None else 0
+
+    def has_task(self, taskId):
+        return taskId in self._tokens
+
+    def next_edges(self, n=1):
+        '''
+        Return the next n live edges as (datetime, taskId, funcName, args),
+        earliest first.
+        '''
+        with self._cond:
+            live = (item for item in self._heap if self._is_live(item))
+            edges = heapq.nsmallest(n, live)
+        return [(datetime.datetime.fromtimestamp(item[0]), item[3], item[4].__name__, item[5])
+                for item in edges]
+
+    def next_time(self):
+        '''Execution time (time.time()) of the earliest live edge, or None.'''
+        with self._cond:
+            self._drop_stale()
+            return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, now=None):
+        '''Remove and return the earliest edge (func, args) if it is due, else None.'''
+        now = time.time() if now is None else now
+        with self._cond:
+            self._drop_stale()
+            if not self._heap or self._heap[0][0] > now:
+                return None
+            item = heapq.heappop(self._heap)
+            token = item[2]
+            token[0] -= 1
+            self._pending -= 1
+            if token[0] == 0 and self._tokens.get(item[3]) is token:
+                del self._tokens[item[3]]
+            return item[4], item[5]
+
+    def _is_live(self, item):
+        return self._tokens.get(item[3]) is item[2]
+
+    def _drop_stale(self):
+        while self._heap and not self._is_live(self._heap[0]):
+            heapq.heappop(self._heap)
+
+    def _compact(self):
+        # Rebuild once stale entries make up more than half of the heap so
+        # memory stays proportional to the live edges.
+        if len(self._heap) > 2*self._pending + 16:
+            self._heap = [item for item in self._heap if self._is_live(item)]
+            heapq.heapify(self._heap)
+
+
+class TaskScheduler(EdgeQueue, Thread):
+    '''One thread running every pending pump edge of an EdgeQueue.'''
+    def __init__(self, onResult=None, name="TaskScheduler"):
+        EdgeQueue.__init__(self)
+        Thread.__init__(self, name=name)
+        self.onResult   = onResult      # Called with the return value of each edge
+        self.daemon     = True
+        self._stopped   = False
+
+    def run(self):
+        while True:
+            with self._cond:
+                while not self._stopped:
+                    execTime = self.next_time()
+                    if execTime is None:
+                        self._cond.wait()
+                        continue
+                    secToExec = execTime - time.time()
+                    if secToExec <= 0:
+                        break
+                    self._cond.wait(secToExec)
+                if self._stopped:
+                    return
+                func, args = self.pop_due(float("inf"))
+            try:
+                result = func(*args)
+                if self.onResult is not None:
+                    self.onResult(result)
+            except Exception as e:
+                print("[Scheduler] Error in {}: {}".format(func.__name__, e))
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+
+    def isStopped(self):
+        return self._stopped
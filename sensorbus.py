@@ -0,0 +1,115 @@
+'''
+Reading of several FS1012 sensors spread over the ADS1115s of one I2C bus.
+
+Read one after another, every input costs a full conversion time
+(1/ADC_DATA_RATE, 7.8 ms at 128 SPS) during which the bus sits idle, so
+a reading of N sensors takes about 2N conversion times. SensorBus reads
+them in rounds instead: each round starts the next conversion on every
+ADS1115 (one short I2C write each), waits one conversion time and then
+collects the results. The ADS1115s convert at the same time, so a
+reading takes as many conversion times as the busiest ADS1115 has
+inputs to convert, whatever the number of ADS1115s.
+
+An ADS1115 with a single sensor in differential mode is left converting
+TP2 - TP1 continuously, and the readings without TP1/TP2 only fetch its
+last result. TP1 and TP2 are then converted every TP_REFRESH_SEC sec.
+
+snapshot() reads under the bus lock of the backend and hands out the
+FlowSamples of the sensors while they are younger than SNAPSHOT_MAX_AGE,
+so a reader that waited for the lock gets the reading just taken.
+'''
+import time
+from threading import RLock
+import settings
+from hardware import get_backend
+
+class _Device:
+    def __init__(self, ads1115, sensors):
+        self.ads1115    = ads1115
+        self.sensors    = sensors
+        # Continuous TP2 - TP1 of a single differential sensor.
+        self.continuous = len(sensors) == 1 and sensors[0].is_differential
+
+
+class SensorBus:
+    def __init__(self, sensors):
+        self.sensors    = sensors           # FS1012 list
+        byAddress = {}
+        for sensor in sensors:
+            if not sensor.check_status:
+                continue
+            byAddress.setdefault(sensor.address, []).append(sensor)
+        self.devices = [_Device(group[0].ads1115, group) for group in byAddress.values()]
+        # Without a working sensor the backend may not even load.
+        self.lock       = get_backend().busLock if self.devices else RLock()
+        self.nextTPRead = 0
+
+    def snapshot(self, maxAge=None):
+        '''
+        FlowSample of every sensor, from the last reading if all of them
+        are at most maxAge (default SNAPSHOT_MAX_AGE) sec old.
+        '''
+        maxAge = settings.SNAPSHOT_MAX_AGE if maxAge is None else maxAge
+        samples = self._fresh(maxAge)
+        if samples is not None:
+            return samples
+        with self.lock:
+            # Another reader may have read the sensors while this one waited.
+            samples = self._fresh(maxAge)
+            if samples is not None:
+                return samples
+            withTP = time.monotonic() >= self.nextTPRead
+            self.read(withTP)
+            if withTP:
+                self.nextTPRead = time.monotonic() + settings.TP_REFRESH_SEC
+            timeStamp, monotonic = time.time(), time.monotonic()
+            return [sensor.store_sample(timeStamp, monotonic) for sensor in self.sensors]
+
+    def _fresh(self, maxAge):
+        samples = [sensor.sample for sensor in self.sensors]
+        now = time.monotonic()
+        if all(sample is not None and now - sample.monotonic <= maxAge for sample in samples):
+            return samples
+        return None
+
+    def read(self, withTP=True):
+        '''
+        Convert the inputs of every working sensor once (see
+        FS1012.conversions), with the bus lock held by the caller. Returns
+        the number of rounds.
+        '''
+        queues = []
+        for device in self.devices:
+            conversions = [(sensor,) + conversion for sensor in device.sensors
+                           for conversion in sensor.conversions(withTP)]
+            ads1115 = device.ads1115
+            if (len(conversions) == 1 and device.continuous and ads1115.continuous
+                    and ads1115.mux == conversions[0][2:]):
+                sensor, key, _, _ = conversions[0]
+                sensor.set_code(key, ads1115.read_conversion())
+            elif conversions:
+                queues.append((device, conversions))
+
+        rounds = max([len(conversions) for _, conversions in queues] or [0])
+        for index in range(rounds):
+            started = []
+            readyAt = None
+            for device, conversions in queues:
+                if index >= len(conversions):
+                    continue
+                sensor, key, pin, negativePin = conversions[index]
+                if device.continuous and key == "diff":
+                    device.ads1115.start_continuous(pin, negativePin)
+                else:
+                    device.ads1115.start_conversion(pin, negativePin)
+                started.append((device, sensor, key))
+                if readyAt is None:
+                    readyAt = time.monotonic() + device.ads1115.conversion_time
+            # Wait for the first conversion; read_conversion waits for the
+            # rest of each later one and for the first result of continuous mode.
+            wait = readyAt - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            for device, sensor, key in started:
+                sensor.set_code(key, device.ads1115.read_conversion())
+        return rounds
@@ -16,6 +16,16 @@ PINK        = '#ff79c6'
 YELLOW      = '#f1fa8c'
 ORANGE      = '#ffb86c'
 
+# Maximum refresh rate (updates per second) of the sensor and pump panels.
+GUI_FPS     = 5
+
+# Flow rate chart (View > Flow Chart): size, default time span (sec) and
+# refresh rate. The span is limited by BUFFER_SEC.
+CHART_WIDTH     = 600
+CHART_HEIGHT    = 260
+CHART_SPAN_SEC  = 600
+CHART_FPS       = 1
+
 '''
 ##################################################################
 
@@ -26,13 +36,42 @@ CAL_PARAMS:
     For a n-dim params array (p), the flow rate equals:
     p[0]*x**n + p[1]*x**(n-1) + ... + p[n-2]*x + p[n-1] 
     where x is (TP2 - TP1) in current version. 
+    The polynomial is tabulated for every ADC code at startup.
+
+CAL_FILE:
+    Path of a calibration file written by calfit.py from reference flow
+    measurements, e.g. "calibration_1_20261018_09-30-00.json". When set,
+    its polynomial is used instead of CAL_PARAMS. None uses CAL_PARAMS.
+
+CAL_RELOAD_SEC:
+    Check the calibration file every n sec while the sensor runs and
+    use its new polynomial when it changed. A file that cannot be read
+    keeps the last good calibration. Set to 0 to disable.
 
 OUTPUT_SEC:
     Write the analog output and flow rate every n sec to csv file.
 
+SENSOR_SEC:
+    Read the flow sensor every n sec.
+
 ADC_ADDR:
     The ADS1115 I2C address. Default is 0x48.
 
+FLOW_SENSORS:
+    The FS1012 sensors of the headless controller, one dict each:
+    "name":         Label in the logs and the metrics.
+    "address":      I2C address of its ADS1115 (0x48, 0x49, 0x4A or 0x4B).
+    "tp1", "tp2":   ADS1115 inputs (0-3) of TP1 and TP2. In differential
+                    mode they must form one of the pairs 0-1, 0-3, 1-3, 2-3.
+    "calParams":    Calibration parameters or the path of a calibration
+                    file, or None for CAL_FILE / CAL_PARAMS.
+    "pumps":        Names of the pumps (see PUMP_CHANNELS) whose flow the
+                    sensor measures, or None for all of them.
+    The sensors are read together every SENSOR_SEC sec: one conversion is
+    started on every ADS1115 before the results are collected, so adding
+    an ADS1115 does not lengthen the reading. The flow rate of the log is
+    the sum of the sensors. The GUI reads TP1/TP2 on P0/P1 at ADC_ADDR.
+
 ADC_GAIN:
     The gain of ADS1115:
     GAIN    RANGE (V)
@@ -43,12 +82,137 @@ ADC_GAIN:
        4    +/- 1.024
        8    +/- 0.512
       16    +/- 0.256
+    Read when the ADS1115 is opened; the sensor converts and scales with
+    that gain until the program restarts.
+
+ADC_MODE:
+    "single":       TP1 (P0) and TP2 (P1) are read one after another in 
+                    single-shot mode and the flow rate uses their difference.
+    "differential": TP2 - TP1 is read in one conversion from the P0-P1 pair
+                    in continuous mode. TP1 and TP2 are still read every
+                    TP_REFRESH_SEC sec for the csv file.
+
+ADC_DATA_RATE:
+    Samples per second of the ADS1115 (one conversion takes 1/rate sec):
+    8, 16, 32, 64, 128, 250, 475, 860
+
+TP_REFRESH_SEC:
+    Read TP1 and TP2 every n sec in differential mode.
+
+FLOW_FILTERS:
+    Filters applied, in this order, to the flow rate of every reading of
+    each sensor, as (kind, {parameters}):
+    ("boxcar", {"n": 4})                Mean of the last n readings.
+    ("median", {"n": 5})                Median of the last n readings,
+                                        drops single spikes.
+    ("ema", {"tau": 2.0})               Exponential moving average with a
+                                        time constant of tau sec.
+    ("kalman", {"q": 20.0, "r": 4.0})   Kalman filter; q: how fast the flow
+                                        may drift (mlpm^2/sec), r: noise of
+                                        one reading (mlpm^2).
+    The filtered flow is used everywhere (display, logs, volumes, flow
+    control); the csv logs also keep the unfiltered one in Flow_Rate_Raw.
+    An empty list disables the filtering. The filters smooth the steps
+    too: keep their delay (about n/2 readings or tau) well below the
+    duration of the pump tasks.
+
+SNAPSHOT_MAX_AGE:
+    A sensor reading younger than n sec is shared with every caller of
+    FS1012.snapshot() instead of converting again. Keep it below
+    SENSOR_SEC.
+
+BUFFER_SEC:
+    Keep the flow sensor samples of the last n sec in memory.
+
+STAT_WINDOWS_SEC:
+    Windows (sec) of the rolling mean, min, max and std of the flow rate,
+    served on /status and /metrics (METRICS_PORT). Each window must be
+    shorter than BUFFER_SEC.
+
+LOG_FLUSH_SEC, LOG_FSYNC_SEC:
+    Flush the log file to the OS every n sec and force it to the SD card
+    (fsync) every n sec. The log is written on its own thread, so a slow
+    card does not delay the sensor reading.
+
+LOG_ROTATE_SEC:
+    Start a new log file at every n sec boundary (3600 = every hour).
+
+LOG_QUEUE_SIZE:
+    Rows waiting to be written. Rows are dropped when the queue is full.
+
+ASYNC_WORKERS:
+    Threads for the blocking I2C/GPIO calls in the asyncio runtime
+    (none_gui_main.py --asyncio).
+
+METRICS_HOST, METRICS_PORT:
+    Serve /metrics (Prometheus) and /status (JSON) of the headless
+    controller on this address. 0 disables the endpoint. Keep the host on
+    127.0.0.1 unless the network of the sampler is trusted.
+
+LOG_FORMAT:
+    "csv":      flow_log_*.csv text files.
+    "binary":   flow_log_*.bin fixed-width records with the raw ADC codes,
+                flow rate and pump states (see binlog.py). Convert them to
+                csv with: python3 binlog.py flow_log_*.bin
 
 '''
 CAL_PARAMS  = [11.32749266, 36.21084542, 13.66281863]   
+CAL_FILE    = None
+CAL_RELOAD_SEC  = 10
 OUTPUT_SEC  = 3
+SENSOR_SEC  = 0.5
 ADC_ADDR    = 0x48
 ADC_GAIN    = 1
+ADC_MODE    = "single"
+ADC_DATA_RATE   = 128
+TP_REFRESH_SEC  = 3
+SNAPSHOT_MAX_AGE    = 0.1
+FLOW_FILTERS    = []
+BUFFER_SEC      = 3600
+STAT_WINDOWS_SEC    = [5, 60, 600]
+LOG_FLUSH_SEC   = 10
+LOG_FSYNC_SEC   = 60
+LOG_ROTATE_SEC  = 3600
+LOG_QUEUE_SIZE  = 10000
+LOG_FORMAT      = "csv"
+ASYNC_WORKERS   = 2
+METRICS_HOST    = "127.0.0.1"
+METRICS_PORT    = 0
+FLOW_SENSORS    = [
+    {"name": "1", "address": ADC_ADDR, "tp1": 0, "tp2": 1, "calParams": None, "pumps": None},
+]
+
+'''
+##################################################################
+
+Hardware Backend
+
+HW_BACKEND:
+    "rpi":  Raspberry Pi GPIO and ADS1115.
+    "sim":  Simulated GPIO and ADS1115 for running without the hardware.
+    The AIR_SAMPLER_BACKEND environment variable overrides this setting.
+
+SIM_PUMP_FLOW, SIM_PUMP_TAU:
+    Flow (mlpm) of one running pump and its response time constant (sec)
+    in the simulation.
+
+SIM_PUMP_DEADBAND:
+    PWM duty (0-1) below which a simulated pump stalls.
+
+SIM_TP1_VOLT, SIM_ADC_NOISE:
+    Simulated TP1 level (V) and the ADC noise (std, in codes).
+
+SIM_I2C_LATENCY:
+    Simulated I2C transaction time (sec), added to every ADC read.
+
+'''
+HW_BACKEND      = "rpi"
+SIM_PUMP_FLOW   = 150
+SIM_PUMP_TAU    = 1.0
+SIM_PUMP_DEADBAND   = 0.2
+SIM_TP1_VOLT    = 0.5
+SIM_ADC_NOISE   = 2
+SIM_I2C_LATENCY = 0.001
 
 '''
 ##################################################################
@@ -65,9 +229,77 @@ INPA1, INPA2:
 INPB1, INPB2:
     GPIO pins that control the positive and negative pins of motor B.
 
+PUMP_CHANNELS:
+    The pumps of the headless controller, one dict each:
+    "name":         One letter or digit. Task files switch the pump with
+                    "pump" + name (e.g. "pumpC": true).
+    "in1", "in2":   GPIO pins of the positive and negative input of its
+                    driver. PWM is set on in1.
+    The GUI drives the pumps A and B on INPA1/INPA2 and INPB1/INPB2.
+
+SCHEDULE_OVERLAP:
+    Overlapping tasks on the same pump in a task file:
+    "merge":    The pump runs from the earliest start to the latest stop.
+    "reject":   The later task is skipped.
+    Tasks set in the GUI are never allowed to overlap.
+
+RECUR_HORIZON_SEC:
+    Tasks of the task file (including the repetitions of recurring tasks)
+    are set n sec ahead; later ones are set as the campaign goes on.
+
+TASK_RELOAD_SEC:
+    Check the task file of none_gui_main.py every n sec and apply the
+    changed tasks without restarting. Set to 0 to disable.
+
+JOURNAL_FILE:
+    Journal of the pump runs of none_gui_main.py. Runs interrupted by a
+    crash or reboot are resumed for their remaining duration on the next
+    start. Set to None to disable.
+
+JOURNAL_COMPACT_RECORDS:
+    Compact the journal to the open runs after n records.
+
+PWM_FREQ:
+    PWM frequency (Hz) on INPA1/INPB1 for tasks with a "targetFlow".
+
+PUMP_FULL_FLOW:
+    Approximate flow (mlpm) of one pump at 100 % duty, used as the
+    starting duty (feed-forward) of the flow control. Tasks with a
+    "targetFlow" above PUMP_FULL_FLOW times their number of pumps are
+    rejected.
+
+PID_KP, PID_KI, PID_KD:
+    Gains of the flow control: duty (%) per mlpm of error, per mlpm*sec
+    of integrated error and per mlpm/sec of flow change. The tracking
+    error is logged to flow_control_*.csv next to the flow log.
+
+PID_DUTY_MIN, PID_DUTY_MAX:
+    Limits (%) of the duty set by the flow control.
+
+TARGET_TOLERANCE:
+    In the task summary (task_summary.csv), the flow counts as under the
+    target when it is more than this fraction below the target flow.
+
 '''
 GPIO_MODE   = "BCM" 
 INPA1       = 17
 INPA2       = 27
 INPB1       = 23
 INPB2       = 24
+PUMP_CHANNELS   = [
+    {"name": "A", "in1": INPA1, "in2": INPA2},
+    {"name": "B", "in1": INPB1, "in2": INPB2},
+]
+SCHEDULE_OVERLAP    = "merge"
+RECUR_HORIZON_SEC   = 3600
+TASK_RELOAD_SEC     = 5
+JOURNAL_FILE        = "pump_journal.txt"
+JOURNAL_COMPACT_RECORDS = 10000
+PWM_FREQ            = 1000
+PUMP_FULL_FLOW      = 150
+PID_KP              = 0.2
+PID_KI              = 0.5
+PID_KD              = 0.0
+PID_DUTY_MIN        = 0
+PID_DUTY_MAX        = 100
+TARGET_TOLERANCE    = 0.05
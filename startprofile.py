@@ -0,0 +1,120 @@
+'''
+Startup profile (none_gui_main.py / main.py --profile-startup).
+
+enable() installs an import hook in front of sys.meta_path that times the
+execution of every module imported afterwards (inclusive and self time),
+so it has to run before the other imports of the script. mark() closes a
+named init phase and milestone() records the time from the process
+start to a point of interest, e.g. the first scheduled pump edge.
+report() lists the slow imports, the phases and the milestones.
+
+Everything is a no-op until enable() is called, so the marks can stay in
+the code.
+'''
+import os
+import sys
+import time
+
+_t0         = time.perf_counter()
+_enabled    = False
+_imports    = []        # [name, depth, inclusive sec, self sec] in import order
+_stack      = []        # [import entry, child sec] of the modules being executed
+_phases     = []        # (name, sec)
+_milestones = []        # (text, sec since the script start, sec since the process start or None)
+_lastMark   = _t0
+
+class _TimedLoader:
+    '''Wraps the loader of a module spec to time exec_module.'''
+    def __init__(self, loader):
+        self._loader = loader
+
+    def __getattr__(self, name):
+        return getattr(self._loader, name)
+
+    def create_module(self, spec):
+        return self._loader.create_module(spec)
+
+    def exec_module(self, module):
+        entry = [module.__name__, len(_stack), 0.0, 0.0]
+        _imports.append(entry)
+        _stack.append([entry, 0.0])
+        start = time.perf_counter()
+        try:
+            self._loader.exec_module(module)
+        finally:
+            elapsed = time.perf_counter() - start
+            _, children = _stack.pop()
+            entry[2] = elapsed
+            entry[3] = elapsed - children
+            if _stack:
+                _stack[-1][1] += elapsed
+
+
+class _ImportTimer:
+    '''Meta path finder that asks the other finders and wraps their loader.'''
+    def find_spec(self, name, path=None, target=None):
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, "find_spec"):
+                continue
+            spec = finder.find_spec(name, path, target)
+            if spec is not None:
+                if spec.loader is not None and hasattr(spec.loader, "exec_module"):
+                    spec.loader = _TimedLoader(spec.loader)
+                return spec
+        return None
+
+
+def enable():
+    global _enabled
+    if not _enabled:
+        _enabled = True
+        sys.meta_path.insert(0, _ImportTimer())
+
+def is_enabled():
+    return _enabled
+
+def mark(name):
+    '''End the init phase `name` (time since the previous mark).'''
+    global _lastMark
+    if not _enabled:
+        return
+    now = time.perf_counter()
+    _phases.append((name, now - _lastMark))
+    _lastMark = now
+
+def milestone(text):
+    if not _enabled:
+        return
+    age = process_age()
+    _milestones.append((text, time.perf_counter() - _t0, age))
+
+def process_age():
+    '''Seconds since the process started (Linux), or None.'''
+    try:
+        with open("/proc/self/stat") as file:
+            startTicks = int(file.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime") as file:
+            uptime = float(file.read().split()[0])
+        return uptime - startTicks/os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError):
+        return None
+
+def report(minMs=1.0):
+    '''Lines of the profile, listing the imports over minMs.'''
+    if not _enabled:
+        return []
+    lines = ["[Start ] Imports over {:.0f} ms (inclusive / self):".format(minMs)]
+    for name, depth, inclusive, selfTime in _imports:
+        if inclusive*1000 >= minMs:
+            lines.append("[Start ]   {:>8.1f} {:>8.1f} ms  {}{}".format(inclusive*1000, selfTime*1000, "  "*depth, name))
+    lines.append("[Start ] {} modules imported in {:.1f} ms.".format(
+        len(_imports), sum(entry[2] for entry in _imports if entry[1] == 0)*1000))
+    for name, sec in _phases:
+        lines.append("[Start ] {:<24} {:>8.1f} ms".format(name, sec*1000))
+    for text, elapsed, age in _milestones:
+        if age is not None:
+            lines.append("[Start ] {} {:.1f} ms after the process start ({:.1f} ms after the script start)."
+                         .format(text, age*1000, elapsed*1000))
+        else:
+            lines.append("[Start ] {} {:.1f} ms after the script start.".format(text, elapsed*1000))
+    return lines
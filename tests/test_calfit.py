@@ -0,0 +1,75 @@
+import datetime
+import json
+import numpy as np
+import pytest
+from calfit import TIME_FORMAT, calibrate, choose_fit, fit_polynomials, read_reference, segment_means
+from calibration import CAL_FILE_VERSION, load_calibration
+
+def test_segment_means():
+    times = np.array([5.0, 0.0, 1.0, 2.0, 3.0, 4.0])      # Unsorted
+    diffs = np.array([50.0, 0.0, 10.0, 20.0, 30.0, 40.0])
+    means, stds, counts = segment_means(times, diffs, np.array([1.0, 3.0, 10.0]), np.array([3.0, 5.0, 12.0]))
+    assert counts.tolist() == [3, 3, 0]
+    assert means[:2].tolist() == pytest.approx([20.0, 40.0])
+    assert stds[:2].tolist() == pytest.approx([np.std([10, 20, 30])]*2)
+    assert np.isnan(means[2])
+
+def test_fit_polynomials_recovers_quadratic():
+    x = np.linspace(0.0, 0.05, 12)
+    y = 20000*x*x + 1500*x + 3
+    fits = fit_polynomials(x, y, 3)
+    assert [fit[0] for fit in fits] == [1, 2, 3]
+    degree, params, residualStd, r2, rmse, maxError = fits[1]
+    assert params.tolist() == pytest.approx([20000, 1500, 3], rel=1e-6)
+    assert r2 == pytest.approx(1.0)
+    assert maxError < 1e-6
+    assert fits[0][2] > 1.0
+    assert choose_fit(fits)[0] == 2
+
+def test_fit_degree_limited_by_points():
+    x = np.array([0.0, 1.0, 2.0, 3.0])
+    assert [fit[0] for fit in fit_polynomials(x, 2*x + 1, 5)] == [1, 2]
+
+def test_choose_fit_needs_a_clear_gain():
+    fits = [(1, None, 1.0, 0.9, 0, 0), (2, None, 0.97, 0.9, 0, 0), (3, None, 0.5, 0.99, 0, 0)]
+    assert choose_fit(fits)[0] == 3
+    assert choose_fit(fits[:2])[0] == 1
+
+def test_calibrate_from_csv_log(tmp_path):
+    start = datetime.datetime(2026, 10, 18, 9, 0, 0)
+    stamp = lambda seconds: (start + datetime.timedelta(seconds=seconds)).strftime(TIME_FORMAT)
+    levels = [10.0, 20.0, 30.0, 40.0, 50.0]              # TP2 - TP1 (mV) of each measurement
+    log = tmp_path / "flow_log_test.csv"
+    lines = ["Time,TP1(mV),TP2(mV),Flow_Rate\n"]
+    for k, level in enumerate(levels):
+        for second in range(60):
+            # The first 10 sec settle from 0 mV.
+            lines.append("{},500.0,{},0\n".format(stamp(60*k + second), 500 + (0 if second < 10 else level)))
+    log.write_text("".join(lines))
+    reference = tmp_path / "reference.csv"
+    reference.write_text("start,end,flow\n" + "".join(
+        "{},{},{}\n".format(stamp(60*k), stamp(60*k + 59), 2000*level/1000 + 5) for k, level in enumerate(levels)))
+
+    calibration, fits = calibrate(read_reference(str(reference)), [str(log)], maxDegree=2, settle=10)
+    assert calibration["degree"] == 1
+    assert calibration["calParams"] == pytest.approx([2000, 5])
+    assert [point["readings"] for point in calibration["points"]] == [50]*5
+    assert calibration["version"] == CAL_FILE_VERSION
+
+    path = tmp_path / "calibration.json"
+    path.write_text(json.dumps(calibration))
+    assert load_calibration(str(path))["calParams"] == pytest.approx([2000, 5])
+
+def test_calibrate_needs_three_measurements(tmp_path):
+    log = tmp_path / "flow_log_test.csv"
+    log.write_text("Time,TP1(mV),TP2(mV),Flow_Rate\n")
+    with pytest.raises(ValueError):
+        calibrate([(0.0, 10.0, 1.0)], [str(log)])
+
+def test_bad_calibration_file(tmp_path):
+    path = tmp_path / "calibration.json"
+    path.write_text(json.dumps({"version": CAL_FILE_VERSION + 1, "calParams": [1, 0]}))
+    with pytest.raises(ValueError, match="version"):
+        load_calibration(str(path))
+    with pytest.raises(ValueError):
+        load_calibration(str(tmp_path / "missing.json"))
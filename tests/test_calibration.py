@@ -0,0 +1,63 @@
+import json
+import os
+import numpy as np
+import pytest
+from calibration import CAL_FILE_VERSION, CODE_MIN, FlowCalibration, code_to_volt
+
+def write_cal(path, calParams, mtime):
+    path.write_text(json.dumps({"version": CAL_FILE_VERSION, "calParams": calParams}))
+    os.utime(path, ns=(mtime, mtime))
+
+def test_table_built_once():
+    calibration = FlowCalibration([2.0, 1.0], gain=1)
+    table = calibration.table
+    assert calibration.table is table
+    assert calibration.lsb == code_to_volt(1)
+    assert calibration.flow(100) == pytest.approx(2.0*100*code_to_volt(1) + 1.0)
+    assert calibration.flow(-32768) == 0.0              # Clipped at 0
+    assert table[1000 - CODE_MIN] == pytest.approx(np.polyval([2.0, 1.0], 1000*code_to_volt(1)))
+
+def test_file_resolved_once_and_reloaded(tmp_path, monkeypatch):
+    path = tmp_path / "cal.json"
+    write_cal(path, [1.0, 0.0], 10**18)
+    calibration = FlowCalibration(str(path), gain=1, reloadSec=10)
+    table = calibration.table
+    stats = []
+    monkeypatch.setattr(os, "stat", lambda *args: stats.append(args) or pytest.fail("stat on a lookup"))
+    calibration.flow(100)
+    calibration.lsb
+    monkeypatch.undo()
+    write_cal(path, [2.0, 0.0], 2*10**18)
+    assert calibration.poll(100.0)                      # First poll checks the file
+    assert calibration.cal_params == [2.0, 0.0]
+    assert calibration.table is not table
+    assert calibration.flow(100) == pytest.approx(2*100*code_to_volt(1))
+    write_cal(path, [3.0, 0.0], 3*10**18)
+    assert not calibration.poll(105.0)                  # Not yet due
+    assert calibration.cal_params == [2.0, 0.0]
+    assert calibration.reload()
+    assert calibration.cal_params == [3.0, 0.0]
+    assert not calibration.reload()                     # Unchanged
+
+def test_broken_file_keeps_last_table(tmp_path, capsys):
+    path = tmp_path / "cal.json"
+    write_cal(path, [1.0, 5.0], 10**18)
+    calibration = FlowCalibration(str(path), gain=1)
+    table = calibration.table
+    path.write_text('{"version": 1, "calPar')        # Half written
+    os.utime(path, ns=(2*10**18, 2*10**18))
+    assert not calibration.reload()
+    path.unlink()
+    assert not calibration.poll(1000.0)
+    assert calibration.table is table
+    assert calibration.flow(0) == pytest.approx(5.0)
+    assert "keeping the last good calibration" in capsys.readouterr().out
+
+def test_missing_file_fails_at_construction(tmp_path):
+    with pytest.raises(ValueError):
+        FlowCalibration(str(tmp_path / "missing.json"))
+
+def test_poll_disabled_for_parameters():
+    calibration = FlowCalibration([1.0], gain=1, reloadSec=0)
+    assert not calibration.poll(1e9)
+    assert not calibration.reload()
@@ -0,0 +1,45 @@
+import pytest
+from filters import EMA, Boxcar, Kalman, Median, create_filters
+
+def test_boxcar_mean_of_window():
+    boxcar = Boxcar(3)
+    assert [boxcar.update(value, 0) for value in (3, 6, 9, 12)] == [3, 4.5, 6, 9]
+
+def test_median_removes_spike():
+    median = Median(3)
+    outputs = [median.update(value, 0) for value in (10, 10, 500, 10, 11)]
+    assert outputs == [10, 10, 10, 10, 11]
+
+def test_median_even_window():
+    median = Median(4)
+    assert [median.update(value, 0) for value in (1, 3)] == [1, 2]
+
+def test_ema_time_weighted():
+    ema = EMA(1.0)
+    assert ema.update(0.0, 0.0) == 0.0
+    assert ema.update(100.0, 1.0) == pytest.approx(100*(1 - 0.36787944117))
+    # A repeated timestamp does not move it.
+    assert ema.update(1000.0, 1.0) == pytest.approx(100*(1 - 0.36787944117))
+
+def test_kalman_converges():
+    kalman = Kalman(0.01, 4.0)
+    value = None
+    for k in range(200):
+        value = kalman.update(50.0 + (1 if k % 2 else -1), k*0.1)
+    assert value == pytest.approx(50, abs=0.5)
+
+def test_chain_in_order():
+    chain = create_filters([("median", {"n": 3}), ("boxcar", {"n": 2})])
+    outputs = [chain.update(value, 0) for value in (10, 500, 10, 10)]
+    assert outputs == [10, 132.5, 132.5, 10]
+
+def test_empty_spec():
+    assert create_filters([]) is None
+
+@pytest.mark.parametrize("spec", [
+    [("lowpass", {"n": 3})], [("boxcar", {"n": 0})], [("boxcar", {"n": 2.5})], [("boxcar", {"size": 3})],
+    [("ema", {"tau": 0})], [("kalman", {"q": 1, "r": -1})],
+])
+def test_invalid_spec(spec):
+    with pytest.raises(ValueError):
+        create_filters(spec)
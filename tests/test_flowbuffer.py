@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+from flowbuffer import FlowBuffer, FlowRow
+
+def fill(buffer, flows):
+    for seq, flow in enumerate(flows):
+        buffer.append(float(seq), flow/10, flow/5, flow, (seq, seq + 1, 1), flow + 1, (flow, 0.5))
+
+def test_wrap_around():
+    buffer = FlowBuffer(5, sensors=2)
+    assert buffer.latest() is None
+    fill(buffer, [float(value) for value in range(12)])
+    assert len(buffer) == 5
+    assert buffer.latest() == FlowRow(11.0, 1.1, 2.2, 11.0, (11, 12, 1), (11.0, 0.5), 12.0)
+    times, flows = buffer.last_columns(4, ("time", "flow"))
+    assert list(times) == [8.0, 9.0, 10.0, 11.0]
+    assert list(flows) == [8.0, 9.0, 10.0, 11.0]
+    # At most the capacity is kept.
+    assert list(buffer.last(10)) == [7.0, 8.0, 9.0, 10.0, 11.0]
+
+def test_defaults_of_append():
+    buffer = FlowBuffer(3, sensors=2)
+    buffer.append(1.0, 0.0, 0.0, 5.0)
+    assert buffer.latest() == FlowRow(1.0, 0.0, 0.0, 5.0, (0, 0, 0), (0.0, 0.0), 5.0)
+
+def test_window_stats_match_numpy():
+    rng = np.random.default_rng(1)
+    flows = rng.normal(100, 20, 2000)
+    flows[500:520] = 1e6            # A spike leaving the windows again
+    buffer = FlowBuffer(300, windows=(7, 64, 250))
+    assert buffer.windows == [7, 64, 250]
+    for seq, flow in enumerate(flows):
+        buffer.append(float(seq), 0.0, 0.0, float(flow))
+        if seq % 97 == 0 or seq in (6, 7, 1999):
+            stats = buffer.all_stats()
+            for size in buffer.windows:
+                window = flows[max(0, seq + 1 - size):seq + 1]
+                assert stats[size] == pytest.approx((window.mean(), window.min(), window.max(), window.std()),
+                                                    rel=1e-6, abs=1e-6)
+                assert buffer.stats(size) == stats[size]
+
+def test_window_must_fit():
+    with pytest.raises(ValueError):
+        FlowBuffer(10, windows=(10,))
@@ -0,0 +1,90 @@
+import pytest
+import settings
+from flowcontrol import PID, FlowController
+
+class Pumps:
+    def __init__(self):
+        self.duties = {}
+
+    def run_pwm(self, pump, duty):
+        self.duties[pump] = duty
+
+def test_pid_proportional_and_integral():
+    pid = PID(0.5, 1.0, 0.0, 0, 100)
+    pid.reset(10)
+    assert pid.update(20, 10, 0.1) == pytest.approx(0.5*10 + 10 + 1.0*10*0.1)
+    assert pid.integral == pytest.approx(11)
+
+def test_pid_clamp_and_anti_windup():
+    pid = PID(1.0, 1.0, 0.0, 0, 100)
+    pid.reset(100)
+    for _ in range(10):
+        assert pid.update(200, 0, 1.0) == 100
+    # The integral did not wind up while saturated, so it follows a lower setpoint at once.
+    assert pid.integral == 100
+    assert pid.update(0, 10, 1.0) < 100
+    pid.reset(0)
+    assert pid.update(0, 50, 1.0) == 0
+    assert pid.integral == 0
+
+def test_pid_derivative_on_measurement():
+    pid = PID(0.0, 0.0, 2.0, -100, 100)
+    pid.reset(0)
+    assert pid.update(50, 10, 1.0) == 0            # No kick on the first sample
+    assert pid.update(80, 15, 1.0) == pytest.approx(-10)
+
+def test_pid_reset_clamps_output():
+    pid = PID(1.0, 1.0, 0.0, 0, 100)
+    pid.reset(250)
+    assert pid.integral == 100
+
+def test_feed_forward_clamped():
+    controller = FlowController(Pumps())
+    assert controller.feed_forward(75, 1) == pytest.approx(50)
+    assert controller.feed_forward(75, 2) == pytest.approx(25)
+    assert controller.feed_forward(10*settings.PUMP_FULL_FLOW, 1) == settings.PID_DUTY_MAX
+    assert controller.feed_forward(0, 1) == settings.PID_DUTY_MIN
+
+def test_start_update_and_stop():
+    pumps = Pumps()
+    controller = FlowController(pumps)
+    controller.start(1, 60, ["A"])
+    assert pumps.duties == {"A": pytest.approx(40)}
+    controller.start(2, 30, ["B"])
+    assert pumps.duties == {"A": pytest.approx(10), "B": pytest.approx(10)}
+    controller.update(1000.0, 27.0)
+    controller.update(1000.5, 34.0)
+    n, rms, maxError = controller.stop(2)
+    assert (n, rms, maxError) == (2, pytest.approx(12.5**0.5), 4.0)
+    assert list(controller.targets) == [1]
+    assert (controller.targets[1].target, controller.targets[1].pumps, controller.targets[1].n) == (60, ("A",), 0)
+    assert controller.stop(1) == (0, 0.0, 0.0)
+    assert controller.targets == {}
+
+def test_stop_reapplies_duty():
+    pumps = Pumps()
+    controller = FlowController(pumps)
+    controller.start(1, 140, ["A"])
+    assert pumps.duties == {"A": pytest.approx(140/1.5)}
+    controller.start(2, 30, ["B"])
+    assert pumps.duties == {"A": pytest.approx(10), "B": pytest.approx(10)}
+    controller.stop(2)
+    # Task 1 sets the target again, with its feed-forward on its own pump.
+    assert controller.duty == pytest.approx(140/1.5)
+    assert pumps.duties["A"] == pytest.approx(140/1.5)
+
+def test_failed_start_leaves_no_target():
+    class BrokenPumps(Pumps):
+        def run_pwm(self, pump, duty):
+            raise RuntimeError("no PWM")
+    controller = FlowController(BrokenPumps())
+    with pytest.raises(RuntimeError):
+        controller.start(1, 50, ["A"])
+    assert controller.targets == {}
+
+def test_update_uses_sensors_of_task():
+    controller = FlowController(Pumps())
+    controller.start(1, 50, ["A"], sensors=[1])
+    controller.update(1000.0, 500.0, (450.0, 50.0))
+    n, rms, maxError = controller.stop(1)
+    assert (n, rms, maxError) == (1, 0.0, 0.0)
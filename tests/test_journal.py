@@ -0,0 +1,62 @@
+import datetime
+import pytest
+from journal import Journal, parse_run_id, run_id
+
+def run(start, stop, pumps="A", targetFlow=None, targetVolume=None):
+    return {"startTime": datetime.datetime.fromtimestamp(start), "stopTime": datetime.datetime.fromtimestamp(stop),
+            **{"pump" + pump: pump in pumps for pump in "AB"}, "targetFlow": targetFlow, "targetVolume": targetVolume}
+
+@pytest.mark.parametrize("pumps, targetFlow, targetVolume", [
+    ("A", None, None), ("B", None, None), ("AB", None, None), ("A", 100, None), ("AB", 85.5, None),
+    ("A", None, 25), ("A", 100, 12.25), ("A", 1e-05, None), ("A", None, 1e-05), ("AB", 1e-05, 1e-05),
+    ("AB", 100000.5, 100000.5), ("B", 1/3, 2e20), ("A", 1e-300, 1/7),
+])
+def test_run_id_round_trip(pumps, targetFlow, targetVolume):
+    runId = run_id(run(1672444800, 1672445400, pumps, targetFlow, targetVolume))
+    assert " " not in runId
+    assert parse_run_id(runId) == (1672444800.0, 1672445400.0, tuple(pumps), targetFlow, targetVolume)
+
+def test_parse_old_format():
+    assert parse_run_id("1672444800-1672445400-A-100.000-v25.000") == (1672444800.0, 1672445400.0, ("A",), 100.0, 25.0)
+    assert parse_run_id("1672444800-1672445400-A-100") == (1672444800.0, 1672445400.0, ("A",), 100.0, None)
+
+@pytest.mark.parametrize("runId", ["", "1672444800", "1672444800-x-A", "1672444800-1672445400-",
+                                   "1672444800-1672445400-A-100v25", "1672444800-1672445400-A-v",
+                                   "1672444800-1672445400-A-x"])
+def test_parse_invalid(runId):
+    with pytest.raises(ValueError):
+        parse_run_id(runId)
+
+def test_replay(tmp_path):
+    path = str(tmp_path / "journal.txt")
+    now = 1672444800.0
+    future = run_id(run(now + 100, now + 200))
+    resumed = run_id(run(now - 50, now + 50, "B", targetFlow=1e-05))
+    ended = run_id(run(now - 40, now + 50, "A"))
+    lost = run_id(run(now - 200, now - 100, "A"))
+    volume = run_id(run(now - 50, now + 50, "A", targetVolume=25))
+    journal = Journal(path)
+    journal.scheduled([future, resumed, ended, lost, volume])
+    journal.started(resumed, now - 50)
+    journal.started(ended, now - 40)
+    journal.stopped(ended, now - 10, 12.5)
+    journal.started(volume, now - 50)
+    journal.close()
+    with open(path, "a") as file:
+        file.write("S " + future[:5])      # Torn last line
+
+    journal = Journal(path)
+    resume, lostIds, records = journal.replay(now=now)
+    journal.close()
+    assert records == 9
+    # The volume pumped before the restart is unknown.
+    assert sorted(lostIds) == sorted([lost, volume])
+    assert [item["journalId"] for item in resume] == [resumed]
+    item = resume[0]
+    assert item["startTime"] == datetime.datetime.fromtimestamp(now)
+    assert item["stopTime"] == datetime.datetime.fromtimestamp(now + 50)
+    assert (item["pumpA"], item["pumpB"], item["targetFlow"]) == (False, True, 1e-05)
+
+    # Compacted to the resumed run.
+    with open(path) as file:
+        assert file.read().split("\n") == ["R " + resumed, "S {} {:.3f}".format(resumed, now - 50), ""]
@@ -0,0 +1,69 @@
+import datetime
+import numpy as np
+import pytest
+from logstats import analyse, find_logs, read_tasks, summary_rows
+
+START = datetime.datetime(2026, 10, 18, 9, 30, 0)
+
+def stamp(seconds):
+    return (START + datetime.timedelta(seconds=seconds)).strftime("%Y-%m-%d %H:%M:%S")
+
+def write_log(path, rows):
+    path.write_text("Time,TP1(mV),TP2(mV),Flow_Rate,Flow_Rate_Raw\n" + "".join(
+        "{},500.0,{},{},{}\n".format(stamp(seconds), 500 + flow/10, flow, flow) for seconds, flow in rows))
+
+@pytest.fixture
+def archive(tmp_path):
+    # 09:30 to 10:30 at 60 mlpm every 3 sec, with a 60 sec hole in the second file.
+    write_log(tmp_path / "flow_log_1.csv", [(seconds, 60.0) for seconds in range(0, 1800, 3)])
+    write_log(tmp_path / "flow_log_2.csv", [(seconds, 60.0) for seconds in range(1800, 3603, 3) if not 2400 < seconds < 2460])
+    (tmp_path / "flow_log_3.csv").write_text("not a log\n")
+    (tmp_path / "task_summary.csv").write_text(
+        "Task,Start,Stop,Duration(s),Volume(ml)\n"
+        "1,{},{},600,60\n2,{},{},600,60\n".format(stamp(1500), stamp(2100), stamp(4000), stamp(4600)))
+    return tmp_path
+
+def run(archive, workers, calParams=None):
+    logs, summaries = find_logs([str(archive)])
+    tasks = read_tasks(summaries)
+    return tasks, analyse(logs, tasks, calParams=calParams, gapSec=9, workers=workers)
+
+def test_hours_and_total(archive):
+    tasks, (hours, taskStats, total, errors) = run(archive, 1)
+    assert len(errors) == 1 and errors[0][0].endswith("flow_log_3.csv")
+    assert len(hours) == 2
+    first, second = (hours[key] for key in sorted(hours))
+    assert first.samples == 600
+    # Each file is integrated on its own: 1797 sec at 1 ml/sec.
+    assert first.volume == pytest.approx(1797)
+    assert (second.gaps, second.gapSec) == (1, 60)
+    assert total.samples == first.samples + second.samples
+    assert total.volume == pytest.approx(1797 + 1800 - 60)
+    assert (total.minFlow, total.maxFlow) == (60.0, 60.0)
+
+def test_tasks(archive):
+    tasks, (hours, taskStats, total, errors) = run(archive, 1)
+    assert tasks[0] == ["1", "2"]
+    # Task 2 starts after the logs end.
+    assert list(taskStats) == [0]
+    assert taskStats[0].samples == 201
+    assert taskStats[0].volume == pytest.approx(297 + 300)
+    header, rows = summary_rows(hours, tasks, taskStats, total)
+    assert [row[0] for row in rows] == ["2026-10-18 09:00", "2026-10-18 10:00", "Task 1", "Total"]
+    assert len(header) == len(rows[0])
+
+def test_workers_give_the_same_result(archive):
+    _, serial = run(archive, 1)
+    tasks, parallel = run(archive, 2)
+    assert summary_rows(*[parallel[0], tasks, parallel[1], parallel[2]]) == \
+        summary_rows(*[serial[0], tasks, serial[1], serial[2]])
+
+def test_recalibrated_volume(archive):
+    # TP2 - TP1 is 6 mV, which 2000 mlpm per V turns into 12 mlpm.
+    tasks, (hours, taskStats, total, errors) = run(archive, 1, calParams=[2000.0, 0.0])
+    assert total.total/total.samples == pytest.approx(12.0)
+    assert total.loggedVolume == pytest.approx(1797 + 1800 - 60)
+    assert total.volume == pytest.approx(total.loggedVolume/5)
+    header, rows = summary_rows(hours, tasks, taskStats, total, recalibrated=True)
+    assert header[-1] == "Logged_Volume(ml)"
+    assert rows[-1][-1] == "{:.3f}".format(total.loggedVolume)
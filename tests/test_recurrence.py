@@ -0,0 +1,51 @@
+import datetime
+import pytest
+from recurrence import TaskStream, expand_task
+
+START = datetime.datetime(2026, 10, 19, 0, 0, 0)        # A Monday
+
+def recurring(**repeat):
+    return {"startTime": START.strftime("%Y-%m-%d %H:%M:%S"), "duration": 10, "durationUnit": "min",
+            "pumpA": True, "repeat": repeat}
+
+def test_count():
+    occurrences = list(expand_task(recurring(every=2, everyUnit="hr", count=3), "0", after=START))
+    assert [start for start, _, _ in occurrences] == [START + datetime.timedelta(hours=2*k) for k in range(3)]
+    start, stop, taskDict = occurrences[1]
+    assert stop - start == datetime.timedelta(minutes=10)
+    assert taskDict["name"] == "0#1"
+    assert "repeat" not in taskDict
+
+def test_past_repetitions_are_skipped():
+    after = START + datetime.timedelta(hours=3)
+    occurrences = list(expand_task(recurring(every=2, everyUnit="hr", count=3), "0", after=after))
+    assert [taskDict["name"] for _, _, taskDict in occurrences] == ["0#2"]
+
+def test_until():
+    until = (START + datetime.timedelta(hours=5)).strftime("%Y-%m-%d %H:%M:%S")
+    occurrences = list(expand_task(recurring(every=1, everyUnit="hr", until=until), "0", after=START))
+    assert len(occurrences) == 6
+
+def test_weekdays_and_hours():
+    rule = recurring(every=1, everyUnit="hr", count=24*14, weekdays=["Sat", "Sun"], hours=[8, 20])
+    starts = [start for start, _, _ in expand_task(rule, "0", after=START)]
+    assert len(starts) == 8
+    assert all(start.weekday() >= 5 and start.hour in (8, 20) for start in starts)
+
+def test_invalid_rules():
+    with pytest.raises(ValueError):
+        expand_task(recurring(every=1, everyUnit="hr"), "0")
+    with pytest.raises(ValueError):
+        expand_task(recurring(every=1, everyUnit="hr", count=2, weekdays=["someday"]), "0")
+
+def test_stream_batches():
+    oneOff = {"startTime": (START + datetime.timedelta(minutes=30)).strftime("%Y-%m-%d %H:%M:%S"),
+              "duration": 5, "durationUnit": "min", "pumpB": True}
+    stream = TaskStream([recurring(every=1, everyUnit="hr", count=3), oneOff, recurring(every=1, everyUnit="hr")],
+                        after=START)
+    assert stream.errors and stream.errors[0][0] == 2
+    batch = stream.take(START + datetime.timedelta(minutes=45))
+    assert [taskDict["name"] for taskDict in batch] == ["0#0", "1"]
+    assert not stream.exhausted
+    assert [taskDict["name"] for taskDict in stream.take(START + datetime.timedelta(hours=5))] == ["0#1", "0#2"]
+    assert stream.exhausted
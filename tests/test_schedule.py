@@ -0,0 +1,82 @@
+import datetime
+import pytest
+import settings
+from schedule import compile_tasks, parse_task
+
+NOW = datetime.datetime(2026, 10, 18, 9, 0, 0)
+
+def task(offset, duration, pumps="A", **extra):
+    taskDict = {"startTime": (NOW + datetime.timedelta(seconds=offset)).strftime("%Y-%m-%d %H:%M:%S"),
+                "duration": duration, "durationUnit": "sec"}
+    taskDict.update({"pump" + pump: pump in pumps for pump in "AB"})
+    taskDict.update(extra)
+    return taskDict
+
+def test_overlapping_tasks_are_merged():
+    schedule = compile_tasks([task(10, 20), task(20, 30, targetFlow=80), task(100, 10)], now=NOW, overlap="merge")
+    assert schedule.errors == []
+    assert schedule.conflicts == [("pumpA", 0, 1)]
+    assert len(schedule.runs) == 2
+    run = schedule.runs[0]
+    assert run["startTime"] == NOW + datetime.timedelta(seconds=10)
+    assert run["stopTime"] == NOW + datetime.timedelta(seconds=50)
+    assert run["tasks"] == [0, 1]
+    assert run["targetFlow"] == 80
+    assert len(schedule.edges()) == 4
+
+def test_touching_tasks_are_merged():
+    schedule = compile_tasks([task(10, 10), task(20, 10)], now=NOW)
+    assert [run["tasks"] for run in schedule.runs] == [[0, 1]]
+    assert schedule.conflicts == []
+
+def test_runs_of_both_pumps_are_combined():
+    schedule = compile_tasks([task(10, 10, pumps="A"), task(10, 10, pumps="B")], now=NOW)
+    assert len(schedule.runs) == 1
+    assert (schedule.runs[0]["pumpA"], schedule.runs[0]["pumpB"]) == (True, True)
+
+def test_overlapping_task_is_rejected():
+    schedule = compile_tasks([task(10, 20), task(20, 30), task(20, 30, pumps="B")], now=NOW, overlap="reject")
+    assert schedule.errors == [(1, "overlaps task 0 on pumpA")]
+    assert [run["tasks"] for run in schedule.runs] == [[0], [2]]
+
+def test_invalid_and_past_tasks_are_skipped():
+    schedule = compile_tasks([task(-10, 20), task(10, 0), {"startTime": "tomorrow"}, task(10, 5, pumps="")],
+                             now=NOW)
+    assert [index for index, _ in schedule.errors] == [0, 1, 2, 3]
+    assert schedule.errors[0][1] == "start time is in the past"
+    assert schedule.runs == []
+
+def test_invalid_overlap_mode():
+    with pytest.raises(ValueError):
+        compile_tasks([], now=NOW, overlap="ignore")
+
+def test_merged_run_has_no_target_volume():
+    schedule = compile_tasks([task(10, 60, targetVolume=25), task(30, 60)], now=NOW)
+    assert schedule.runs[0]["targetVolume"] is None
+
+def test_target_volume_kept_by_a_single_task():
+    schedule = compile_tasks([task(10, 60, pumps="AB", targetVolume=25), task(100, 10, targetVolume=5)], now=NOW)
+    assert [run["targetVolume"] for run in schedule.runs] == [25, 5]
+
+def test_target_flow_above_full_flow_is_rejected():
+    assert settings.PUMP_FULL_FLOW == 150
+    with pytest.raises(ValueError, match="PUMP_FULL_FLOW"):
+        parse_task(task(10, 20, targetFlow=200))
+    # Two pumps can give up to twice PUMP_FULL_FLOW.
+    assert parse_task(task(10, 20, pumps="AB", targetFlow=200))[3] == 200
+    schedule = compile_tasks([task(10, 20, targetFlow=200)], now=NOW)
+    assert schedule.runs == []
+    assert "PUMP_FULL_FLOW" in schedule.errors[0][1]
+
+def test_target_volume_dropped_on_shared_sensor():
+    # Both pumps are measured by the one default sensor.
+    schedule = compile_tasks([task(10, 60, targetVolume=25), task(20, 30, pumps="B")], now=NOW)
+    assert [run["targetVolume"] for run in schedule.runs] == [None, None]
+    assert len(schedule.warnings) == 1
+    assert schedule.warnings[0][0] == "0"
+    assert "same flow sensor" in schedule.warnings[0][1]
+
+def test_target_volume_kept_without_overlap():
+    schedule = compile_tasks([task(10, 60, targetVolume=25), task(70, 30, pumps="B")], now=NOW)
+    assert [run["targetVolume"] for run in schedule.runs] == [25, None]
+    assert schedule.warnings == []
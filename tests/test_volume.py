@@ -0,0 +1,102 @@
+import pytest
+import settings
+from volume import VolumeIntegrator, VolumeTracker, format_summary, shares_sensor, write_summary, SUMMARY_HEADER
+
+def test_trapezoid_volume_and_hold():
+    integrator = VolumeIntegrator(100.0, targetFlow=60)
+    for timeStamp, flow in ((100.0, 60.0), (130.0, 0.0), (160.0, 60.0)):
+        integrator.add(timeStamp, flow)
+    summary = integrator.finish(220.0)
+    # 15 ml down, 15 ml up and 60 ml held to the stop.
+    assert summary["volume"] == pytest.approx(90)
+    assert summary["meanFlow"] == pytest.approx(45)
+    assert (summary["minFlow"], summary["maxFlow"], summary["samples"]) == (0.0, 60.0, 3)
+    assert summary["underTarget"] == pytest.approx(30/120)
+
+def test_samples_before_start_are_ignored():
+    integrator = VolumeIntegrator(100.0)
+    assert integrator.add(90.0, 1000.0) is False
+    summary = integrator.finish(120.0)
+    assert (summary["volume"], summary["samples"], summary["underTarget"]) == (0.0, 0, None)
+
+def test_target_volume_reached_once():
+    integrator = VolumeIntegrator(0.0, targetVolume=10)
+    step = settings.SENSOR_SEC
+    volumes = []
+    for k in range(int(20/step)):
+        if integrator.add(k*step, 60.0):
+            volumes.append(integrator.volume)
+    # Reached once, within half a sensor period of the target.
+    assert len(volumes) == 1
+    assert volumes[0] == pytest.approx(10, abs=60*step/120 + 1e-9)
+    assert integrator.finish(20.0)["reached"] is True
+
+def test_tracker_reports_reached_tasks():
+    tracker = VolumeTracker()
+    tracker.start(1, startTime=0.0, targetVolume=1, sensors=[0])
+    tracker.start(2, startTime=0.0, sensors=[1])
+    assert tracker.update(0.0, 60.0) == []
+    assert tracker.update(1.0, 60.0) == [1]
+    assert tracker.update(2.0, 60.0) == []
+
+def test_tracker_writes_summaries(tmp_path):
+    tracker = VolumeTracker()
+    tracker.summaryDir = str(tmp_path)
+    tracker.start("a", startTime=0.0, targetFlow=50, sensors=[0])
+    tracker.start("b", startTime=30.0, sensors=[1])
+    tracker.update(0.0, 60.0)
+    tracker.update(60.0, 60.0)
+    summaries = [tracker.stop(taskId, stopTime=60.0) for taskId in ("a", "b")]
+    assert [summary["volume"] for summary in summaries] == [pytest.approx(60), pytest.approx(0)]
+    assert format_summary(summaries[0]).endswith("max 60.0 mlpm, 0.0 % under target.")
+    assert tracker.stop("a") is None
+    with open(tmp_path / "task_summary.csv") as file:
+        lines = file.readlines()
+    assert lines[0] == SUMMARY_HEADER
+    assert [line.split(",")[0] for line in lines[1:]] == ["a", "b"]
+
+def test_shares_sensor():
+    assert shares_sensor(None, [0])
+    assert shares_sensor([0, 1], [1])
+    assert not shares_sensor([0], [1])
+    assert not shares_sensor([], None)
+
+def test_tracker_drops_shared_target_volume(capsys):
+    tracker = VolumeTracker()
+    tracker.start(1, startTime=0.0, targetVolume=50, sensors=[0])
+    tracker.start(2, startTime=10.0, sensors=[1])
+    tracker.start(3, startTime=20.0, sensors=[0])
+    assert "Task 1 shares its flow sensor" in capsys.readouterr().out
+    tracker.update(30.0, 90.0, (30.0, 60.0))
+    tracker.update(90.0, 90.0, (30.0, 60.0))
+    summary = tracker.stop(1, stopTime=90.0)
+    assert summary["targetVolume"] is None
+    assert summary["sharedWith"] == [3]
+    assert summary["volume"] == pytest.approx(30)
+    assert tracker.stop(2, stopTime=90.0)["sharedWith"] == []
+    assert tracker.stop(3, stopTime=90.0)["sharedWith"] == [1]
+    assert tracker.stop(3) is None
+
+def test_summary_of_shared_task_counts_each_task_once(tmp_path):
+    tracker = VolumeTracker()
+    tracker.summaryDir = str(tmp_path)
+    tracker.start("a", startTime=0.0, sensors=[0])
+    tracker.start("b", startTime=0.0, sensors=[0])
+    tracker.update(0.0, 60.0, (60.0,))
+    tracker.update(60.0, 60.0, (60.0,))
+    summaries = [tracker.stop(taskId, stopTime=60.0) for taskId in ("a", "b")]
+    assert format_summary(summaries[0]).endswith("includes the flow of task b (shared sensor).")
+    with open(tmp_path / "task_summary.csv") as file:
+        lines = file.readlines()
+    assert lines[0] == SUMMARY_HEADER
+    assert [line.rstrip("\n").split(",")[-1] for line in lines[1:]] == ["b", "a"]
+
+def test_old_summary_file_is_moved_aside(tmp_path):
+    path = tmp_path / "task_summary.csv"
+    path.write_text("Task,Start,Stop\n1,x,y\n")
+    integrator = VolumeIntegrator(0.0)
+    summary = integrator.finish(10.0)
+    summary["task"] = 1
+    write_summary(str(path), summary)
+    assert path.read_text().startswith(SUMMARY_HEADER)
+    assert len(list(tmp_path.iterdir())) == 2
@@ -0,0 +1,200 @@
+'''
+Sampled volume of each pump task.
+
+VolumeTracker integrates the flow rate of every running task as the
+samples arrive (trapezoidal rule on the sample timestamps). Each sample
+costs O(1) per running task. The flow is held at the last sample up to
+the stop time. When a task stops, its summary is appended to
+task_summary.csv in the log directory:
+
+    Task, Start, Stop, Duration(s), Volume(ml), Mean_Flow, Min_Flow,
+    Max_Flow, Target_Flow, Under_Target(%), Target_Volume(ml), Samples,
+    Shared_With
+
+The flow is in mlpm. Under_Target is the fraction of the sampled time
+with the flow more than TARGET_TOLERANCE below the target flow. It is
+empty for tasks without a target.
+
+With several flow sensors (FLOW_SENSORS), a task integrates the sum of
+the sensors that measure its pumps. A sensor shared with another task
+running at the same time measures the flow of both, so such a task loses
+its target volume and its summary names the tasks it shared with
+(Shared_With); its volume is then an upper bound.
+
+A task with a target volume is reported by update() as soon as its
+volume is within half a sensor period of the target at the current flow,
+so the pumps stop at the sample closest to the target rather than one
+period after it.
+'''
+import os
+import time, datetime
+from threading import Lock
+import settings
+
+SUMMARY_FILE = "task_summary.csv"
+SUMMARY_HEADER = ("Task,Start,Stop,Duration(s),Volume(ml),Mean_Flow(mlpm),Min_Flow(mlpm),"
+                  "Max_Flow(mlpm),Target_Flow(mlpm),Under_Target(%),Target_Volume(ml),Samples,Shared_With\n")
+
+class VolumeIntegrator:
+    '''Running volume, min/max and time under target of one task.'''
+    def __init__(self, startTime, targetFlow=None, targetVolume=None, sensors=None):
+        self.startTime     = startTime
+        self.sensors       = sensors     # Indices of the sensors to sum, or None for the total flow
+        self.targetFlow    = targetFlow
+        self.targetVolume  = targetVolume
+        self.reached       = False
+        self.lastTime      = None
+        self.lastFlow      = 0.0
+        self.volume        = 0.0         # ml
+        self.sampledSec    = 0.0
+        self.underSec      = 0.0
+        self.minFlow       = float("inf")
+        self.maxFlow       = float("-inf")
+        self.samples       = 0
+        self.sharedWith    = set()      # Tasks measured by the same sensors at the same time
+
+    def add(self, timeStamp, flowRate):
+        '''Add one sample. Returns True once, when the target volume is reached.'''
+        if timeStamp < self.startTime:
+            return False
+        if self.lastTime is not None:
+            self._integrate(timeStamp, (self.lastFlow + flowRate)/2, flowRate)
+        self.lastTime = timeStamp
+        self.lastFlow = flowRate
+        self.samples += 1
+        if flowRate < self.minFlow:
+            self.minFlow = flowRate
+        if flowRate > self.maxFlow:
+            self.maxFlow = flowRate
+        if self.targetVolume is None or self.reached:
+            return False
+        self.reached = self.targetVolume - self.volume <= flowRate*settings.SENSOR_SEC/120
+        return self.reached
+
+    def _integrate(self, timeStamp, meanFlow, endFlow):
+        dt = timeStamp - self.lastTime
+        self.volume += meanFlow*dt/60
+        self.sampledSec += dt
+        if self.targetFlow is not None and endFlow < self.targetFlow*(1 - settings.TARGET_TOLERANCE):
+            self.underSec += dt
+
+    def finish(self, stopTime):
+        '''Hold the last flow up to stopTime and return the summary dict.'''
+        if self.lastTime is not None and stopTime > self.lastTime:
+            self._integrate(stopTime, self.lastFlow, self.lastFlow)
+            self.lastTime = stopTime
+        return {
+            "start":        self.startTime,
+            "stop":         stopTime,
+            "duration":     stopTime - self.startTime,
+            "volume":       self.volume,
+            "meanFlow":     self.volume*60/self.sampledSec if self.sampledSec > 0 else 0.0,
+            "minFlow":      self.minFlow if self.samples else 0.0,
+            "maxFlow":      self.maxFlow if self.samples else 0.0,
+            "targetFlow":   self.targetFlow,
+            "underTarget":  self.underSec/self.sampledSec if self.targetFlow is not None and self.sampledSec > 0 else None,
+            "targetVolume": self.targetVolume,
+            "reached":      self.reached,
+            "samples":      self.samples,
+            "sharedWith":   sorted(self.sharedWith, key=str),
+        }
+
+
+class VolumeTracker:
+    '''
+    Volume integrators of the running tasks, keyed by the task ids of
+    MotorHandler.pumpTasks / MotorFrame.pumpTasks. update() is called from
+    the sensor thread, start() and stop() from the pump edges.
+    '''
+    def __init__(self):
+        self.running    = {}
+        self.summaryDir = None          # Directory of task_summary.csv, or None
+        self._lock      = Lock()
+
+    def start(self, taskId, startTime=None, targetFlow=None, targetVolume=None, sensors=None):
+        integrator = VolumeIntegrator(time.time() if startTime is None else startTime,
+                                      targetFlow, targetVolume, sensors)
+        with self._lock:
+            for otherId, other in self.running.items():
+                if not shares_sensor(integrator.sensors, other.sensors):
+                    continue
+                integrator.sharedWith.add(otherId)
+                other.sharedWith.add(taskId)
+                for task, tracked in ((taskId, integrator), (otherId, other)):
+                    if tracked.targetVolume is not None and not tracked.reached:
+                        print("[Volume] Task {} shares its flow sensor with a running task, "
+                              "its target volume is dropped.".format(task))
+                        tracked.targetVolume = None
+            self.running[taskId] = integrator
+
+    def update(self, timeStamp, flowRate, flowRates=None):
+        '''
+        Add one sample (total flow, flow of each sensor) to every running
+        task. Returns the ids of the tasks that reached their target volume.
+        '''
+        reached = []
+        with self._lock:
+            for taskId, integrator in self.running.items():
+                flow = flowRate
+                if integrator.sensors is not None and flowRates is not None:
+                    flow = sum(flowRates[index] for index in integrator.sensors)
+                if integrator.add(timeStamp, flow):
+                    reached.append(taskId)
+        return reached
+
+    def stop(self, taskId, stopTime=None):
+        '''Finish taskId, append its summary to the summary file and return it (None if not running).'''
+        with self._lock:
+            integrator = self.running.pop(taskId, None)
+        if integrator is None:
+            return None
+        summary = integrator.finish(time.time() if stopTime is None else stopTime)
+        summary["task"] = taskId
+        if self.summaryDir is not None:
+            try:
+                write_summary(os.path.join(self.summaryDir, SUMMARY_FILE), summary)
+            except OSError as e:
+                print("[Volume] Cannot write the task summary: {}".format(e))
+        return summary
+
+
+def shares_sensor(sensors, otherSensors):
+    '''True if two tasks measured on these sensor indices (None: all) share a sensor.'''
+    if sensors == [] or otherSensors == []:
+        return False
+    return sensors is None or otherSensors is None or bool(set(sensors) & set(otherSensors))
+
+def format_summary(summary):
+    target = ""
+    if summary["targetVolume"] is not None:
+        target = ", target {:g} ml {}".format(summary["targetVolume"], "reached" if summary["reached"] else "NOT reached")
+    shared = ""
+    if summary.get("sharedWith"):
+        shared = ", includes the flow of task {} (shared sensor)".format(",".join(map(str, summary["sharedWith"])))
+    return "[Volume] Task {task}: {volume:.1f} ml in {duration:.0f} s, flow mean {meanFlow:.1f} / min {minFlow:.1f} / max {maxFlow:.1f} mlpm{under}{target}{shared}.".format(
+        under="" if summary["underTarget"] is None else ", {:.1f} % under target".format(summary["underTarget"]*100),
+        target=target, shared=shared, **summary)
+
+def write_summary(path, summary):
+    newFile = not os.path.exists(path)
+    if not newFile:
+        with open(path) as file:
+            header = file.readline()
+        if header != SUMMARY_HEADER:
+            # Written with other columns: keep it aside and start a new file.
+            root, ext = os.path.splitext(path)
+            os.replace(path, "{}_{}{}".format(root, datetime.datetime.now().strftime("%Y%m%d_%H-%M-%S"), ext))
+            newFile = True
+    timeFormat = "%Y-%m-%d %H:%M:%S"
+    with open(path, "a") as file:
+        if newFile:
+            file.write(SUMMARY_HEADER)
+        file.write("{},{},{},{:.1f},{:.3f},{:.2f},{:.2f},{:.2f},{},{},{},{},{}\n".format(
+            summary["task"],
+            datetime.datetime.fromtimestamp(summary["start"]).strftime(timeFormat),
+            datetime.datetime.fromtimestamp(summary["stop"]).strftime(timeFormat),
+            summary["duration"], summary["volume"], summary["meanFlow"], summary["minFlow"], summary["maxFlow"],
+            "" if summary["targetFlow"] is None else summary["targetFlow"],
+            "" if summary["underTarget"] is None else "{:.1f}".format(summary["underTarget"]*100),
+            "" if summary["targetVolume"] is None else summary["targetVolume"],
+            summary["samples"], " ".join(map(str, summary.get("sharedWith", ())))))